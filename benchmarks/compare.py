@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+#
+# This software may be modified and distributed under the terms
+# of the MIT license.  See the LICENSE file for details.
+
+"""Compare two result files of benchmarks.e2e and exit with status 1 on regressions.
+
+A scenario regressed if its throughput dropped or its CPU time per event grew by more than
+the tolerance, if its p99 emit latency grew by more than the (larger) latency tolerance, or if
+a reliable transport (TCP, TLS, Unix socket) lost or duplicated events. Memory growth is
+reported but not checked, it is too noisy for short runs.
+
+Usage: python -m benchmarks.compare baseline.json current.json [--tolerance 0.15]
+                                    [--latency-tolerance 0.5]
+"""
+
+from __future__ import print_function
+
+import argparse
+import json
+import sys
+
+from .e2e import is_incomplete
+
+
+# (label, function returning the value of a result, True if higher values are better,
+#  True if checked with the latency tolerance)
+METRICS = (
+    ('events/s', lambda result: result['events_per_second'], True, False),
+    ('p99 us', lambda result: result['emit_latency_us']['p99'], False, True),
+    ('cpu us/ev', lambda result: result['cpu_us_per_event'], False, False),
+)
+
+
+# ----------------------------------------------------------------------
+def compare(baseline, current, tolerance, latency_tolerance):
+    """
+    :return: tuple of (report lines, list of regression descriptions)
+    """
+    baseline_results = dict((result['name'], result) for result in baseline['scenarios'])
+    lines = ['{:<24} {:<10} {:>12} {:>12} {:>8}'.format(
+        'scenario', 'metric', 'baseline', 'current', 'change')]
+    regressions = []
+    for result in current['scenarios']:
+        name = result['name']
+        if is_incomplete(result):
+            regressions.append('{}: {} events lost, {} duplicated'.format(
+                name, result['lost'], result['duplicated']))
+        reference = baseline_results.pop(name, None)
+        if reference is None:
+            lines.append('{:<24} not in baseline'.format(name))
+            continue
+        for label, get, higher_is_better, is_latency in METRICS:
+            old, new = get(reference), get(result)
+            change = (new - old) / old if old else 0.0
+            worse = -change if higher_is_better else change
+            marker = ''
+            if worse > (latency_tolerance if is_latency else tolerance):
+                marker = ' !'
+                regressions.append('{}: {} {:.1f} -> {:.1f} ({:+.1%})'.format(
+                    name, label, old, new, change))
+            lines.append('{:<24} {:<10} {:>12.1f} {:>12.1f} {:>+8.1%}{}'.format(
+                name, label, old, new, change, marker))
+    for name in sorted(baseline_results):
+        lines.append('{:<24} not in current results'.format(name))
+    return lines, regressions
+
+
+# ----------------------------------------------------------------------
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('baseline', help='results of the reference version')
+    parser.add_argument('current', help='results to check')
+    parser.add_argument('--tolerance', type=float, default=0.15,
+                        help='accepted relative change, 0.15 for 15%%')
+    parser.add_argument('--latency-tolerance', type=float, default=0.5,
+                        help='accepted relative change of the p99 emit latency')
+    args = parser.parse_args()
+
+    with open(args.baseline) as baseline_file:
+        baseline = json.load(baseline_file)
+    with open(args.current) as current_file:
+        current = json.load(current_file)
+
+    print('baseline: log_async {version}, Python {python}, {platform}'.format(**baseline))
+    print('current:  log_async {version}, Python {python}, {platform}'.format(**current))
+    lines, regressions = compare(baseline, current, args.tolerance, args.latency_tolerance)
+    print('\n'.join(lines))
+    if regressions:
+        print('\nregressions:\n  ' + '\n  '.join(regressions), file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,275 @@
+# -*- coding: utf-8 -*-
+#
+# This software may be modified and distributed under the terms
+# of the MIT license.  See the LICENSE file for details.
+
+"""Run AsynchronousLogHandler end-to-end against local sink servers for every combination
+of transport, cache and formatter and measure emit latency, throughput, CPU time per event,
+memory growth and delivery completeness.
+
+The results can be written as JSON and compared with `python -m benchmarks.compare`.
+Requires Python 3, TLS requires the openssl command line tool.
+
+Usage: python -m benchmarks.e2e [--events N] [--transports tcp tls udp unix]
+                                [--caches memory sqlite] [--formatters json msgpack cbor]
+                                [--output results.json]
+"""
+
+from __future__ import print_function
+
+import argparse
+import json
+import logging
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+
+from log_async.database import DatabaseCache
+from log_async.formatter import CborLogstashFormatter, LogstashFormatter, MsgpackLogstashFormatter
+from log_async.handler import AsynchronousLogHandler
+from log_async.memory_cache import MemoryCache
+from log_async.transport import TcpTransport, UdpTransport, UnixSocketTransport
+import log_async
+
+from .sinks import create_self_signed_certificate, format_message, Sink, SINK_KINDS
+
+
+CACHES = ('memory', 'sqlite')
+FORMATTERS = ('json', 'msgpack', 'cbor')
+# transports which must deliver every event exactly once
+RELIABLE_TRANSPORTS = ('tcp', 'tls', 'unix')
+
+RESULTS_FORMAT_VERSION = 1
+
+
+class SkipScenario(Exception):
+    """A scenario cannot run in this environment, e.g. an optional package is missing"""
+
+
+# ----------------------------------------------------------------------
+def _create_formatter(kind):
+    try:
+        if kind == 'msgpack':
+            return MsgpackLogstashFormatter()
+        if kind == 'cbor':
+            return CborLogstashFormatter()
+    except ImportError as exc:
+        raise SkipScenario(str(exc))
+    return LogstashFormatter()
+
+
+# ----------------------------------------------------------------------
+def _create_transport(kind, address):
+    if kind == 'unix':
+        return UnixSocketTransport(address)
+    host, port = address
+    if kind == 'udp':
+        return UdpTransport(host, port)
+    return TcpTransport(host, port, ssl_enable=(kind == 'tls'), ssl_verify=False,
+                        keyfile=None, certfile=None, ca_certs=None)
+
+
+# ----------------------------------------------------------------------
+def _create_cache(kind, directory):
+    if kind == 'sqlite':
+        return DatabaseCache(os.path.join(directory, 'buffer.db'))
+    return MemoryCache({})
+
+
+# ----------------------------------------------------------------------
+def _rss_bytes():
+    try:
+        with open('/proc/self/statm') as statm:
+            return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (IOError, OSError):
+        # peak instead of current usage, in kilobytes on Linux and bytes on macOS
+        import resource
+        rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return rss if sys.platform == 'darwin' else rss * 1024
+
+
+# ----------------------------------------------------------------------
+def _cpu_seconds():
+    return time.process_time()  # user and system time of all threads, without the sinks
+
+
+# ----------------------------------------------------------------------
+def _percentile(ordered, fraction):
+    if not ordered:
+        return 0.0
+    return ordered[min(int(round(fraction * (len(ordered) - 1))), len(ordered) - 1)]
+
+
+# ----------------------------------------------------------------------
+def scenario_name(transport, cache, formatter):
+    return '{}-{}-{}'.format(transport, cache, formatter)
+
+
+# ----------------------------------------------------------------------
+def run_scenario(transport, cache, formatter, events, directory, certificate, timeout):
+    """Emit `events` events through a new handler and count the events received by the sink.
+
+    :return: dict of measurements
+    """
+    if transport == 'tls' and certificate is None:
+        raise SkipScenario('openssl is not available to create a certificate')
+    log_formatter = _create_formatter(formatter)
+
+    sink = Sink(transport, directory, certificate)
+    sink.start()
+    handler = None
+    logger = logging.getLogger('log_async.benchmark.{}'.format(
+        scenario_name(transport, cache, formatter)))
+    try:
+        handler = AsynchronousLogHandler(
+            'localhost', 0, transport=_create_transport(transport, sink.address),
+            buffer=_create_cache(cache, directory), formatter=log_formatter)
+        logger.propagate = False
+        logger.setLevel(logging.INFO)
+        logger.addHandler(handler)
+
+        # start the worker thread before measuring
+        logger.info('warm-up')
+        handler.flush(timeout=timeout)
+
+        latencies = []
+        timer = time.perf_counter
+        rss_before = _rss_bytes()
+        cpu_before = _cpu_seconds()
+        start = timer()
+        for sequence in range(events):
+            emit_start = timer()
+            logger.info(format_message(sequence))
+            latencies.append(timer() - emit_start)
+        emitted = timer()
+        pending = handler.flush(timeout=timeout)
+        delivered = timer()
+        cpu_seconds = _cpu_seconds() - cpu_before
+        rss_growth = _rss_bytes() - rss_before
+    finally:
+        if handler is not None:
+            logger.removeHandler(handler)
+            handler.shutdown(timeout=timeout)
+        counts, received_bytes = sink.stop()
+        if cache == 'sqlite':
+            os.unlink(os.path.join(directory, 'buffer.db'))
+
+    latencies.sort()
+    received = sum(1 for sequence in range(events) if sequence in counts)
+    return dict(
+        name=scenario_name(transport, cache, formatter),
+        transport=transport,
+        cache=cache,
+        formatter=formatter,
+        events=events,
+        emit_latency_us=dict(
+            p50=_percentile(latencies, 0.5) * 1e6,
+            p90=_percentile(latencies, 0.9) * 1e6,
+            p99=_percentile(latencies, 0.99) * 1e6,
+            max=latencies[-1] * 1e6 if latencies else 0.0),
+        emit_events_per_second=events / (emitted - start),
+        events_per_second=events / (delivered - start),
+        cpu_us_per_event=cpu_seconds / events * 1e6,
+        rss_growth_bytes=rss_growth,
+        pending=pending,
+        received=received,
+        lost=events - received,
+        duplicated=sum(count - 1 for count in counts.values() if count > 1),
+        bytes_received=received_bytes,
+    )
+
+
+# ----------------------------------------------------------------------
+def is_incomplete(result):
+    """True if a reliable transport lost or duplicated events"""
+    return result['transport'] in RELIABLE_TRANSPORTS and bool(
+        result['lost'] or result['duplicated'])
+
+
+# ----------------------------------------------------------------------
+def run(transports, caches, formatters, events, timeout, output=print):
+    """Run all combinations of the given transports, caches and formatters.
+
+    :return: dict with the environment, the results and the skipped scenarios
+    """
+    results = dict(
+        format=RESULTS_FORMAT_VERSION,
+        version=log_async.__version__,
+        python=platform.python_version(),
+        implementation=platform.python_implementation(),
+        platform=platform.platform(),
+        cpu_count=os.cpu_count(),
+        timestamp=time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        events=events,
+        scenarios=[],
+        skipped=[],
+    )
+    directory = tempfile.mkdtemp(prefix='log_async_benchmark_')
+    try:
+        certificate = None
+        if 'tls' in transports:
+            certificate = create_self_signed_certificate(directory)
+        for transport in transports:
+            for cache in caches:
+                for formatter in formatters:
+                    name = scenario_name(transport, cache, formatter)
+                    try:
+                        result = run_scenario(
+                            transport, cache, formatter, events, directory, certificate, timeout)
+                    except SkipScenario as exc:
+                        results['skipped'].append(dict(name=name, reason=str(exc)))
+                        output('{:<24} skipped: {}'.format(name, exc))
+                        continue
+                    results['scenarios'].append(result)
+                    output(format_result(result))
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+    return results
+
+
+# ----------------------------------------------------------------------
+def format_header():
+    return '{:<24} {:>8} {:>8} {:>9} {:>11} {:>10} {:>9} {:>7} {:>6}'.format(
+        'scenario', 'p50 us', 'p99 us', 'max us', 'events/s', 'cpu us/ev', 'rss KiB',
+        'lost', 'dup')
+
+
+# ----------------------------------------------------------------------
+def format_result(result):
+    latency = result['emit_latency_us']
+    return '{:<24} {:>8.1f} {:>8.1f} {:>9.1f} {:>11,.0f} {:>10.1f} {:>9,d} {:>7d} {:>6d}'.format(
+        result['name'], latency['p50'], latency['p99'], latency['max'],
+        result['events_per_second'], result['cpu_us_per_event'],
+        result['rss_growth_bytes'] // 1024, result['lost'], result['duplicated'])
+
+
+# ----------------------------------------------------------------------
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--events', type=int, default=20000, help='events per scenario')
+    parser.add_argument('--transports', nargs='+', choices=SINK_KINDS, default=list(SINK_KINDS))
+    parser.add_argument('--caches', nargs='+', choices=CACHES, default=list(CACHES))
+    parser.add_argument('--formatters', nargs='+', choices=FORMATTERS, default=list(FORMATTERS))
+    parser.add_argument('--timeout', type=float, default=120.0,
+                        help='seconds to wait for the delivery of the events of a scenario')
+    parser.add_argument('--output', help='write the results as JSON to this file')
+    args = parser.parse_args()
+
+    print(format_header())
+    results = run(args.transports, args.caches, args.formatters, args.events, args.timeout)
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump(results, output, indent=2, sort_keys=True)
+            output.write('\n')
+
+    incomplete = [result['name'] for result in results['scenarios'] if is_incomplete(result)]
+    if incomplete:
+        print('incomplete delivery: {}'.format(', '.join(incomplete)), file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
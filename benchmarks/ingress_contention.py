@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+#
+# This software may be modified and distributed under the terms
+# of the MIT license.  See the LICENSE file for details.
+
+"""Measure the throughput of concurrent producers putting events into the worker's
+ingress queue while a consumer drains it, for queue.Queue and DequeIngressQueue.
+
+Usage: python -m benchmarks.ingress_contention [--events N] [--producers 1 8 64]
+"""
+
+from __future__ import print_function
+
+from threading import Event, Thread
+import argparse
+import time
+
+from six.moves.queue import Empty, Queue
+
+from log_async.ingress import DequeIngressQueue
+
+
+class QueueIngressQueue(object):
+    """queue.Queue with the ingress queue interface, like the worker used it before"""
+
+    def __init__(self):
+        self._queue = Queue()
+
+    def put(self, event):
+        self._queue.put(event)
+
+    def get_batch(self, max_events=None):
+        events = []
+        while max_events is None or len(events) < max_events:
+            try:
+                events.append(self._queue.get(block=False))
+            except Empty:
+                break
+        return events
+
+    def qsize(self):
+        return self._queue.qsize()
+
+
+# ----------------------------------------------------------------------
+def run(queue_class, producers, events):
+    """
+    :return: tuple of (events put per second, seconds the consumer lagged behind)
+    """
+    queue = queue_class()
+    payload = b'{"message": "benchmark"}\n'
+    per_producer = events // producers
+    total = per_producer * producers
+    start_event = Event()
+    consumed = [0]
+
+    def produce():
+        start_event.wait()
+        put = queue.put
+        for _ in range(per_producer):
+            put(payload)
+
+    def consume():
+        while consumed[0] < total:
+            batch = queue.get_batch()
+            if batch:
+                consumed[0] += len(batch)
+            else:
+                time.sleep(0.001)
+
+    threads = [Thread(target=produce) for _ in range(producers)]
+    consumer = Thread(target=consume)
+    for thread in threads:
+        thread.start()
+    consumer.start()
+    start = time.time()
+    start_event.set()
+    for thread in threads:
+        thread.join()
+    produced = time.time()
+    consumer.join()
+    return total / (produced - start), time.time() - produced
+
+
+# ----------------------------------------------------------------------
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--events', type=int, default=200000, help='events per run')
+    parser.add_argument('--producers', type=int, nargs='+', default=[1, 8, 64])
+    args = parser.parse_args()
+
+    print('{:<20} {:>10} {:>15} {:>12}'.format('queue', 'producers', 'events/s', 'drain lag'))
+    for producers in args.producers:
+        for queue_class in (QueueIngressQueue, DequeIngressQueue):
+            rate, lag = run(queue_class, producers, args.events)
+            print('{:<20} {:>10} {:>15,.0f} {:>11.3f}s'.format(
+                queue_class.__name__, producers, rate, lag))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,225 @@
+# -*- coding: utf-8 -*-
+#
+# This software may be modified and distributed under the terms
+# of the MIT license.  See the LICENSE file for details.
+
+"""Local servers receiving the events of a benchmark run.
+
+Each sink runs in a separate process, so receiving the events does not add to the CPU time
+and memory measured in the benchmark process. The sinks do not parse the events, they count
+the sequence numbers embedded in the messages (`bench-<number>-end`), which works for every
+formatter and framing.
+"""
+
+from threading import Event, Thread
+import multiprocessing
+import os
+import re
+import shutil
+import socket
+import ssl
+import subprocess
+
+
+SEQUENCE_PATTERN = re.compile(br'bench-(\d+)-end')
+
+SINK_KINDS = ('tcp', 'tls', 'udp', 'unix')
+
+# seconds to wait for connections to deliver their remaining data when the sink is stopped
+DRAIN_TIMEOUT = 10.0
+
+
+# ----------------------------------------------------------------------
+def format_message(sequence):
+    return 'bench-{}-end'.format(sequence)
+
+
+# ----------------------------------------------------------------------
+def create_self_signed_certificate(directory):
+    """Create a certificate for the TLS sink with the openssl command line tool.
+
+    :return: tuple of (certificate path, key path), None if openssl is not available
+    """
+    openssl = shutil.which('openssl')
+    if openssl is None:
+        return None
+    certfile = os.path.join(directory, 'sink.crt')
+    keyfile = os.path.join(directory, 'sink.key')
+    try:
+        subprocess.check_call(
+            [openssl, 'req', '-x509', '-newkey', 'rsa:2048', '-nodes', '-days', '1',
+             '-subj', '/CN=localhost', '-keyout', keyfile, '-out', certfile],
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return certfile, keyfile
+
+
+class _Counter(object):
+
+    def __init__(self):
+        self.counts = {}
+        self.bytes = 0
+
+    def add(self, data):
+        self.bytes += len(data)
+        counts = self.counts
+        for match in SEQUENCE_PATTERN.finditer(data):
+            sequence = int(match.group(1))
+            counts[sequence] = counts.get(sequence, 0) + 1
+
+
+# ----------------------------------------------------------------------
+def _receive_stream(connection, counter):
+    # messages may be split across reads, scan the data of a connection once it is closed
+    chunks = []
+    try:
+        while True:
+            data = connection.recv(65536)
+            if not data:
+                break
+            chunks.append(data)
+    except (OSError, ssl.SSLError):
+        pass  # e.g. the client closed a TLS connection without shutting down TLS
+    finally:
+        connection.close()
+    counter.add(b''.join(chunks))
+
+
+# ----------------------------------------------------------------------
+def _accept_streams(server, counters, threads, ssl_context):
+    while True:
+        try:
+            connection, _ = server.accept()
+        except OSError:
+            return  # the sink was stopped
+        if ssl_context is not None:
+            try:
+                connection = ssl_context.wrap_socket(connection, server_side=True)
+            except (OSError, ssl.SSLError):
+                connection.close()
+                continue
+        # one counter per connection, the threads are joined before the counters are merged
+        connection_counter = _Counter()
+        counters.append(connection_counter)
+        thread = Thread(target=_receive_stream, args=(connection, connection_counter))
+        thread.daemon = True
+        thread.start()
+        threads.append(thread)
+
+
+# ----------------------------------------------------------------------
+def _receive_datagrams(server, counter, stopped):
+    # after the sink was stopped, receive the pending datagrams until none arrives in time
+    server.settimeout(0.2)
+    while True:
+        try:
+            data = server.recv(65536)
+        except socket.timeout:
+            if stopped.is_set():
+                return
+            continue
+        counter.add(data)
+
+
+# ----------------------------------------------------------------------
+def _serve(kind, address, certificate, pipe):
+    if kind == 'unix':
+        server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    elif kind == 'udp':
+        server = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        server.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 8 * 1024 * 1024)
+    else:
+        server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    server.bind(address)
+    if kind != 'udp':
+        server.listen(128)
+
+    counters = []
+    threads = []
+    stopped = Event()
+    if kind == 'udp':
+        counter = _Counter()
+        counters.append(counter)
+        receiver = Thread(target=_receive_datagrams, args=(server, counter, stopped))
+    else:
+        ssl_context = None
+        if kind == 'tls':
+            ssl_context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+            ssl_context.load_cert_chain(*certificate)
+            # TcpTransport closes the connection after each batch without reading the TLS 1.3
+            # session tickets sent by the server, the resulting RST can discard the data
+            # not yet read by the sink
+            ssl_context.num_tickets = 0
+        receiver = Thread(target=_accept_streams, args=(server, counters, threads, ssl_context))
+    receiver.daemon = True
+    receiver.start()
+    pipe.send(server.getsockname())
+
+    pipe.recv()  # stop
+    stopped.set()
+    if kind == 'udp':
+        receiver.join()
+        server.close()
+    else:
+        # the client closed its connections, let the receiving threads finish
+        for thread in list(threads):
+            thread.join(DRAIN_TIMEOUT)
+        server.shutdown(socket.SHUT_RDWR)
+        server.close()
+
+    counts = {}
+    received_bytes = 0
+    for counter in counters:
+        received_bytes += counter.bytes
+        for sequence, count in counter.counts.items():
+            counts[sequence] = counts.get(sequence, 0) + count
+    pipe.send((counts, received_bytes))
+
+
+class Sink(object):
+    """A server receiving events in a separate process.
+
+    :param kind: One of SINK_KINDS
+    :param directory: Directory for the Unix domain socket
+    :param certificate: tuple of (certificate path, key path), required for 'tls'
+    """
+
+    # ----------------------------------------------------------------------
+    def __init__(self, kind, directory, certificate=None):
+        if kind not in SINK_KINDS:
+            raise ValueError(u'Unknown sink "{}", expected one of {}'.format(
+                kind, ', '.join(SINK_KINDS)))
+        self.kind = kind
+        if kind == 'unix':
+            self._bind_address = os.path.join(directory, 'sink.sock')
+        else:
+            self._bind_address = ('127.0.0.1', 0)
+        self._certificate = certificate
+        self._pipe = None
+        self._process = None
+        self.address = None
+
+    # ----------------------------------------------------------------------
+    def start(self):
+        """Start the sink process, `address` is set when the sink accepts events"""
+        self._pipe, child_pipe = multiprocessing.Pipe()
+        self._process = multiprocessing.Process(
+            target=_serve, args=(self.kind, self._bind_address, self._certificate, child_pipe),
+            name='BenchmarkSink-{}'.format(self.kind))
+        self._process.daemon = True
+        self._process.start()
+        self.address = self._pipe.recv()
+
+    # ----------------------------------------------------------------------
+    def stop(self):
+        """Stop the sink process after it received the data of all closed connections.
+
+        :return: tuple of (dict of sequence number -> times received, bytes received)
+        """
+        self._pipe.send('stop')
+        result = self._pipe.recv()
+        self._process.join()
+        if self.kind == 'unix':
+            os.unlink(self._bind_address)
+        return result
@@ -0,0 +1,473 @@
+# -*- coding: utf-8 -*-
+#
+# This software may be modified and distributed under the terms
+# of the MIT license.  See the LICENSE file for details.
+
+"""asyncio based log handler and transports (Python 3.7+ only)"""
+
+from collections import deque
+import asyncio
+import logging
+import ssl
+import threading
+import time
+
+from .cache import Cache
+from .constants import constants
+from .formatter import LogstashFormatter
+from .framing import DelimiterFraming
+from .hooks import hooks
+from .memory_cache import MemoryCache
+from .openmetrics import CONTENT_TYPE
+from .spool import REASON_REJECTED
+from .transport import PartialSendError, RejectedEventError, TransportStats
+from .utils import import_string, overrides_method, safe_log_via_print
+from .worker import WorkerStats
+
+
+class AsyncioTcpTransport(object):
+    """Send events over TCP (optionally TLS) using asyncio streams.
+
+    All events of a batch are written before waiting for the socket to drain, so the
+    batch is pipelined and backpressure is handled by the event loop.
+    """
+
+    # ----------------------------------------------------------------------
+    def __init__(self, host, port, ssl_enable=False, ssl_verify=True, keyfile=None,
+                 certfile=None, ca_certs=None, **kwargs):
+        self._host = host
+        self._port = port
+        self._ssl_enable = ssl_enable
+        self._ssl_verify = ssl_verify
+        self._keyfile = keyfile
+        self._certfile = certfile
+        self._ca_certs = ca_certs
+        self._stats = TransportStats(constants.TRANSPORT_STATS_PREFIX)
+
+    # ----------------------------------------------------------------------
+    async def send(self, events):
+        start = time.monotonic()
+        hook = hooks.on_send_start
+        if hook is not None:
+            hook(events)
+        error = None
+        try:
+            await self._send_batch(events, start)
+        except Exception as e:
+            error = e
+            raise
+        finally:
+            hook = hooks.on_send_end
+            if hook is not None:
+                hook(events, time.monotonic() - start, error)
+
+    # ----------------------------------------------------------------------
+    async def _send_batch(self, events, start):
+        # like TcpTransport, use a new connection per batch to notice broken connections
+        self._stats.begin_batch()
+        reader, writer = await asyncio.wait_for(
+            asyncio.open_connection(self._host, self._port, ssl=self._create_ssl_context()),
+            constants.SOCKET_TIMEOUT)
+        # events written before the last successful drain are considered sent
+        drained = 0
+        try:
+            pending = 0
+            for written, event in enumerate(events, 1):
+                data = self._convert_data_to_send(event)
+                writer.write(data)
+                self._stats.bytes_sent(len(data))
+                pending += len(data)
+                if pending >= constants.ASYNCIO_DRAIN_THRESHOLD:
+                    await asyncio.wait_for(writer.drain(), constants.SOCKET_TIMEOUT)
+                    pending = 0
+                    drained = written
+            await asyncio.wait_for(writer.drain(), constants.SOCKET_TIMEOUT)
+            self._stats.events_sent(len(events))
+            self._stats.batch_sent(len(events), time.monotonic() - start)
+        except Exception as e:
+            self._stats.socket_error()
+            if drained:
+                self._stats.events_sent(drained)
+                raise PartialSendError(e, drained) from e
+            raise
+        finally:
+            writer.close()
+            try:
+                await asyncio.wait_for(writer.wait_closed(), constants.SOCKET_TIMEOUT)
+            except Exception:
+                pass
+
+    # ----------------------------------------------------------------------
+    def _create_ssl_context(self):
+        if not self._ssl_enable:
+            return None
+        context = ssl.create_default_context(cafile=self._ca_certs)
+        if not self._ssl_verify:
+            context.check_hostname = False
+            context.verify_mode = ssl.CERT_OPTIONAL if self._ca_certs else ssl.CERT_NONE
+        if self._certfile:
+            context.load_cert_chain(self._certfile, self._keyfile)
+        return context
+
+    # ----------------------------------------------------------------------
+    def _convert_data_to_send(self, data):
+        if not isinstance(data, bytes):
+            return bytes(data, 'utf-8')
+        return data
+
+    # ----------------------------------------------------------------------
+    async def close(self):
+        pass
+
+    # ----------------------------------------------------------------------
+    def get_stats(self):
+        return self._stats.get_stats()
+
+
+class AsyncioUdpTransport(AsyncioTcpTransport):
+    """Send events as UDP datagrams using an asyncio datagram endpoint"""
+
+    # ----------------------------------------------------------------------
+    def __init__(self, host, port, **kwargs):
+        super(AsyncioUdpTransport, self).__init__(host, port)
+        self._endpoint = None
+
+    # ----------------------------------------------------------------------
+    async def _send_batch(self, events, start):
+        self._stats.begin_batch()
+        if self._endpoint is None:
+            loop = asyncio.get_running_loop()
+            self._endpoint, _ = await loop.create_datagram_endpoint(
+                asyncio.DatagramProtocol, remote_addr=(self._host, self._port))
+        try:
+            for event in events:
+                data = self._convert_data_to_send(event)
+                self._endpoint.sendto(data)
+                self._stats.bytes_sent(len(data))
+            self._stats.events_sent(len(events))
+            self._stats.batch_sent(len(events), time.monotonic() - start)
+        except Exception:
+            self._stats.socket_error()
+            await self.close()
+            raise
+
+    # ----------------------------------------------------------------------
+    async def close(self):
+        if self._endpoint is not None:
+            self._endpoint.close()
+            self._endpoint = None
+
+
+class AsyncioLogHandler(logging.Handler):
+    """Python logging handler for asynchronous log forwarding from asyncio applications.
+
+    `emit()` only formats the record and appends it to an in-memory queue, it never blocks
+    and may be called from the event loop or any other thread. Caching and sending is done
+    by a task on the event loop: on the loop passed in, on the loop running when the first
+    record is emitted or, if there is none, on a dedicated loop in a background thread.
+
+    :param host: The host of the log forwarding server, required.
+    :param port: The port of the log forwarding server, required.
+    :param transport: Instance or path to an asyncio transport class
+                      (AsyncioTcpTransport by default, AsyncioUdpTransport for UDP)
+    :param ssl_enable: Should SSL be enabled for the connection? Default is False.
+    :param ssl_verify: Should the server's SSL certificate be verified?
+    :param keyfile: The path to client side SSL key file (default is None).
+    :param certfile: The path to client side SSL certificate file (default is None).
+    :param ca_certs: The path to the file containing recognized CA certificates.
+    :param enable: Flag to enable log processing (default is True)
+    :param formatter: Formatter to turn event into byte array
+    :param buffer: Implementation of log_async.Cache, should not block (default is MemoryCache)
+    :param framing: How events are delimited on the wire, newline terminated by default
+    :param loop: Event loop to run the flush task on
+    """
+
+    # ----------------------------------------------------------------------
+    def __init__(self, host, port, transport='log_async.aio.AsyncioTcpTransport',
+                 ssl_enable=False, ssl_verify=True, keyfile=None, certfile=None, ca_certs=None,
+                 enable=True, formatter=None, buffer=None, framing=None, loop=None):
+        super(AsyncioLogHandler, self).__init__()
+        if isinstance(transport, str):
+            transport = import_string(transport)(
+                host=host, port=port, ssl_enable=ssl_enable, ssl_verify=ssl_verify,
+                keyfile=keyfile, certfile=certfile, ca_certs=ca_certs)
+        self._host = host
+        self._port = port
+        self._transport = transport
+        self._enable = enable
+        self._buffer = buffer if buffer is not None else MemoryCache(cache={})
+        self._framing = framing if framing is not None else DelimiterFraming(b'\n')
+        self._loop = loop
+        self._loop_thread = None
+        self._queue = deque()
+        self._wakeup = None
+        self._flush_requested = False
+        self._flush_waiters = []
+        self._non_flushed = 0
+        self._task = None
+        self._started = False
+        self._stop_requested = False
+        self._start_lock = threading.Lock()
+        self._stats = WorkerStats(constants.WORKER_STATS_PREFIX)
+        if formatter is not None:
+            self.formatter = formatter
+        elif self.formatter is None:
+            self.formatter = LogstashFormatter()
+
+    # ----------------------------------------------------------------------
+    @property
+    def endpoint(self):
+        """Address of the log forwarding server as `host:port`"""
+        return u'{}:{}'.format(self._host, self._port)
+
+    # ----------------------------------------------------------------------
+    def emit(self, record):
+        if not self._enable:
+            return
+
+        try:
+            self._start()
+            formatted = self.formatter.format(record)
+            if isinstance(formatted, str):
+                formatted = formatted.encode('utf-8')
+            self._queue.append(self._framing.frame(formatted))
+            self._stats.event()
+            if len(self._queue) >= constants.QUEUED_EVENTS_FLUSH_COUNT:
+                self._wake(flush=False)
+        except (KeyboardInterrupt, SystemExit):
+            raise
+        except Exception:
+            self.handleError(record)
+
+    # ----------------------------------------------------------------------
+    def _start(self):
+        if self._started:
+            return
+        with self._start_lock:
+            if self._started:
+                return
+            if self._loop is None:
+                try:
+                    self._loop = asyncio.get_running_loop()
+                except RuntimeError:
+                    self._start_dedicated_loop()
+            if self._in_loop_thread():
+                self._create_task()
+            else:
+                # do not wait for the loop, it might not run yet (e.g. logging during the
+                # application's startup), the events are queued until the task starts
+                self._loop.call_soon_threadsafe(self._create_task)
+            self._started = True
+
+    # ----------------------------------------------------------------------
+    def _start_dedicated_loop(self):
+        self._loop = asyncio.new_event_loop()
+        self._loop_thread = threading.Thread(
+            target=self._loop.run_forever, name='AsyncioLogHandler', daemon=True)
+        self._loop_thread.start()
+
+    # ----------------------------------------------------------------------
+    def _in_loop_thread(self):
+        try:
+            return asyncio.get_running_loop() is self._loop
+        except RuntimeError:
+            return False
+
+    # ----------------------------------------------------------------------
+    def _create_task(self):
+        self._wakeup = asyncio.Event()
+        if self._flush_requested:
+            self._wakeup.set()
+        self._task = self._loop.create_task(self._run())
+
+    # ----------------------------------------------------------------------
+    def _wake(self, flush):
+        if flush:
+            self._flush_requested = True
+        if self._wakeup is None:
+            return
+        if self._in_loop_thread():
+            self._wakeup.set()
+        else:
+            self._loop.call_soon_threadsafe(self._wakeup.set)
+
+    # ----------------------------------------------------------------------
+    async def _run(self):
+        last_flush = time.monotonic()
+        stopping = False
+        while not stopping:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), constants.QUEUE_CHECK_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+            except asyncio.CancelledError:
+                stopping = True
+            stopping = stopping or self._stop_requested
+            self._wakeup.clear()
+            self._move_queue_to_buffer()
+            force = self._flush_requested or stopping
+            interval_reached = \
+                time.monotonic() - last_flush > constants.QUEUED_EVENTS_FLUSH_INTERVAL
+            if force or interval_reached or \
+                    self._non_flushed >= constants.QUEUED_EVENTS_FLUSH_COUNT:
+                self._flush_requested = False
+                waiters, self._flush_waiters = self._flush_waiters, []
+                await self._flush_buffer()
+                last_flush = time.monotonic()
+                for waiter in waiters:
+                    if not waiter.done():
+                        waiter.set_result(None)
+            if not stopping:
+                self._buffer.expire_events()
+
+    # ----------------------------------------------------------------------
+    def _move_queue_to_buffer(self):
+        while self._queue:
+            self._buffer.add_event(self._queue.popleft())
+            self._non_flushed += 1
+        self._stats.set_queue_size(len(self._queue))
+
+    # ----------------------------------------------------------------------
+    async def _flush_buffer(self):
+        queued_events = self._buffer.get_queued_events()
+        if not queued_events:
+            return
+        try:
+            await self._transport.send([event['event_text'] for event in queued_events])
+        except asyncio.CancelledError:
+            # the task was cancelled while sending, do not strand the claimed events
+            self._buffer.requeue_queued_events(queued_events)
+            raise
+        except PartialSendError as e:
+            safe_log_via_print('exception', u'An error occurred while sending events: %s', e)
+            done = e.sent
+            if isinstance(e, RejectedEventError):
+                # retrying the rejected event cannot succeed, remove it with the sent events
+                spool = getattr(self._buffer, 'spool', None)
+                if spool is not None:
+                    spool.add(queued_events[done]['event_text'], REASON_REJECTED)
+                done += 1
+            self._buffer.complete_queued_events(queued_events, done)
+        except Exception as e:
+            safe_log_via_print('exception', u'An error occurred while sending events: %s', e)
+            self._buffer.requeue_queued_events(queued_events)
+        else:
+            if overrides_method(self._buffer, 'delete_events', Cache):
+                # do not delete the events claimed by other processes sharing the buffer
+                self._buffer.delete_events(queued_events)
+            else:
+                self._buffer.delete_queued_events()
+            self._non_flushed = 0
+
+    # ----------------------------------------------------------------------
+    async def flush_async(self):
+        """Send all events emitted so far, to be awaited on the handler's loop"""
+        if self._task is None:
+            return
+        waiter = self._loop.create_future()
+        self._flush_waiters.append(waiter)
+        self._wake(flush=True)
+        await asyncio.shield(waiter)
+
+    # ----------------------------------------------------------------------
+    async def shutdown_async(self):
+        """Send all pending events and stop the flush task, to be awaited on the handler's loop
+        """
+        task, self._task = self._task, None
+        if task is not None:
+            # let the task finish its final flush instead of cancelling it in the middle
+            self._stop_requested = True
+            self._wakeup.set()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        # a record emitted later starts a new task
+        self._started = False
+        self._stop_requested = False
+        await self._transport.close()
+
+    # ----------------------------------------------------------------------
+    def flush(self):
+        # the synchronous logging API must not block the event loop, only request a flush
+        if self._task is not None:
+            self._wake(flush=True)
+
+    # ----------------------------------------------------------------------
+    def close(self):
+        self.acquire()
+        try:
+            self._shutdown_blocking()
+        finally:
+            self.release()
+        super(AsyncioLogHandler, self).close()
+
+    # ----------------------------------------------------------------------
+    def _shutdown_blocking(self):
+        if not self._started:
+            return
+        if self._in_loop_thread():
+            # cannot block the loop, let the shutdown run in the background
+            self._loop.create_task(self.shutdown_async())
+            return
+        if self._loop.is_closed() or not self._loop.is_running():
+            return
+        future = asyncio.run_coroutine_threadsafe(self.shutdown_async(), self._loop)
+        try:
+            future.result(constants.SOCKET_TIMEOUT * 2)
+        except Exception as e:
+            safe_log_via_print('error', u'Error on shutting down log handler: {}'.format(e))
+        if self._loop_thread is not None:
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._loop_thread.join()
+            self._loop.close()
+            self._loop_thread = None
+
+    # ----------------------------------------------------------------------
+    def get_stats(self):
+        vals = []
+        if self._enable:
+            self._stats.set_queue_size(len(self._queue))
+            vals.extend(self._stats.get_stats())
+            vals.extend(self._transport.get_stats())
+            vals.extend(self._buffer.get_stats())
+            if hasattr(self.formatter, 'get_stats'):
+                vals.extend(self.formatter.get_stats())
+        return vals
+
+
+class OpenMetricsASGIApp(object):
+    """ASGI application serving the statistics of log handlers in the OpenMetrics text format,
+    see `log_async.openmetrics.make_asgi_app()`
+
+    :param exporter: log_async.openmetrics.OpenMetricsExporter to serve
+    """
+
+    # ----------------------------------------------------------------------
+    def __init__(self, exporter):
+        self._exporter = exporter
+
+    # ----------------------------------------------------------------------
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            while True:
+                message = await receive()
+                if message['type'] == 'lifespan.startup':
+                    await send({'type': 'lifespan.startup.complete'})
+                elif message['type'] == 'lifespan.shutdown':
+                    await send({'type': 'lifespan.shutdown.complete'})
+                    return
+        if scope['type'] != 'http':
+            return
+
+        if scope.get('method', 'GET') not in ('GET', 'HEAD'):
+            await send({'type': 'http.response.start', 'status': 405,
+                        'headers': [(b'allow', b'GET, HEAD')]})
+            await send({'type': 'http.response.body', 'body': b''})
+            return
+        body = self._exporter.render()
+        await send({'type': 'http.response.start', 'status': 200,
+                    'headers': [(b'content-type', CONTENT_TYPE.encode('ascii')),
+                                (b'content-length', str(len(body)).encode('ascii'))]})
+        await send({'type': 'http.response.body',
+                    'body': b'' if scope.get('method') == 'HEAD' else body})
@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+#
+# This software may be modified and distributed under the terms
+# of the MIT license.  See the LICENSE file for details.
+
+import random
+
+from .utils import monotonic
+
+
+STATE_CLOSED = 'closed'
+STATE_OPEN = 'open'
+STATE_HALF_OPEN = 'half_open'
+
+# numeric representation of the states for stats
+STATE_VALUES = {STATE_CLOSED: 0, STATE_OPEN: 1, STATE_HALF_OPEN: 2}
+
+
+class CircuitBreaker(object):
+    """Stop sending to an unreachable log forwarding server for a while.
+
+    After `failure_threshold` consecutive failed sends the breaker opens and no sends are
+    attempted until the backoff delay has elapsed. The delay doubles with every consecutive
+    opening (up to `backoff_max`) and is jittered, so that many clients do not retry
+    at the same time. Then the breaker is half-open: a single, small probe batch is sent,
+    if it succeeds the breaker closes again, otherwise it opens with the next delay.
+
+    :param failure_threshold: Number of consecutive failures opening the breaker
+    :param backoff_initial: Delay in seconds after the first opening
+    :param backoff_max: Maximum delay in seconds
+    :param clock: Function returning the current (monotonic) time in seconds
+    :param random_: Function returning a random float in [0, 1)
+    """
+
+    # ----------------------------------------------------------------------
+    def __init__(self, failure_threshold=3, backoff_initial=1.0, backoff_max=60.0,
+                 clock=monotonic, random_=random.random):
+        self._failure_threshold = failure_threshold
+        self._backoff_initial = backoff_initial
+        self._backoff_max = backoff_max
+        self._clock = clock
+        self._random = random_
+        self._state = STATE_CLOSED
+        self._failures = 0
+        self._openings = 0
+        self._retry_at = None
+        self.trips = 0
+
+    # ----------------------------------------------------------------------
+    @property
+    def state(self):
+        return self._state
+
+    # ----------------------------------------------------------------------
+    @property
+    def probing(self):
+        """True if the next send is a probe and should use a small batch"""
+        return self._state == STATE_HALF_OPEN
+
+    # ----------------------------------------------------------------------
+    def allow(self):
+        """Check whether a send may be attempted now, moves an open breaker to half-open
+        once the backoff delay has elapsed"""
+        if self._state == STATE_OPEN:
+            if self._clock() < self._retry_at:
+                return False
+            self._state = STATE_HALF_OPEN
+        return True
+
+    # ----------------------------------------------------------------------
+    def retry_in(self):
+        """Seconds until the next send is allowed, 0 if the breaker is not open"""
+        if self._state != STATE_OPEN:
+            return 0
+        return max(0, self._retry_at - self._clock())
+
+    # ----------------------------------------------------------------------
+    def record_success(self):
+        self._state = STATE_CLOSED
+        self._failures = 0
+        self._openings = 0
+        self._retry_at = None
+
+    # ----------------------------------------------------------------------
+    def record_failure(self):
+        """
+        :return: True if the breaker was opened by this failure
+        """
+        self._failures += 1
+        if self._state == STATE_OPEN:
+            return False
+        if self._state == STATE_HALF_OPEN or self._failures >= self._failure_threshold:
+            self._open()
+            return True
+        return False
+
+    # ----------------------------------------------------------------------
+    def _open(self):
+        delay = min(self._backoff_max, self._backoff_initial * 2 ** self._openings)
+        # "equal jitter": wait at least half of the delay
+        delay = delay / 2.0 + self._random() * delay / 2.0
+        self._openings += 1
+        self._state = STATE_OPEN
+        self._retry_at = self._clock() + delay
+        self.trips += 1
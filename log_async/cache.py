@@ -7,13 +7,19 @@ import abc
 
 import six
 
+from .utils import overrides_method
+
 
 @six.add_metaclass(abc.ABCMeta)
 class Cache(object):
 
+    # DeadLetterSpool (see log_async.spool) receiving the events which overflowed, expired
+    # or were rejected, None to discard them
+    spool = None
+
     # ----------------------------------------------------------------------
     @abc.abstractmethod
-    def add_event(self, event):
+    def add_event(self, event, created=None):
         """Add the event to the cache.
 
         This method is meant to be called by various other threads.
@@ -21,15 +27,21 @@ class Cache(object):
         will be called by the log processing worker threads.
 
         :param str event: A log message
+        :param float created: Creation time of the log record (as returned by time.time()),
+                              returned as `created` by get_queued_events() to measure the
+                              age of sent events; None if unknown (optional for
+                              implementations, the worker only passes it if accepted)
         :return:
         """
         pass
 
     # ----------------------------------------------------------------------
     @abc.abstractmethod
-    def get_queued_events(self):
+    def get_queued_events(self, limit=None):
         """Get pending events and mark them to be deleted
 
+        :param limit: Maximum number of events to return, None for all pending events
+                      (optional for implementations, the worker only passes it if accepted)
         :return: A list of events to be published
         """
         pass
@@ -56,11 +68,72 @@ class Cache(object):
         """
         pass
 
+    # ----------------------------------------------------------------------
+    def delete_events(self, events):
+        """Delete the given events, previously returned by get_queued_events().
+
+        Unlike delete_queued_events(), this only deletes the passed events and so
+        allows multiple batches to be in flight at the same time. The default
+        implementation deletes all events marked for deletion, caches relying on it
+        are flushed without pipeline.
+
+        :param events:
+        :return:
+        """
+        self.delete_queued_events()
+
+    # ----------------------------------------------------------------------
+    def complete_queued_events(self, events, sent_count):
+        """Handle a partially sent batch of events, previously returned by
+        get_queued_events(): delete the first `sent_count` events, which were sent,
+        and requeue the remaining ones.
+
+        Caches which do not implement delete_events() requeue all events, so the sent
+        events are sent again.
+
+        :param events:
+        :param sent_count: Number of events at the start of `events` which were sent
+        :return:
+        """
+        if not overrides_method(self, 'delete_events', Cache):
+            self.requeue_queued_events(events)
+            return
+        self.delete_events(events[:sent_count])
+        self.requeue_queued_events(events[sent_count:])
+
     # ----------------------------------------------------------------------
     @abc.abstractmethod
     def expire_events(self):
         """Expire events older than the TTL. If no TTL is set, no action is taken.
 
+        :return: Number of expired events
+        """
+        pass
+
+    # ----------------------------------------------------------------------
+    def refresh_stats(self):
+        """Update statistics which are expensive to collect, called periodically
+        by the worker thread.
+
+        :return:
+        """
+        pass
+
+    # ----------------------------------------------------------------------
+    def vacuum(self):
+        """Compact the storage of the cache, called periodically by the worker thread.
+
+        :return:
+        """
+        pass
+
+    # ----------------------------------------------------------------------
+    def reset_after_fork(self):
+        """Called in a forked child process for the cache inherited from the parent.
+
+        Events buffered before the fork belong to the parent process, which will send them.
+        Implementations must make sure the child does not send them a second time.
+
         :return:
         """
         pass
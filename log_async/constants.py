@@ -21,6 +21,42 @@ class Constants(object):
     # to logger whenever QUEUED_EVENTS_FLUSH_COUNT or QUEUED_EVENTS_FLUSH_INTERVAL is reached,
     # whatever happens first
     QUEUED_EVENTS_FLUSH_COUNT = 50
+    # number of batches of cached events which may be in flight at the same time; if greater
+    # than 0, a separate sender thread transmits the batches while the worker keeps caching
+    # new events and claiming the next batches, 0 sends all cached events at once
+    QUEUED_EVENTS_PIPELINE_DEPTH = 0
+    # maximum number of cached events per batch if QUEUED_EVENTS_PIPELINE_DEPTH is enabled
+    QUEUED_EVENTS_BATCH_SIZE = 500
+    # number of consecutive failed sends after which the worker stops sending for a while
+    CIRCUIT_BREAKER_FAILURE_THRESHOLD = 3
+    # delay in seconds before sending is attempted again after the first failures; the delay
+    # doubles with every further failed attempt up to CIRCUIT_BREAKER_BACKOFF_MAX and is jittered
+    CIRCUIT_BREAKER_BACKOFF_INITIAL = 1.0
+    CIRCUIT_BREAKER_BACKOFF_MAX = 60.0
+    # number of events sent to probe whether the log forwarding server is reachable again
+    CIRCUIT_BREAKER_PROBE_SIZE = 1
+    # let the worker choose flush interval and flush count at runtime from the measured event
+    # rate, send duration and backlog instead of using QUEUED_EVENTS_FLUSH_INTERVAL and
+    # QUEUED_EVENTS_FLUSH_COUNT (and QUEUED_EVENTS_BATCH_SIZE), within the bounds below
+    ADAPTIVE_FLUSH = False
+    # bounds of the flush interval in seconds, the upper bound is the maximum time an event
+    # is held back in the cache while the log forwarding server is reachable
+    ADAPTIVE_FLUSH_MIN_INTERVAL = 1.0
+    ADAPTIVE_FLUSH_MAX_LATENCY = 10.0
+    # bounds of the flush count (batch size)
+    ADAPTIVE_FLUSH_MIN_COUNT = 10
+    ADAPTIVE_FLUSH_MAX_COUNT = 5000
+    # intervals in seconds of the worker's housekeeping tasks: expiring events older than the
+    # event_ttl, refreshing statistics which are expensive to collect (like the size of the
+    # database file) and compacting the buffer (VACUUM of the SQLite database)
+    MAINTENANCE_EXPIRE_INTERVAL = 30.0
+    MAINTENANCE_STATS_INTERVAL = 10.0
+    MAINTENANCE_VACUUM_INTERVAL = 3600.0
+    # time in seconds after which the worker does not start further housekeeping tasks in
+    # the current iteration, so that it gets back to caching queued events
+    MAINTENANCE_TIME_BUDGET = 0.5
+    # minimum fraction of unused pages in the SQLite database file to run VACUUM
+    DATABASE_VACUUM_FREE_RATIO = 0.5
     # maximum number of events to be updated within one SQLite statement
     DATABASE_EVENT_CHUNK_SIZE = 750
     # timeout in seconds to "connect" (i.e. open) the SQLite database
@@ -44,11 +80,42 @@ class Constants(object):
     # Use a string like '5 per minute' or None to disable (default), for details see
     # http://limits.readthedocs.io/en/stable/string-notation.html
     ERROR_LOG_RATE_LIMIT = None
+    # appended to strings (prepended to stack traces) which were cut to fit the size limits
+    # configured on the formatter
+    FORMATTER_TRUNCATION_MARKER = '...'
+    # number of rendered stack traces kept by the formatter if stack trace deduplication
+    # is enabled without an explicit cache size
+    FORMATTER_STACK_TRACE_CACHE_SIZE = 256
+
+    # number of bytes written by the asyncio transports before waiting for the socket to drain
+    ASYNCIO_DRAIN_THRESHOLD = 64 * 1024
+    # capacity in bytes of the shared memory ring buffer between application processes and
+    # the shipper process (AsynchronousLogHandler with shipper=True)
+    SHIPPER_RING_SIZE = 8 * 1024 * 1024
+    # interval in seconds in which the shipper process collects events from the ring buffer
+    SHIPPER_POLL_INTERVAL = 0.1
+    # interval in seconds to check whether the shipper process is still running
+    SHIPPER_SUPERVISE_INTERVAL = 5.0
+
+    # compressed size in bytes after which a file of the dead-letter spool (log_async.spool)
+    # is completed and a new one is started
+    SPOOL_MAX_FILE_SIZE = 16 * 1024 * 1024
+    # maximum size in bytes of all files in the spool directory, the oldest completed files
+    # are deleted to stay below it
+    SPOOL_MAX_TOTAL_SIZE = 256 * 1024 * 1024
+    # number of bytes of events which the spool collects before compressing and writing them
+    SPOOL_BLOCK_SIZE = 64 * 1024
+    # maximum time in seconds events are held in memory by the spool before they are written
+    SPOOL_FLUSH_INTERVAL = 5.0
 
     DATABASE_STATS_PREFIX = "eventlog_bufdb_"
     MEMORY_STATS_PREFIX = "eventlog_bufmem_"
     WORKER_STATS_PREFIX = "eventlog_worker_"
     TRANSPORT_STATS_PREFIX = "eventlog_transport_"
+    FORMATTER_STATS_PREFIX = "eventlog_formatter_"
+    SHIPPER_STATS_PREFIX = "eventlog_shipper_"
+    HANDLER_STATS_PREFIX = "eventlog_handler_"
+    SPOOL_STATS_PREFIX = "eventlog_spool_"
 
 
 constants = Constants()
@@ -12,17 +12,22 @@ import six
 
 from .cache import Cache
 from .constants import constants
+from .hooks import hooks
+from .spool import REASON_EXPIRED, REASON_OVERFLOW
 from .stats import Counter, Gauge, LogStats
 from .utils import ichunked
 
 
+# `pending_delete` is 0 for queued events, 1 for events claimed by the worker of a process
+# and 2 for events claimed by log_async.replay
 DATABASE_SCHEMA_STATEMENTS = [
     '''
     CREATE TABLE IF NOT EXISTS `event` (
     `event_id`          INTEGER NOT NULL PRIMARY KEY AUTOINCREMENT,
     `event_text`        TEXT NOT NULL,
     `pending_delete`    INTEGER NOT NULL,
-    `entry_date`        TEXT NOT NULL);
+    `entry_date`        TEXT NOT NULL,
+    `created`           REAL);
     ''',
     '''CREATE INDEX IF NOT EXISTS `idx_pending_delete` ON `event` (pending_delete);''',
     '''CREATE INDEX IF NOT EXISTS `idx_entry_date` ON `event` (entry_date);''',
@@ -60,16 +65,20 @@ class DatabaseCache(Cache):
         :param max_size: maximum number of buffered events, excluding events saved on prior runs
         :param overflow_fn: Function to call in case of overflow. Important - don't just log to
                 the same path or there could be an infinite loop!
+        :param spool: DeadLetterSpool receiving the events which overflowed or expired
     """
 
     # ----------------------------------------------------------------------
-    def __init__(self, path, event_ttl=None, max_size=None, overflow_fn=None):
+    def __init__(self, path, event_ttl=None, max_size=None, overflow_fn=None, spool=None):
         self._database_path = path
         self._connection = None
         self._event_ttl = event_ttl
         self._max_size = max_size
         self._overflow_fn = overflow_fn
+        self.spool = spool
         self._stats = DatabaseStats(constants.DATABASE_STATS_PREFIX)
+        self._stats_refreshed = False
+        self._schema_upgraded = False
 
     @contextmanager
     def _connect(self):
@@ -104,16 +113,36 @@ class DatabaseCache(Cache):
         try:
             for statement in DATABASE_SCHEMA_STATEMENTS:
                 cursor.execute(statement)
+            if not self._schema_upgraded:
+                self._upgrade_schema(cursor)
+                self._schema_upgraded = True
         except sqlite3.OperationalError:
             self._close()
             self._handle_sqlite_error()
             raise
 
     # ----------------------------------------------------------------------
-    def add_event(self, event):
+    def _upgrade_schema(self, cursor):
+        # databases created by older versions lack the `created` column
+        columns = [row[1] for row in cursor.execute('PRAGMA table_info(`event`)')]
+        if 'created' in columns:
+            return
+        try:
+            cursor.execute('ALTER TABLE `event` ADD COLUMN `created` REAL')
+        except sqlite3.OperationalError as e:
+            if 'duplicate column' not in str(e):
+                raise  # otherwise added by another process meanwhile
+
+    # ----------------------------------------------------------------------
+    def add_event(self, event, created=None):
         self._stats.event(1)
-        if self._max_size is not None and self._stats.totalBuffered() >= self._max_size:
+        if self._max_size is not None and self._stats.buffered() >= self._max_size:
             self._stats.discard(1)
+            hook = hooks.on_drop
+            if hook is not None:
+                hook(1, 'overflow')
+            if self.spool is not None:
+                self.spool.add(event, REASON_OVERFLOW)
             if self._overflow_fn:
                 try:
                     self._overflow_fn(event)
@@ -123,12 +152,29 @@ class DatabaseCache(Cache):
 
         query = u'''
             INSERT INTO `event`
-            (`event_text`, `pending_delete`, `entry_date`) VALUES (?, ?, datetime('now'))'''
+            (`event_text`, `pending_delete`, `entry_date`, `created`)
+            VALUES (?, ?, datetime('now'), ?)'''
         with self._connect() as connection:
-            connection.execute(query, (event, False))
+            connection.execute(query, (event, False, created))
         self._stats.buffer(1)
 
+    # ----------------------------------------------------------------------
+    def reset_after_fork(self):
+        # The database file is shared with the parent process, events are owned by the
+        # process which marks them as pending_delete, which happens within an exclusive
+        # transaction. Only the inherited connection and the statistics are dropped.
+        self._connection = None
+        self._stats = DatabaseStats(constants.DATABASE_STATS_PREFIX)
+
+    # ----------------------------------------------------------------------
     def get_stats(self):
+        if not self._stats_refreshed:
+            self.refresh_stats()
+        return self._stats.get_stats()
+
+    # ----------------------------------------------------------------------
+    def refresh_stats(self):
+        self._stats_refreshed = True
         try:
             fsize = os.stat(self._database_path).st_size
             self._stats.set_file_size(fsize)
@@ -138,7 +184,30 @@ class DatabaseCache(Cache):
             # and should have been logged already. Either way, to avoid
             # infinite recursion, we can't log more errors if logging is failing
             pass
-        return self._stats.get_stats()
+
+    # ----------------------------------------------------------------------
+    def vacuum(self):
+        """Run VACUUM if at least DATABASE_VACUUM_FREE_RATIO of the database file is unused
+
+        :return: True if VACUUM was run
+        """
+        with self._connect() as connection:
+            page_count = connection.execute('PRAGMA page_count;').fetchone()[0]
+            free_pages = connection.execute('PRAGMA freelist_count;').fetchone()[0]
+        if not free_pages or free_pages < page_count * constants.DATABASE_VACUUM_FREE_RATIO:
+            return False
+
+        # VACUUM cannot be run within a transaction
+        connection = sqlite3.connect(
+            self._database_path, timeout=constants.DATABASE_TIMEOUT, isolation_level=None)
+        try:
+            connection.execute('VACUUM;')
+        except sqlite3.OperationalError:
+            self._handle_sqlite_error()
+            raise
+        finally:
+            connection.close()
+        return True
 
     # ----------------------------------------------------------------------
     def _handle_sqlite_error(self):
@@ -148,12 +217,17 @@ class DatabaseCache(Cache):
             six.reraise(DatabaseLockedError, DatabaseLockedError(e), traceback)
 
     # ----------------------------------------------------------------------
-    def get_queued_events(self):
-        query_fetch = 'SELECT `event_id`, `event_text` FROM `event` WHERE `pending_delete` = 0;'
+    def get_queued_events(self, limit=None):
+        query_fetch = 'SELECT `event_id`, `event_text`, `created` FROM `event` ' \
+            'WHERE `pending_delete` = 0'
         query_update_base = 'UPDATE `event` SET `pending_delete`=1 WHERE `event_id` IN (%s);'
+        parameters = ()
+        if limit is not None:
+            query_fetch += ' ORDER BY `event_id` LIMIT ?'
+            parameters = (limit,)
         with self._connect() as connection:
             cursor = connection.cursor()
-            cursor.execute(query_fetch)
+            cursor.execute(query_fetch, parameters)
             events = cursor.fetchall()
             self._bulk_update_events(cursor, events, query_update_base)
         self._stats.unbuffer(len(events))
@@ -186,16 +260,45 @@ class DatabaseCache(Cache):
             cursor = connection.cursor()
             cursor.execute(query_delete)
 
+    # ----------------------------------------------------------------------
+    def delete_events(self, events):
+        query_delete_base = 'DELETE FROM `event` WHERE `event_id` IN (%s);'
+        with self._connect() as connection:
+            cursor = connection.cursor()
+            self._bulk_update_events(cursor, events, query_delete_base)
+
+    # ----------------------------------------------------------------------
+    def complete_queued_events(self, events, sent_count):
+        query_delete_base = 'DELETE FROM `event` WHERE `event_id` IN (%s);'
+        query_update_base = 'UPDATE `event` SET `pending_delete`=0 WHERE `event_id` IN (%s);'
+        with self._connect() as connection:
+            cursor = connection.cursor()
+            self._bulk_update_events(cursor, events[:sent_count], query_delete_base)
+            n = self._bulk_update_events(cursor, events[sent_count:], query_update_base)
+            if n > 0:
+                self._stats.buffer(n)
+
     # ----------------------------------------------------------------------
     def expire_events(self):
         if self._event_ttl is None:
-            return
+            return 0
 
-        query_delete = "DELETE FROM `event` WHERE `entry_date` < datetime('now', '-{} seconds');" \
+        # events being sent (pending_delete=1) or replayed are not expired, they would be
+        # delivered twice if the send succeeds
+        condition = "`pending_delete` = 0 AND `entry_date` < datetime('now', '-{} seconds')" \
             .format(self._event_ttl)
+        expired = []
         with self._connect() as connection:
             cursor = connection.cursor()
-            cursor.execute(query_delete)
+            if self.spool is not None:
+                # within the same transaction, so no other process claims them meanwhile
+                expired = [row[0] for row in cursor.execute(
+                    'SELECT `event_text` FROM `event` WHERE {};'.format(condition))]
+            cursor.execute('DELETE FROM `event` WHERE {};'.format(condition))
             numDeleted = cursor.rowcount
             if numDeleted > 0:
                 self._stats.discard(numDeleted)
+        # spool after committing, not while holding the database lock
+        for event in expired:
+            self.spool.add(event, REASON_EXPIRED)
+        return max(numDeleted, 0)
@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+#
+# This software may be modified and distributed under the terms
+# of the MIT license.  See the LICENSE file for details.
+
+from .utils import monotonic
+
+
+class AdaptiveFlushController(object):
+    """Choose the flush interval and flush count (batch size) of a worker at runtime.
+
+    The controller measures the arrival rate of events and the duration of successful sends
+    (both as exponentially weighted moving averages):
+
+    * the flush interval is chosen so that sending takes about `target_utilization` of the
+      time, i.e. slow sends lead to fewer, larger batches; it is kept within
+      `min_interval` and `max_latency` so that events are not held back too long
+    * if the backlog is larger than one batch, the worker is behind and the interval
+      drops to `min_interval` until the backlog is sent
+    * the flush count is the number of events expected to arrive within one interval,
+      kept within `min_count` and `max_count`, so bursts are sent in larger batches
+      while quiet periods are flushed by the (short) interval
+
+    :param min_interval: Lower bound of the flush interval in seconds
+    :param max_latency: Upper bound of the flush interval in seconds
+    :param min_count: Lower bound of the flush count
+    :param max_count: Upper bound of the flush count
+    :param target_utilization: Fraction of the time to be spent sending
+    :param smoothing: Weight of the latest measurement in the moving averages
+    :param clock: Function returning the current (monotonic) time in seconds
+    """
+
+    RATE_WINDOW = 1.0
+
+    # ----------------------------------------------------------------------
+    def __init__(self, min_interval=1.0, max_latency=10.0, min_count=10, max_count=5000,
+                 target_utilization=0.5, smoothing=0.3, clock=monotonic):
+        self._min_interval = min_interval
+        self._max_latency = max_latency
+        self._min_count = min_count
+        self._max_count = max_count
+        self._target_utilization = target_utilization
+        self._smoothing = smoothing
+        self._clock = clock
+        self._arrivals = 0
+        self._window_start = clock()
+        self._arrival_rate = None
+        self._send_duration = None
+        self.interval = max_latency
+        self.count = min_count
+
+    # ----------------------------------------------------------------------
+    @property
+    def arrival_rate(self):
+        return self._arrival_rate or 0.0
+
+    # ----------------------------------------------------------------------
+    @property
+    def send_duration(self):
+        return self._send_duration or 0.0
+
+    # ----------------------------------------------------------------------
+    def record_arrival(self, n=1):
+        self._arrivals += n
+
+    # ----------------------------------------------------------------------
+    def record_send(self, duration):
+        self._send_duration = self._average(self._send_duration, duration)
+
+    # ----------------------------------------------------------------------
+    def update(self, backlog):
+        """Recompute `interval` and `count`.
+
+        :param backlog: Number of events received but not yet sent
+        """
+        now = self._clock()
+        elapsed = now - self._window_start
+        if elapsed >= self.RATE_WINDOW:
+            self._arrival_rate = self._average(self._arrival_rate, self._arrivals / elapsed)
+            self._arrivals = 0
+            self._window_start = now
+
+        interval = self.send_duration / self._target_utilization
+        interval = min(self._max_latency, max(self._min_interval, interval))
+        count = int(self.arrival_rate * interval)
+        count = min(self._max_count, max(self._min_count, count))
+        if backlog > count:
+            interval = self._min_interval
+        self.interval = interval
+        self.count = count
+
+    # ----------------------------------------------------------------------
+    def _average(self, average, value):
+        if average is None:
+            return float(value)
+        return self._smoothing * value + (1 - self._smoothing) * average
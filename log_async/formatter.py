@@ -12,10 +12,15 @@ import traceback
 import uuid
 
 from six import integer_types, string_types, text_type
+from six.moves import reprlib
 
 import log_async
 
 from .constants import constants
+from .framing import DelimiterFraming, LengthPrefixFraming
+from .stack_trace import StackTraceCache
+from .stats import Counter, StatsCollector
+from .templates import TEMPLATE_ARGS_FIELD, TEMPLATE_ID_FIELD, TEMPLATE_TEXT_FIELD, TemplateRegistry
 
 
 try:
@@ -24,6 +29,103 @@ except ImportError:
     import json
 
 
+class FormatterStats(StatsCollector):
+
+    def __init__(self, prefix):
+        super(FormatterStats, self).__init__(prefix)
+        self._truncated = Counter(prefix + "truncated_total",
+                                  "events truncated to fit the configured size limits")
+        self._trace_cache_hits = Counter(prefix + "stack_trace_cache_hits_total",
+                                         "stack traces taken from the cache")
+        self._trace_dedups = Counter(prefix + "stack_trace_deduplicated_total",
+                                     "stack traces replaced by their fingerprint")
+        self._all.extend([self._truncated, self._trace_cache_hits, self._trace_dedups])
+
+    def truncated(self, n=1):
+        self._truncated.inc(n)
+
+    def stack_trace_cache_hit(self, n=1):
+        self._trace_cache_hits.inc(n)
+
+    def stack_trace_deduplicated(self, n=1):
+        self._trace_dedups.inc(n)
+
+
+class SizeLimiter(object):
+    """Enforces the size limits of a single event while its fields are being converted.
+
+    `max_event_bytes` is tracked as a budget which is consumed by every string and scalar
+    added to the event. The accounting is an estimate (JSON escaping is not considered),
+    the formatter checks the final size again after serialization.
+    """
+
+    # rough serialized size of scalars, separators and quotes
+    SCALAR_SIZE = 8
+    ITEM_OVERHEAD = 4
+
+    # ----------------------------------------------------------------------
+    def __init__(self, max_event_bytes=None, max_string_length=None,
+                 max_collection_length=None, max_depth=None):
+        self.max_string_length = max_string_length
+        self.max_collection_length = max_collection_length
+        self.max_depth = max_depth
+        self.remaining = max_event_bytes
+        self.truncated = False
+        self._repr = reprlib.Repr()
+        if max_string_length is not None:
+            self._repr.maxstring = max_string_length
+            self._repr.maxother = max_string_length
+
+    # ----------------------------------------------------------------------
+    def exhausted(self):
+        return self.remaining is not None and self.remaining <= 0
+
+    # ----------------------------------------------------------------------
+    def consume(self, nbytes):
+        if self.remaining is not None:
+            self.remaining -= nbytes
+
+    # ----------------------------------------------------------------------
+    def string(self, value, keep_tail=False):
+        limit = self.max_string_length
+        if self.remaining is not None:
+            budget = max(self.remaining - self.ITEM_OVERHEAD, 0)
+            limit = budget if limit is None else min(limit, budget)
+        if limit is not None and len(value) > limit:
+            self.truncated = True
+            marker = constants.FORMATTER_TRUNCATION_MARKER
+            keep = max(limit - len(marker), 0)
+            if keep_tail:
+                value = marker + value[len(value) - keep:]
+            else:
+                value = value[:keep] + marker
+        self.consume(len(value) + self.ITEM_OVERHEAD)
+        return value
+
+    # ----------------------------------------------------------------------
+    def repr(self, value):
+        return self.string(self._repr.repr(value))
+
+    # ----------------------------------------------------------------------
+    def items(self, items):
+        """Yield the items of a collection which fit into the limits"""
+        for index, item in enumerate(items):
+            if self.max_collection_length is not None and index >= self.max_collection_length:
+                self.truncated = True
+                return
+            if self.exhausted():
+                self.truncated = True
+                return
+            yield item
+
+    # ----------------------------------------------------------------------
+    def too_deep(self, depth):
+        if self.max_depth is not None and depth > self.max_depth:
+            self.truncated = True
+            return True
+        return False
+
+
 class LogstashFormatter(logging.Formatter):
 
     # ----------------------------------------------------------------------
@@ -34,19 +136,45 @@ class LogstashFormatter(logging.Formatter):
             fqdn=False,
             extra_prefix='extra',
             extra=None,
-            ensure_ascii=True):
+            ensure_ascii=True,
+            max_event_bytes=None,
+            max_string_length=None,
+            max_collection_length=None,
+            max_depth=None,
+            stack_trace_cache_size=None,
+            stack_trace_dedup_window=None,
+            template_encoding=False,
+            template_refresh_interval=300):
         super(LogstashFormatter, self).__init__()
         self._message_type = message_type
         self._tags = tags if tags is not None else []
         self._extra_prefix = extra_prefix
         self._extra = extra
         self._ensure_ascii = ensure_ascii
+        self._max_event_bytes = max_event_bytes
+        self._max_string_length = max_string_length
+        self._max_collection_length = max_collection_length
+        self._max_depth = max_depth
+        self._limits_enabled = any(limit is not None for limit in (
+            max_event_bytes, max_string_length, max_collection_length, max_depth))
+        self._stats = FormatterStats(constants.FORMATTER_STATS_PREFIX)
+        self._stack_trace_cache = None
+        if stack_trace_cache_size or stack_trace_dedup_window is not None:
+            self._stack_trace_cache = StackTraceCache(
+                max_size=stack_trace_cache_size or constants.FORMATTER_STACK_TRACE_CACHE_SIZE,
+                dedup_window=stack_trace_dedup_window)
+        self._template_registry = None
+        if template_encoding:
+            self._template_registry = TemplateRegistry(refresh_interval=template_refresh_interval)
 
         self._interpreter = None
         self._interpreter_version = None
         self._host = None
         self._logsource = None
         self._program_name = None
+        self._envelope = None
+        self._static_extra_fields = None
+        self._batch_framing = DelimiterFraming(b'\n')
 
         # fetch static information and process related information already
         # as they won't change during lifetime
@@ -55,6 +183,7 @@ class LogstashFormatter(logging.Formatter):
         self._prefetch_host(fqdn)
         self._prefetch_logsource()
         self._prefetch_program_name()
+        self._prefetch_envelope()
 
     # ----------------------------------------------------------------------
     def _prefetch_interpreter(self):
@@ -88,26 +217,172 @@ class LogstashFormatter(logging.Formatter):
         self._program_name = sys.argv[0]
 
     # ----------------------------------------------------------------------
-    def format(self, record):
-        message = {
-            '@timestamp': self._format_timestamp(record.created),
+    def _prefetch_envelope(self):
+        """Prepare the static top-level and extra fields shared by all events"""
+        self._envelope = {
             '@version': '1',
             'host': self._host,
-            'level': record.levelname,
             'logsource': self._logsource,
-            'message': record.getMessage(),
-            'pid': record.process,
             'program': self._program_name,
             'type': self._message_type,
         }
         if self._tags:
-            message['tags'] = self._tags
+            self._envelope['tags'] = self._tags
+        self._static_extra_fields = {
+            'interpreter': self._interpreter,
+            'interpreter_version': self._interpreter_version,
+            'log_async_version': log_async.__version__,
+        }
 
+    # ----------------------------------------------------------------------
+    def format(self, record):
+        limiter = self._create_size_limiter()
+        message = self._get_message(record, dict(self._envelope), limiter)
+        if limiter is None:
+            serialized = self._serialize(message)
+        else:
+            if self._max_event_bytes is not None and self._get_sent_template(message) and \
+                    len(self._serialize(message)) > self._max_event_bytes:
+                # the minimal event sent instead would lose the template and its arguments,
+                # send (as much as fits of) the message instead
+                limiter = self._create_size_limiter()
+                message = self._get_message(
+                    record, dict(self._envelope), limiter, template_encoding=False)
+            serialized = self._serialize_limited(message, limiter)
+        self._announce_template(message)
+        return serialized
+
+    # ----------------------------------------------------------------------
+    def format_batch(self, records, framing=None):
+        """Format multiple records at once into a single buffer.
+
+        The static top-level fields (host, program, type, ...) are serialized once per batch
+        and the serializer is set up once, unless size limits are configured (then each
+        record is formatted with format()).
+
+        :param records: iterable of LogRecord instances
+        :param framing: framing to delimit the events, newline delimited (NDJSON) for the JSON
+                        formatters and length prefixed for the binary formatters by default
+        :return: bytes (str on Python 2) containing all framed events
+        """
+        buffer_, _ = self._format_batch(records, framing)
+        return bytes(buffer_)
+
+    # ----------------------------------------------------------------------
+    def format_batch_events(self, records, framing=None):
+        """Like format_batch(), but return the framed events one by one, e.g. to cache them
+
+        :return: list of bytes (str on Python 2), one framed event per record
+        """
+        buffer_, ends = self._format_batch(records, framing)
+        events = []
+        start = 0
+        for end in ends:
+            events.append(bytes(buffer_[start:end]))
+            start = end
+        return events
+
+    # ----------------------------------------------------------------------
+    def _format_batch(self, records, framing):
+        framing = framing if framing is not None else self._batch_framing
+        frame_into = framing.frame_into
+        if self._limits_enabled or type(self).format is not LogstashFormatter.format:
+            format_record = self.format
+        else:
+            format_record = self._create_batch_formatter()
+        buffer_ = bytearray()
+        ends = []
+        for record in records:
+            frame_into(buffer_, format_record(record))
+            ends.append(len(buffer_))
+        return buffer_, ends
+
+    # ----------------------------------------------------------------------
+    def _create_batch_formatter(self):
+        """
+        :return: Function formatting a record like format(), with the state shared by the
+                 records of a batch prepared once
+        """
+        envelope = self._envelope
+        if type(self)._serialize is not LogstashFormatter._serialize:
+            serialize = self._create_batch_serializer()
+
+            def serialize_record(record):
+                message = self._get_message(record, dict(envelope))
+                serialized = serialize(message)
+                self._announce_template(message)
+                return serialized
+
+            return serialize_record
+
+        encode = self._create_json_encoder()
+        # the serialized envelope without its closing brace, the fields of each record
+        # are appended to it
+        prefix = encode(envelope)[:-1] + ', '
+
+        def format_record(record):
+            message = self._get_message(record, {})
+            if any(key in envelope for key in message):
+                # record fields replace fields of the envelope
+                full = dict(envelope)
+                full.update(message)
+                text = encode(full)
+            else:
+                text = prefix + encode(message)[1:]
+            self._announce_template(message)
+            if sys.version_info < (3, 0):
+                return text
+            return text.encode('utf-8')
+
+        return format_record
+
+    # ----------------------------------------------------------------------
+    def _create_batch_serializer(self):
+        """Override when needed
+
+        :return: Function serializing a message, e.g. reusing a packer for a batch
+        """
+        return self._serialize
+
+    # ----------------------------------------------------------------------
+    def _create_json_encoder(self):
+        if sys.version_info < (3, 0):
+            return json.dumps
+        if hasattr(json, 'JSONEncoder'):
+            return json.JSONEncoder(ensure_ascii=self._ensure_ascii).encode
+        return lambda message: json.dumps(message, ensure_ascii=self._ensure_ascii)
+
+    # ----------------------------------------------------------------------
+    def _get_message(self, record, message, limiter=None, template_encoding=True):
+        """Add the fields of `record` to `message`, which contains the envelope (or nothing)"""
+        message['@timestamp'] = self._format_timestamp(record.created)
+        message['level'] = record.levelname
+        message['pid'] = record.process
+        template_fields = None
+        if template_encoding:
+            template_fields = self._get_template_fields(record, limiter)
+        if template_fields is None:
+            message['message'] = record.getMessage()
+        if limiter is not None:
+            text = message.pop('message', None)
+            limiter.consume(len(self._serialize(message)))
+            if text is not None:
+                message['message'] = limiter.string(text)
+
+        # prepare dynamic extra fields, these come first so that the stack trace
+        # takes precedence over arbitrary record fields when the size budget is tight
+        extra_fields = self._get_extra_fields(record)
+        if limiter is not None:
+            extra_fields = self._limit_extra_fields(extra_fields, limiter)
+        if template_fields is not None:
+            if limiter is not None:
+                limiter.consume(len(self._serialize(template_fields)))
+            extra_fields.update(template_fields)
         # record fields
-        record_fields = self._get_record_fields(record)
+        record_fields = self._get_record_fields(record, limiter)
         message.update(record_fields)
-        # prepare dynamic extra fields
-        extra_fields = self._get_extra_fields(record)
+        if limiter is not None and limiter.truncated:
+            extra_fields['truncated'] = True
         # wrap extra fields in configurable namespace
         if self._extra_prefix:
             message[self._extra_prefix] = extra_fields
@@ -116,8 +391,92 @@ class LogstashFormatter(logging.Formatter):
 
         # move existing extra record fields into the configured prefix
         self._move_extra_record_fields_to_prefix(message)
+        return message
+
+    # ----------------------------------------------------------------------
+    def reset_after_fork(self):
+        if self._stack_trace_cache is not None:
+            self._stack_trace_cache.reset_after_fork()
+        if self._template_registry is not None:
+            self._template_registry.reset_after_fork()
+
+    # ----------------------------------------------------------------------
+    def get_stats(self):
+        return self._stats.get_stats()
+
+    # ----------------------------------------------------------------------
+    def _create_size_limiter(self):
+        if not self._limits_enabled:
+            return None
+        return SizeLimiter(
+            max_event_bytes=self._max_event_bytes,
+            max_string_length=self._max_string_length,
+            max_collection_length=self._max_collection_length,
+            max_depth=self._max_depth)
+
+    # ----------------------------------------------------------------------
+    def _get_template_fields(self, record, limiter=None):
+        """Replace the interpolated message by the id of the message template and its
+        arguments if template encoding is enabled. The template text is only included
+        the first time (per refresh interval) a template is used.
+
+        Arguments which are not JSON types are sent as their `str()`. If the message
+        cannot be rebuilt from the converted arguments exactly (e.g. `%r` or `%x` of an
+        object) or it would have to be truncated, the message is sent as usual."""
+        if self._template_registry is None or not record.args or \
+                not isinstance(record.msg, string_types):
+            return None
+        args = self._get_template_args(record.args)
+        if args is None:
+            return None
+        message = record.getMessage()
+        try:
+            if record.msg % args != message:
+                return None
+        except (TypeError, ValueError, KeyError):
+            return None
+        if limiter is not None and limiter.max_string_length is not None and \
+                len(message) > limiter.max_string_length:
+            return None
+        # the template is recorded as sent by _announce_template() once the event is complete
+        id_, send_text = self._template_registry.lookup(record.msg, announce=False)
+        fields = {TEMPLATE_ID_FIELD: id_, TEMPLATE_ARGS_FIELD: args}
+        if send_text:
+            fields[TEMPLATE_TEXT_FIELD] = record.msg
+        return fields
+
+    # ----------------------------------------------------------------------
+    def _get_sent_template(self, message):
+        """
+        :return: Id of the template whose text is included in the formatted `message`, if any
+        """
+        if self._template_registry is None:
+            return None
+        fields = message.get(self._extra_prefix) if self._extra_prefix else message
+        if not isinstance(fields, dict) or TEMPLATE_TEXT_FIELD not in fields:
+            return None
+        return fields.get(TEMPLATE_ID_FIELD)
+
+    # ----------------------------------------------------------------------
+    def _announce_template(self, message):
+        id_ = self._get_sent_template(message)
+        if id_ is not None:
+            self._template_registry.announce(id_)
 
-        return self._serialize(message)
+    # ----------------------------------------------------------------------
+    def _get_template_args(self, args):
+        """
+        :return: The arguments converted to JSON types, None if they cannot be converted
+        """
+        easy_types = (bool, float, type(None)) + string_types + integer_types
+        if isinstance(args, dict):
+            if not all(isinstance(key, string_types) for key in args):
+                return None
+            return {key: value if isinstance(value, easy_types) else text_type(value)
+                    for key, value in args.items()}
+        if not isinstance(args, tuple):
+            return None
+        return tuple(arg if isinstance(arg, easy_types) else text_type(arg) for arg in args)
 
     # ----------------------------------------------------------------------
     def _format_timestamp(self, time_):
@@ -125,51 +484,99 @@ class LogstashFormatter(logging.Formatter):
         return tstamp.strftime("%Y-%m-%dT%H:%M:%S") + ".%03d" % (tstamp.microsecond / 1000) + "Z"
 
     # ----------------------------------------------------------------------
-    def _get_record_fields(self, record):
-        def value_repr(value):
-            easy_types = (bool, float, type(None)) + string_types + integer_types
-
-            if isinstance(value, dict):
-                return {k: value_repr(v) for k, v in value.items()}
-            elif isinstance(value, (tuple, list)):
-                return [value_repr(v) for v in value]
-            elif isinstance(value, (datetime, date)):
-                return self._format_timestamp(time.mktime(value.timetuple()))
-            elif isinstance(value, uuid.UUID):
-                return value.hex
-            elif isinstance(value, easy_types):
-                return value
-            else:
-                return repr(value)
+    def _value_repr(self, value, limiter=None, depth=0):
+        easy_types = (bool, float, type(None)) + string_types + integer_types
+
+        if limiter is not None:
+            if isinstance(value, (dict, tuple, list)) and limiter.too_deep(depth + 1):
+                return constants.FORMATTER_TRUNCATION_MARKER
+            if isinstance(value, string_types):
+                return limiter.string(value)
+            limiter.consume(limiter.SCALAR_SIZE)
+
+        if isinstance(value, dict):
+            if limiter is None:
+                return {k: self._value_repr(v) for k, v in value.items()}
+            return {
+                k: self._value_repr(v, limiter, depth + 1)
+                for k, v in limiter.items(value.items())}
+        elif isinstance(value, (tuple, list)):
+            if limiter is None:
+                return [self._value_repr(v) for v in value]
+            return [self._value_repr(v, limiter, depth + 1) for v in limiter.items(value)]
+        elif isinstance(value, (datetime, date)):
+            return self._format_timestamp(time.mktime(value.timetuple()))
+        elif isinstance(value, uuid.UUID):
+            return value.hex
+        elif isinstance(value, easy_types):
+            return value
+        elif limiter is not None:
+            return limiter.repr(value)
+        else:
+            return repr(value)
 
+    # ----------------------------------------------------------------------
+    def _get_record_fields(self, record, limiter=None):
         fields = {}
 
         for key, value in record.__dict__.items():
             if key not in constants.FORMATTER_RECORD_FIELD_SKIP_LIST:
-                fields[key] = value_repr(value)
+                if limiter is not None:
+                    if limiter.exhausted():
+                        limiter.truncated = True
+                        break
+                    limiter.consume(len(key) + limiter.ITEM_OVERHEAD)
+                fields[key] = self._value_repr(value, limiter)
         return fields
 
+    # ----------------------------------------------------------------------
+    def _limit_extra_fields(self, extra_fields, limiter):
+        limited = {}
+        stack_trace = extra_fields.pop('stack_trace', None)
+        if stack_trace is not None:
+            # keep the end of the stack trace, it contains the exception and innermost frames
+            limited['stack_trace'] = limiter.string(stack_trace, keep_tail=True)
+        for key, value in extra_fields.items():
+            if limiter.exhausted():
+                limiter.truncated = True
+                break
+            limiter.consume(len(key) + limiter.ITEM_OVERHEAD)
+            limited[key] = self._value_repr(value, limiter)
+        return limited
+
     # ----------------------------------------------------------------------
     def _get_extra_fields(self, record):
-        extra_fields = {
-            'func_name': record.funcName,
-            'interpreter': self._interpreter,
-            'interpreter_version': self._interpreter_version,
-            'line': record.lineno,
-            'logger_name': record.name,
-            'log_async_version': log_async.__version__,
-            'path': record.pathname,
-            'process_name': record.processName,
-            'thread_name': record.threadName,
-        }
+        extra_fields = dict(self._static_extra_fields)
+        extra_fields['func_name'] = record.funcName
+        extra_fields['line'] = record.lineno
+        extra_fields['logger_name'] = record.name
+        extra_fields['path'] = record.pathname
+        extra_fields['process_name'] = record.processName
+        extra_fields['thread_name'] = record.threadName
         # static extra fields
         if self._extra:
             extra_fields.update(self._extra)
         # exceptions
         if record.exc_info:
-            extra_fields['stack_trace'] = self._format_exception(record.exc_info)
+            if self._stack_trace_cache is not None and isinstance(record.exc_info, tuple):
+                extra_fields.update(self._format_cached_exception(record.exc_info))
+            else:
+                extra_fields['stack_trace'] = self._format_exception(record.exc_info)
         return extra_fields
 
+    # ----------------------------------------------------------------------
+    def _format_cached_exception(self, exc_info):
+        fingerprint, stack_trace, repeats, cache_hit = self._stack_trace_cache.get(exc_info)
+        fields = {'stack_trace_fingerprint': fingerprint}
+        if stack_trace is None:
+            self._stats.stack_trace_deduplicated()
+            fields['stack_trace_repeats'] = repeats
+        else:
+            if cache_hit:
+                self._stats.stack_trace_cache_hit()
+            fields['stack_trace'] = stack_trace
+        return fields
+
     # ----------------------------------------------------------------------
     def _format_exception(self, exc_info):
         if isinstance(exc_info, tuple):
@@ -203,6 +610,98 @@ class LogstashFormatter(logging.Formatter):
         else:
             return bytes(json.dumps(message, ensure_ascii=self._ensure_ascii), 'utf-8')
 
+    # ----------------------------------------------------------------------
+    def _serialize_limited(self, message, limiter):
+        serialized = self._serialize(message)
+        max_event_bytes = self._max_event_bytes
+        if max_event_bytes is None or len(serialized) <= max_event_bytes:
+            if limiter.truncated:
+                self._stats.truncated()
+            return serialized
+
+        # The estimate was off (e.g. due to escaping), fall back to a minimal event
+        # consisting of the top-level fields and as much of the message as fits.
+        self._stats.truncated()
+        minimal = dict(
+            (key, value) for key, value in message.items()
+            if key in constants.FORMATTER_LOGSTASH_MESSAGE_FIELD_LIST)
+        marker = {'truncated': True}
+        if self._extra_prefix:
+            minimal[self._extra_prefix] = marker
+        else:
+            minimal.update(marker)
+        text = minimal.get('message') or u''
+        minimal['message'] = u''
+        overhead = len(self._serialize(minimal))
+        while True:
+            budget = max(max_event_bytes - overhead, 0)
+            minimal['message'] = text[:budget]
+            serialized = self._serialize(minimal)
+            if len(serialized) <= max_event_bytes or not minimal['message']:
+                return serialized
+            # escaped characters take more space than accounted for, shrink further
+            text = text[:max(budget - (len(serialized) - max_event_bytes), 0)]
+
+
+class MsgpackLogstashFormatter(LogstashFormatter):
+    """LogstashFormatter emitting MessagePack instead of JSON.
+
+    MessagePack is self-delimiting, so use it either without any framing for Logstash's
+    msgpack codec or with `log_async.framing.LengthPrefixFraming` for receivers which
+    need the event boundaries up front. Requires the `msgpack` package.
+    """
+
+    # ----------------------------------------------------------------------
+    def __init__(self, *args, **kwargs):
+        self._packb = None
+        self._unpackb = None
+        self._packer_class = None
+        self._import_serializer()
+        super(MsgpackLogstashFormatter, self).__init__(*args, **kwargs)
+        self._batch_framing = LengthPrefixFraming()
+
+    # ----------------------------------------------------------------------
+    def _import_serializer(self):
+        import msgpack
+        self._packb = msgpack.packb
+        self._unpackb = msgpack.unpackb
+        self._packer_class = msgpack.Packer
+
+    # ----------------------------------------------------------------------
+    def _serialize(self, message):
+        return self._packb(message, use_bin_type=True)
+
+    # ----------------------------------------------------------------------
+    def _create_batch_serializer(self):
+        if type(self)._serialize is not MsgpackLogstashFormatter._serialize:
+            return self._serialize
+        # one packer (and its internal buffer) for all events of the batch
+        return self._packer_class(use_bin_type=True).pack
+
+    # ----------------------------------------------------------------------
+    def deserialize(self, data):
+        """Decode an event produced by this formatter, e.g. in tests or local receivers"""
+        return self._unpackb(data, raw=False)
+
+
+class CborLogstashFormatter(MsgpackLogstashFormatter):
+    """LogstashFormatter emitting CBOR (RFC 7049) instead of JSON. Requires the `cbor2` package.
+    """
+
+    # ----------------------------------------------------------------------
+    def _import_serializer(self):
+        import cbor2
+        self._packb = cbor2.dumps
+        self._unpackb = cbor2.loads
+
+    # ----------------------------------------------------------------------
+    def _serialize(self, message):
+        return self._packb(message)
+
+    # ----------------------------------------------------------------------
+    def deserialize(self, data):
+        return self._unpackb(data)
+
 
 class DjangoLogstashFormatter(LogstashFormatter):
 
@@ -0,0 +1,146 @@
+# -*- coding: utf-8 -*-
+#
+# This software may be modified and distributed under the terms
+# of the MIT license.  See the LICENSE file for details.
+
+from threading import Event, Thread
+import errno
+import os
+import select
+import socket
+
+from .framing import LengthPrefixFraming
+from .utils import safe_log_via_print
+
+
+class LocalForwarder(Thread):
+    """Accept events from other processes on a Unix domain socket and pass them to a callback.
+
+    The events are expected to be sent length prefixed (see `log_async.framing`), e.g. by
+    `log_async.transport.UnixSocketTransport`. Used by AsynchronousLogHandler to let forked
+    child processes forward their events to the parent process, which then is the only
+    process connecting to the log forwarding server.
+
+    :param path: Path of the Unix domain socket to listen on, an existing file is replaced
+    :param enqueue: Callable receiving each event
+    """
+
+    POLL_INTERVAL = 0.5
+
+    # ----------------------------------------------------------------------
+    def __init__(self, path, enqueue):
+        super(LocalForwarder, self).__init__()
+        self.daemon = True
+        self.name = self.__class__.__name__
+        self._path = path
+        self._enqueue = enqueue
+        self._shutdown_event = Event()
+        self._server = None
+        self._clients = {}
+        self._owner_pid = os.getpid()
+
+    # ----------------------------------------------------------------------
+    @property
+    def path(self):
+        return self._path
+
+    # ----------------------------------------------------------------------
+    def listen(self):
+        """Create the listening socket, call before the thread is started (and before forking)
+        so that child processes can connect right away"""
+        if self._server is not None:
+            return
+        self._unlink()
+        server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        server.bind(self._path)
+        server.listen(128)
+        server.setblocking(False)
+        self._server = server
+
+    # ----------------------------------------------------------------------
+    def start(self):
+        self.listen()
+        super(LocalForwarder, self).start()
+
+    # ----------------------------------------------------------------------
+    def shutdown(self):
+        self._shutdown_event.set()
+
+    # ----------------------------------------------------------------------
+    def run(self):
+        try:
+            while not self._shutdown_event.is_set():
+                self._poll()
+            # drain data already sent by clients before closing
+            while self._poll(timeout=0):
+                pass
+        except Exception as e:
+            safe_log_via_print('exception', u'Local event forwarder failed: %s', e)
+        finally:
+            self._close()
+
+    # ----------------------------------------------------------------------
+    def _poll(self, timeout=POLL_INTERVAL):
+        sockets = [self._server] + list(self._clients)
+        readable, _, _ = select.select(sockets, [], [], timeout)
+        for sock in readable:
+            if sock is self._server:
+                self._accept()
+            else:
+                self._read(sock)
+        return len(readable)
+
+    # ----------------------------------------------------------------------
+    def _accept(self):
+        try:
+            client, _ = self._server.accept()
+        except socket.error as e:
+            if e.errno in (errno.EAGAIN, errno.EWOULDBLOCK):
+                return
+            raise
+        client.setblocking(False)
+        self._clients[client] = LengthPrefixFraming().decoder()
+
+    # ----------------------------------------------------------------------
+    def _read(self, client):
+        try:
+            data = client.recv(65536)
+        except socket.error as e:
+            if e.errno in (errno.EAGAIN, errno.EWOULDBLOCK):
+                return
+            data = b''
+        if not data:
+            self._clients.pop(client, None)
+            client.close()
+            return
+        for event in self._clients[client].feed(data):
+            self._enqueue(event)
+
+    # ----------------------------------------------------------------------
+    def _close(self):
+        for client in list(self._clients):
+            client.close()
+        self._clients.clear()
+        if self._server is not None:
+            self._server.close()
+            self._server = None
+        if os.getpid() == self._owner_pid:
+            self._unlink()
+
+    # ----------------------------------------------------------------------
+    def reset_after_fork(self):
+        """Close the inherited sockets in a forked child without removing the socket file,
+        which still belongs to the parent process"""
+        for client in list(self._clients):
+            client.close()
+        self._clients.clear()
+        if self._server is not None:
+            self._server.close()
+            self._server = None
+
+    # ----------------------------------------------------------------------
+    def _unlink(self):
+        try:
+            os.unlink(self._path)
+        except OSError:
+            pass
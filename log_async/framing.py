@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+#
+# This software may be modified and distributed under the terms
+# of the MIT license.  See the LICENSE file for details.
+
+import struct
+
+
+class DelimiterFraming(object):
+    """Terminate each event with a delimiter, e.g. a newline for JSON lines.
+    An empty delimiter sends the events as they are (e.g. for self-delimiting
+    encodings like MessagePack read by Logstash's msgpack codec).
+
+    :param delimiter: bytes (str on Python 2) appended to each event
+    """
+
+    # ----------------------------------------------------------------------
+    def __init__(self, delimiter=b'\n'):
+        self._delimiter = delimiter
+
+    # ----------------------------------------------------------------------
+    def frame(self, data):
+        if len(self._delimiter):
+            return data + self._delimiter
+        return data
+
+    # ----------------------------------------------------------------------
+    def frame_into(self, buffer_, data):
+        buffer_ += data
+        buffer_ += self._delimiter
+
+    # ----------------------------------------------------------------------
+    def decoder(self):
+        return DelimiterDecoder(self._delimiter)
+
+
+class LengthPrefixFraming(object):
+    """Prefix each event with its length as 4 byte unsigned integer in network byte order.
+    Suitable for binary encodings which may contain any delimiter."""
+
+    HEADER = struct.Struct('>I')
+
+    # ----------------------------------------------------------------------
+    def frame(self, data):
+        return self.HEADER.pack(len(data)) + data
+
+    # ----------------------------------------------------------------------
+    def frame_into(self, buffer_, data):
+        buffer_ += self.HEADER.pack(len(data))
+        buffer_ += data
+
+    # ----------------------------------------------------------------------
+    def decoder(self):
+        return LengthPrefixDecoder()
+
+
+class DelimiterDecoder(object):
+    """Incrementally split a byte stream into events terminated by a delimiter"""
+
+    # ----------------------------------------------------------------------
+    def __init__(self, delimiter=b'\n'):
+        if not len(delimiter):
+            raise ValueError('cannot split a stream without delimiter')
+        self._delimiter = delimiter
+        self._buffer = bytearray()
+
+    # ----------------------------------------------------------------------
+    def feed(self, data):
+        """Add received data and return the list of completely received events"""
+        self._buffer += data
+        events = []
+        start = 0
+        while True:
+            end = self._buffer.find(self._delimiter, start)
+            if end < 0:
+                break
+            events.append(bytes(self._buffer[start:end]))
+            start = end + len(self._delimiter)
+        del self._buffer[:start]
+        return events
+
+    # ----------------------------------------------------------------------
+    def pending(self):
+        return len(self._buffer)
+
+
+class LengthPrefixDecoder(object):
+    """Incrementally split a byte stream into length prefixed events"""
+
+    # ----------------------------------------------------------------------
+    def __init__(self):
+        self._buffer = bytearray()
+
+    # ----------------------------------------------------------------------
+    def feed(self, data):
+        """Add received data and return the list of completely received events"""
+        self._buffer += data
+        header = LengthPrefixFraming.HEADER
+        events = []
+        start = 0
+        while len(self._buffer) - start >= header.size:
+            length, = header.unpack_from(self._buffer, start)
+            end = start + header.size + length
+            if end > len(self._buffer):
+                break
+            events.append(bytes(self._buffer[start + header.size:end]))
+            start = end
+        del self._buffer[:start]
+        return events
+
+    # ----------------------------------------------------------------------
+    def pending(self):
+        return len(self._buffer)
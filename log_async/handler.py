@@ -4,18 +4,61 @@
 # of the MIT license.  See the LICENSE file for details.
 
 from logging import Handler
+import os
+import tempfile
+import weakref
 
 from six import PY2, PY3, string_types, text_type
 
+from .constants import constants
 from .database import DatabaseCache
 from .formatter import LogstashFormatter
+from .forwarder import LocalForwarder
+from .framing import DelimiterFraming
+from .hooks import hooks
 from .memory_cache import MemoryCache
-from .utils import import_string, safe_log_via_print
+from .stats import Histogram, StatsCollector
+from .transport import UnixSocketTransport
+from .utils import import_string, monotonic, safe_log_via_print
 from .worker import LogProcessingWorker
 
 
 _default_terminator = PY2 and '\n' or b'\n'
 
+FORK_MODE_RESTART = 'restart'
+FORK_MODE_FORWARD = 'forward'
+
+# all handlers of this process, to re-initialize them in forked child processes
+_handlers = weakref.WeakSet()
+_fork_hook_available = hasattr(os, 'register_at_fork')
+
+
+class HandlerStats(StatsCollector):
+
+    def __init__(self, prefix):
+        super(HandlerStats, self).__init__(prefix)
+        self._emit_seconds = Histogram(prefix + "emit_seconds", "time spent by callers in emit()")
+        self._all.extend([self._emit_seconds])
+
+    def emit(self, duration):
+        self._emit_seconds.observe(duration)
+
+
+# ----------------------------------------------------------------------
+def get_handlers():
+    """All AsynchronousLogHandler instances of this process (which were not garbage collected)"""
+    return list(_handlers)
+
+
+# ----------------------------------------------------------------------
+def _reinit_handlers_after_fork():
+    for handler in list(_handlers):
+        handler._reinit_after_fork()
+
+
+if _fork_hook_available:
+    os.register_at_fork(after_in_child=_reinit_handlers_after_fork)
+
 
 class ProcessingError(Exception):
     """"""
@@ -42,15 +85,41 @@ class AsynchronousLogHandler(Handler):
     :param formatter: Formatter to turn event into byte array (in PY2, into a string)
     :param delimeter: Delimiter to be sent after each message
     :param buffer: Implementation of log_async.Cache
+    :param framing: How events are delimited on the wire, e.g.
+                    log_async.framing.LengthPrefixFraming for binary formatters.
+                    Defaults to terminating each event with `terminator`.
+    :param worker_pool: Optional log_async.worker.WorkerPool to share one worker thread (with
+                        the transport and buffer of the first handler) between all handlers
+                        sending to the same host and port with the same transport, SSL and
+                        buffer configuration. By default, each handler owns its worker thread.
+    :param fork_mode: Behaviour in forked child processes: 'restart' (default) starts a fresh
+                      worker, transport and buffer in each child, 'forward' makes children
+                      forward their events over a Unix domain socket to the process which
+                      created the handler, which is then the only one connecting to the
+                      log forwarding server.
+    :param forward_socket_path: Path of the Unix domain socket used with fork_mode 'forward'
+                                (default is a file in the temporary directory)
+    :param shipper: Run buffer, flush loop and transport in a separate shipper process which
+                    is fed through a shared memory ring buffer (Python 3.8+, the process is
+                    forked regardless of the multiprocessing start method)
+    :param shipper_ring_size: Capacity in bytes of the shipper's ring buffer
+    :param spool: log_async.spool.DeadLetterSpool receiving the events which overflow or expire
+                  in the buffer created by the handler (pass it to the cache when using
+                  `buffer`) and the events rejected by the transport. It is closed on
+                  shutdown and its statistics are included in get_stats().
+    :param deferred_formatting: Only queue the log records in emit(), the worker thread formats
+                                them a batch at a time with the formatter's
+                                format_batch_events() (e.g. LogstashFormatter). Not supported
+                                with `worker_pool` and `shipper`.
     """
 
-    _worker_thread = None
-
     # ----------------------------------------------------------------------
     def __init__(self, host, port, database_path=None, transport='log_async.transport.TcpTransport',
                  ssl_enable=False, ssl_verify=True, keyfile=None, certfile=None, ca_certs=None,
                  enable=True, event_ttl=None, encoding='utf-8',
-                 formatter=None, buffer=None, terminator=_default_terminator):
+                 formatter=None, buffer=None, terminator=_default_terminator, framing=None,
+                 worker_pool=None, fork_mode=FORK_MODE_RESTART, forward_socket_path=None,
+                 shipper=False, shipper_ring_size=None, spool=None, deferred_formatting=False):
         super(AsynchronousLogHandler, self).__init__()
         self._host = host
         self._port = port
@@ -67,32 +136,129 @@ class AsynchronousLogHandler(Handler):
         self._encoding = encoding
         self._buffer = buffer
         self._terminator = terminator
+        self._framing = framing if framing is not None else DelimiterFraming(terminator)
+        self._worker_pool = worker_pool
+        self._worker_thread = None
+        self._fork_mode = fork_mode
+        self._forward_socket_path = forward_socket_path
+        self._forwarder = None
+        self._shipper = shipper
+        self._shipper_ring_size = shipper_ring_size
+        self._spool = spool
+        # buffers passed in are only shared with handlers using the same instance
+        self._buffer_key = id(buffer) if buffer is not None else \
+            (database_path, event_ttl, id(spool) if spool is not None else None)
+        self._deferred_formatting = deferred_formatting
+        self._pid = os.getpid()
+        self._stats = HandlerStats(constants.HANDLER_STATS_PREFIX)
+        self._check_shipper()
         self._setup_transport()
         self._setup_buffer()
         self._setup_formatter(formatter)
+        self._check_deferred_formatting()
+        self._setup_forwarder()
+        _handlers.add(self)
+
+    # ----------------------------------------------------------------------
+    @property
+    def endpoint(self):
+        """Address of the log forwarding server as `host:port`"""
+        return u'{}:{}'.format(self._host, self._port)
 
     # ----------------------------------------------------------------------
     def emit(self, record):
         if not self._enable:
             return  # we should not do anything, so just leave
 
+        start = monotonic()
+        if not _fork_hook_available and os.getpid() != self._pid:
+            self._reinit_after_fork()
+
         # create thread on first emit
         # subclasses such as ConsoleLogger may override emit to prevent asynchronous logging
         self._start_worker_thread()
 
         # basically same implementation as in logging.handlers.SocketHandler.emit()
         try:
-            data = self._format_record(record)
-            AsynchronousLogHandler._worker_thread.enqueue_event(data)
+            if self._deferred_formatting:
+                data = record
+            else:
+                data = self._format_record(record)
+            self._worker_thread.enqueue_event(data, created=record.created)
+            hook = hooks.on_enqueue
+            if hook is not None:
+                hook(data)
         except (KeyboardInterrupt, SystemExit):
             raise
         except Exception:
             self.handleError(record)
+        self._stats.emit(monotonic() - start)
 
     # ----------------------------------------------------------------------
-    def flush(self):
-        if self._worker_thread_is_running():
-            self._worker_thread.force_flush_queued_events()
+    def flush(self, timeout=None):
+        """Trigger sending the queued events.
+
+        :param timeout: If set, wait up to `timeout` seconds until all events emitted so far
+                        have been sent
+        :return: Number of events emitted so far which are still pending if `timeout` is set
+                 (None if unknown: in shipper mode the events are sent by another process,
+                 so this only triggers sending them and does not wait)
+        """
+        if not self._worker_thread_is_running():
+            return None if timeout is None else 0
+        self._worker_thread.force_flush_queued_events()
+        if timeout is not None:
+            return self._wait_for_delivery(timeout)
+
+    # ----------------------------------------------------------------------
+    @property
+    def pending(self):
+        """Number of emitted events which were neither sent nor expired yet
+        (None if unknown, e.g. in shipper mode)"""
+        worker_thread = self._worker_thread
+        if worker_thread is None:
+            return 0
+        return getattr(worker_thread, 'pending', None)
+
+    # ----------------------------------------------------------------------
+    def set_profiler(self, profiler, timeout=None):
+        """Start profiling the worker thread, or stop the current profiler.
+
+        :param profiler: log_async.profiling.WorkerProfiler, None to stop profiling
+        :param timeout: Maximum time to wait for the worker thread in seconds,
+                        None to wait without limit
+        :return: True if the change was applied, False if the worker thread is not running
+                 (e.g. before the first event was emitted) or does not support profiling
+        """
+        worker_thread = self._worker_thread
+        if worker_thread is None or not hasattr(worker_thread, 'set_profiler'):
+            return False
+        return worker_thread.set_profiler(profiler, timeout)
+
+    # ----------------------------------------------------------------------
+    def _wait_for_delivery(self, timeout):
+        worker_thread = self._worker_thread
+        wait_for_delivery = getattr(worker_thread, 'wait_for_delivery', None)
+        if wait_for_delivery is None:
+            return None
+        return wait_for_delivery(worker_thread.sequence, timeout)
+
+    # ----------------------------------------------------------------------
+    def _check_shipper(self):
+        if self._shipper:
+            # fail early instead of on the first emitted event
+            from .shipper import get_fork_context
+            get_fork_context()
+
+    # ----------------------------------------------------------------------
+    def _check_deferred_formatting(self):
+        if not self._deferred_formatting:
+            return
+        if self._worker_pool is not None or self._shipper:
+            # workers shared by handlers and the shipper only receive formatted events
+            raise ValueError('deferred_formatting is not supported with worker_pool or shipper')
+        if not hasattr(self.formatter, 'format_batch_events'):
+            raise ValueError('deferred_formatting requires a formatter with format_batch_events()')
 
     # ----------------------------------------------------------------------
     def _setup_transport(self):
@@ -118,16 +284,74 @@ class AsynchronousLogHandler(Handler):
 
         # support previous invocation parameters
         if self._database_path:
-            self._buffer = DatabaseCache(path=self._database_path, event_ttl=self._event_ttl)
+            self._buffer = DatabaseCache(
+                path=self._database_path, event_ttl=self._event_ttl, spool=self._spool)
         else:
+            self._buffer = MemoryCache(cache={}, event_ttl=self._event_ttl, spool=self._spool)
+
+    # ----------------------------------------------------------------------
+    def _setup_forwarder(self):
+        if self._fork_mode != FORK_MODE_FORWARD or not self._enable:
+            return
+
+        if self._forward_socket_path is None:
+            self._forward_socket_path = os.path.join(
+                tempfile.gettempdir(), 'log_async-{}-{}.sock'.format(os.getpid(), id(self)))
+        # the worker and the listener need to be running before any child is forked
+        self._start_worker_thread()
+        self._forwarder = LocalForwarder(self._forward_socket_path, self._enqueue_forwarded_event)
+        self._forwarder.start()
+
+    # ----------------------------------------------------------------------
+    def _enqueue_forwarded_event(self, event):
+        # called from the forwarder thread
+        worker_thread = self._worker_thread
+        if worker_thread is not None:
+            worker_thread.enqueue_event(event)
+
+    # ----------------------------------------------------------------------
+    def _reinit_after_fork(self):
+        """Called in a forked child process: the worker thread does not exist in the child
+        and anything buffered or queued before forking belongs to the parent process."""
+        self._pid = os.getpid()
+        if hasattr(self.formatter, 'reset_after_fork'):
+            self.formatter.reset_after_fork()
+        if self._shipper:
+            return  # the inherited ring buffer is shared with the parent's shipper process
+        if self._spool is not None:
+            self._spool.reset_after_fork()
+        self._worker_thread = None
+        if self._worker_pool is not None:
+            self._worker_pool.reset_after_fork()
+
+        if self._forwarder is not None:
+            # forward to the parent instead of connecting to the log forwarding server
+            self._forwarder.reset_after_fork()
+            self._forwarder = None
+            self._transport = UnixSocketTransport(self._forward_socket_path)
             self._buffer = MemoryCache(cache={}, event_ttl=self._event_ttl)
+            return
+
+        if hasattr(self._transport, 'reset_after_fork'):
+            self._transport.reset_after_fork()
+        if self._buffer is not None:
+            self._buffer.reset_after_fork()
 
     # ----------------------------------------------------------------------
     def _start_worker_thread(self):
         if self._worker_thread_is_running():
             return
 
-        AsynchronousLogHandler._worker_thread = LogProcessingWorker(
+        if self._worker_pool is not None:
+            self._worker_thread = self._worker_pool.acquire(
+                self._worker_key(), self, self._create_worker_thread)
+        else:
+            self._worker_thread = self._create_worker_thread()
+            self._worker_thread.start()
+
+    # ----------------------------------------------------------------------
+    def _create_worker_thread(self):
+        worker_kwargs = dict(
             host=self._host,
             port=self._port,
             transport=self._transport,
@@ -137,12 +361,28 @@ class AsynchronousLogHandler(Handler):
             certfile=self._certfile,
             ca_certs=self._ca_certs,
             buffer=self._buffer)
-        AsynchronousLogHandler._worker_thread.start()
+        if self._deferred_formatting:
+            worker_kwargs.update(formatter=self.formatter, framing=self._framing)
+        if self._shipper:
+            from .shipper import ShipperClient
+            return ShipperClient(
+                ring_size=self._shipper_ring_size or constants.SHIPPER_RING_SIZE,
+                worker_kwargs=worker_kwargs)
+        return LogProcessingWorker(**worker_kwargs)
+
+    # ----------------------------------------------------------------------
+    def _worker_key(self):
+        """Handlers with the same key share a worker thread when using a worker pool: they send
+        to the same destination with the same transport and buffer configuration"""
+        transport = self._transport_path
+        if not isinstance(transport, string_types):
+            transport = id(transport)  # an instance passed in
+        return (self._host, self._port, transport, self._ssl_enable, self._ssl_verify,
+                self._keyfile, self._certfile, self._ca_certs, self._buffer_key)
 
     # ----------------------------------------------------------------------
-    @staticmethod
-    def _worker_thread_is_running():
-        worker_thread = AsynchronousLogHandler._worker_thread
+    def _worker_thread_is_running(self):
+        worker_thread = self._worker_thread
         if worker_thread is not None and worker_thread.is_alive():
             return True
 
@@ -151,9 +391,7 @@ class AsynchronousLogHandler(Handler):
         formatted = self.formatter.format(record)
         if PY3 and isinstance(formatted, text_type):
             formatted = formatted.encode(self._encoding)
-        if len(self._terminator):
-            formatted = formatted + self._terminator
-        return formatted
+        return self._framing.frame(formatted)
 
     # ----------------------------------------------------------------------
     # establish log message formatter, or a LogstashFormatter if one was not provided
@@ -173,32 +411,65 @@ class AsynchronousLogHandler(Handler):
         super(AsynchronousLogHandler, self).close()
 
     # ----------------------------------------------------------------------
-    def shutdown(self):
+    def shutdown(self, timeout=None):
+        """Send the queued events and stop the worker thread.
+
+        :param timeout: Maximum time in seconds to wait for the events to be sent,
+                        None to wait until the worker thread finished
+        :return: Number of events which could not be sent (None if unknown,
+                 e.g. in shipper mode)
+        """
+        self._shutdown_forwarder()
+        if self._worker_pool is not None and self._worker_thread is not None:
+            # only the last handler using a shared worker shuts it down
+            if not self._worker_pool.release(self._worker_key(), self):
+                pending = self.flush(timeout) if timeout is not None else None
+                self._reset_worker_thread()
+                return pending
+
+        pending = 0
         if self._worker_thread_is_running():
+            deadline = None if timeout is None else monotonic() + timeout
             self._trigger_worker_shutdown()
-            self._wait_for_worker_thread()
-            self._reset_worker_thread()
-            self._close_transport()
-        else:
-            pass
+            if timeout is not None:
+                self._wait_for_delivery(timeout)
+            self._wait_for_worker_thread(
+                None if deadline is None else max(0, deadline - monotonic()))
+            if not self._worker_thread.is_alive():
+                # otherwise the worker might still be sending
+                self._close_transport()
+            pending = self._wait_for_delivery(0)
+        if self._spool is not None and not self._worker_thread_is_running():
+            self._spool.close()
+        self._reset_worker_thread()
+        return pending
+
+    # ----------------------------------------------------------------------
+    def _shutdown_forwarder(self):
+        if self._forwarder is not None:
+            self._forwarder.shutdown()
+            self._forwarder.join()
+            self._forwarder = None
 
     # ----------------------------------------------------------------------
     def _trigger_worker_shutdown(self):
-        AsynchronousLogHandler._worker_thread.shutdown()
+        self._worker_thread.shutdown()
 
     # ----------------------------------------------------------------------
-    def _wait_for_worker_thread(self):
-        AsynchronousLogHandler._worker_thread.join()
+    def _wait_for_worker_thread(self, timeout=None):
+        self._worker_thread.join(timeout)
 
     # ----------------------------------------------------------------------
     def _reset_worker_thread(self):
-        AsynchronousLogHandler._worker_thread = None
+        self._worker_thread = None
 
     # ----------------------------------------------------------------------
     def _close_transport(self):
+        # a shared worker may use the transport of another handler
+        transport = getattr(self._worker_thread, 'transport', self._transport)
         try:
-            if self._transport is not None:
-                self._transport.close()
+            if transport is not None:
+                transport.close()
         except Exception as e:
             safe_log_via_print('error', u'Error on closing transport: {}'.format(e))
 
@@ -206,10 +477,15 @@ class AsynchronousLogHandler(Handler):
     def get_stats(self):
         vals = []
         if self._enable:
-            if AsynchronousLogHandler._worker_thread:
-                vals.extend(AsynchronousLogHandler._worker_thread.get_stats())
+            vals.extend(self._stats.get_stats())
+            if self._worker_thread:
+                vals.extend(self._worker_thread.get_stats())
             if self._transport is not None:
                 vals.extend(self._transport.get_stats())
             if self._buffer is not None:
                 vals.extend(self._buffer.get_stats())
+            if self._spool is not None:
+                vals.extend(self._spool.get_stats())
+            if hasattr(self.formatter, 'get_stats'):
+                vals.extend(self.formatter.get_stats())
         return vals
@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+#
+# This software may be modified and distributed under the terms
+# of the MIT license.  See the LICENSE file for details.
+
+from threading import Lock
+
+
+# hook names and the arguments passed to their callbacks
+HOOK_NAMES = (
+    # on_enqueue(event): AsynchronousLogHandler.emit() passed a formatted event to the worker
+    # (the LogRecord with deferred_formatting)
+    'on_enqueue',
+    # on_cache_write(event, duration): the worker added an event to the cache
+    'on_cache_write',
+    # on_claim(events, duration): the worker claimed a batch of events from the cache
+    'on_claim',
+    # on_send_start(events): a transport starts sending a batch
+    'on_send_start',
+    # on_send_end(events, duration, error): a transport finished sending a batch,
+    # error is None on success
+    'on_send_end',
+    # on_requeue(events, error): a batch could not be sent and was returned to the cache
+    'on_requeue',
+    # on_drop(count, reason): events were discarded ('overflow', 'expired', 'rejected' or
+    # 'ring_full'), possibly into a dead-letter spool (see log_async.spool)
+    'on_drop',
+    # on_flush_cycle(count, duration): the worker finished a flush attempt which claimed
+    # `count` (> 0) events, the duration includes sending unless the send pipeline is used
+    'on_flush_cycle',
+)
+
+
+class HookRegistry(object):
+    """Callbacks invoked at points of the log processing pipeline, e.g. for profiling.
+
+    For each hook the registry has an attribute of the same name which is None while
+    no callback is registered, so an unused hook costs one attribute lookup::
+
+        hook = hooks.on_send_start
+        if hook is not None:
+            hook(events)
+
+    With one callback the attribute is the callback itself, with more a function calling
+    all of them. Exceptions raised by callbacks are not caught, callbacks must not raise.
+    Callbacks are called from application threads (on_enqueue), the worker thread and
+    the sender thread of a send pipeline.
+    """
+
+    # ----------------------------------------------------------------------
+    def __init__(self):
+        self._lock = Lock()
+        self._callbacks = dict((name, ()) for name in HOOK_NAMES)
+        for name in HOOK_NAMES:
+            setattr(self, name, None)
+
+    # ----------------------------------------------------------------------
+    def register(self, name, callback):
+        """
+        :param name: One of HOOK_NAMES
+        :param callback: Callable receiving the arguments documented in HOOK_NAMES
+        """
+        self._check_name(name)
+        with self._lock:
+            self._callbacks[name] += (callback,)
+            self._update(name)
+
+    # ----------------------------------------------------------------------
+    def unregister(self, name, callback):
+        self._check_name(name)
+        with self._lock:
+            callbacks = list(self._callbacks[name])
+            callbacks.remove(callback)
+            self._callbacks[name] = tuple(callbacks)
+            self._update(name)
+
+    # ----------------------------------------------------------------------
+    def clear(self):
+        with self._lock:
+            for name in HOOK_NAMES:
+                self._callbacks[name] = ()
+                self._update(name)
+
+    # ----------------------------------------------------------------------
+    def _check_name(self, name):
+        if name not in self._callbacks:
+            raise ValueError(u'Unknown hook "{}", expected one of {}'.format(
+                name, ', '.join(HOOK_NAMES)))
+
+    # ----------------------------------------------------------------------
+    def _update(self, name):
+        callbacks = self._callbacks[name]
+        if not callbacks:
+            setattr(self, name, None)
+        elif len(callbacks) == 1:
+            setattr(self, name, callbacks[0])
+        else:
+            def call_all(*args):
+                for callback in callbacks:
+                    callback(*args)
+            setattr(self, name, call_all)
+
+
+# the hooks of this process
+hooks = HookRegistry()
@@ -0,0 +1,45 @@
+# -*- coding: utf-8 -*-
+#
+# This software may be modified and distributed under the terms
+# of the MIT license.  See the LICENSE file for details.
+
+from collections import deque
+
+
+class DequeIngressQueue(object):
+    """Multi-producer, single-consumer queue between the logging threads and the worker thread.
+
+    `put()` is a plain `deque.append()`, which is atomic, so producers neither take a lock
+    nor notify a condition variable (unlike `queue.Queue`). The consumer does not block but
+    polls, taking all pending events at once with `get_batch()`.
+
+    Any object providing `put()`, `get_batch()` and `qsize()` can be passed to
+    LogProcessingWorker as `ingress_queue` instead.
+    """
+
+    # ----------------------------------------------------------------------
+    def __init__(self):
+        self._events = deque()
+
+    # ----------------------------------------------------------------------
+    def put(self, event):
+        self._events.append(event)
+
+    # ----------------------------------------------------------------------
+    def get_batch(self, max_events=None):
+        """Remove and return pending events in the order they were put.
+
+        :param max_events: Maximum number of events to return, None for all pending events
+        :return: list of events, empty if there are none
+        """
+        events = []
+        popleft = self._events.popleft
+        count = len(self._events) if max_events is None else min(max_events, len(self._events))
+        # events appended meanwhile are left for the next call
+        for _ in range(count):
+            events.append(popleft())
+        return events
+
+    # ----------------------------------------------------------------------
+    def qsize(self):
+        return len(self._events)
@@ -0,0 +1,476 @@
+# -*- coding: utf-8 -*-
+#
+# This software may be modified and distributed under the terms
+# of the MIT license.  See the LICENSE file for details.
+
+"""Generate load on a log handler to find the event rate it sustains.
+
+Usage: python -m log_async.loadgen [--host HOST] [--port PORT] [--transport PATH]
+                                   [--buffer memory|sqlite] [--formatter PATH]
+                                   [--threads N] [--processes N] [--rate R [R ...]]
+                                   [--duration SECONDS] [--output results.json]
+"""
+
+from __future__ import division, print_function
+
+from array import array
+from collections import OrderedDict
+from threading import Event, Thread
+from timeit import default_timer
+import argparse
+import json
+import logging
+import multiprocessing
+import os
+import random
+import sys
+import tempfile
+import time
+
+from .constants import constants
+from .utils import import_string
+
+
+LARGE_MESSAGE_BYTES = 16 * 1024
+
+DEFAULT_MIX = 'plain=70,extra=20,exception=5,large=5'
+# length of the repeated sequence of record shapes
+SHAPE_CYCLE = 1000
+
+# a stage saturated the handler if the backlog exceeds this multiple of the expected backlog
+SATURATION_BACKLOG_FACTOR = 2.0
+# ... or if less than this fraction of the target rate could be emitted
+SATURATION_RATE_RATIO = 0.95
+
+
+# ----------------------------------------------------------------------
+def _create_exc_info():
+    try:
+        {}['missing']
+    except KeyError:
+        return sys.exc_info()
+
+
+_EXC_INFO = _create_exc_info()
+_LARGE_PAYLOAD = ''.join(random.Random(0).choice('abcdefghijklmnopqrstuvwxyz0123456789 ')
+                         for _ in range(LARGE_MESSAGE_BYTES))
+
+
+# ----------------------------------------------------------------------
+def _emit_plain(logger, number):
+    logger.info('request %d handled in %d ms', number, number % 250)
+
+
+# ----------------------------------------------------------------------
+def _emit_extra(logger, number):
+    logger.info('order %d placed', number, extra=dict(
+        customer_id=number % 10007,
+        request_id='{:032x}'.format(number),
+        amount=number % 1000 / 10.0,
+        currency='EUR',
+        items=['sku-{}'.format(number % 97), 'sku-{}'.format(number % 89)],
+        region='eu-west-1',
+        user_agent='Mozilla/5.0 (X11; Linux x86_64) loadgen'))
+
+
+# ----------------------------------------------------------------------
+def _emit_exception(logger, number):
+    logger.error('failed to process job %d', number, exc_info=_EXC_INFO)
+
+
+# ----------------------------------------------------------------------
+def _emit_large(logger, number):
+    logger.warning('payload of request %d: %s', number, _LARGE_PAYLOAD)
+
+
+# record shapes, each emitting one log record
+SHAPES = OrderedDict([
+    ('plain', _emit_plain),
+    ('extra', _emit_extra),
+    ('exception', _emit_exception),
+    ('large', _emit_large),
+])
+
+
+# ----------------------------------------------------------------------
+def parse_mix(text):
+    """Parse a record mix like `plain=70,extra=20,exception=5,large=5`.
+
+    :return: dict of shape name -> weight
+    """
+    mix = OrderedDict()
+    for part in text.split(','):
+        name, _, weight = part.partition('=')
+        name = name.strip()
+        if name not in SHAPES:
+            raise ValueError(u'Unknown record shape "{}", expected one of {}'.format(
+                name, ', '.join(SHAPES)))
+        mix[name] = float(weight) if weight else 1.0
+    if not any(weight > 0 for weight in mix.values()):
+        raise ValueError(u'The record mix needs a positive weight')
+    return mix
+
+
+# ----------------------------------------------------------------------
+def expected_backlog(rate):
+    """Number of events a handler which keeps up holds back at `rate` events per second:
+    the worker takes new events every QUEUE_CHECK_INTERVAL seconds and sends them once
+    QUEUED_EVENTS_FLUSH_COUNT events are cached or QUEUED_EVENTS_FLUSH_INTERVAL elapsed.
+    """
+    hold = constants.QUEUE_CHECK_INTERVAL
+    if rate * hold <= constants.QUEUED_EVENTS_FLUSH_COUNT:
+        hold += constants.QUEUED_EVENTS_FLUSH_INTERVAL
+    return rate * hold + constants.QUEUED_EVENTS_FLUSH_COUNT
+
+
+# ----------------------------------------------------------------------
+def percentiles(values):
+    """
+    :return: dict of p50, p90, p99 and max of `values` in microseconds
+    """
+    ordered = sorted(values)
+    if not ordered:
+        return dict(p50=0.0, p90=0.0, p99=0.0, max=0.0)
+
+    def percentile(fraction):
+        return ordered[int(round(fraction * (len(ordered) - 1)))] * 1e6
+
+    return dict(p50=percentile(0.5), p90=percentile(0.9), p99=percentile(0.99),
+                max=ordered[-1] * 1e6)
+
+
+class LoadGenerator(object):
+    """Emit log records through a handler from several threads, in stages of target rates.
+
+    The records are emitted on a fixed schedule per thread (open loop): a slow emit()
+    does not lower the offered load, late records are emitted at once to catch up.
+    A rate of 0 emits as fast as possible.
+
+    :param handler: The handler to load, e.g. an AsynchronousLogHandler
+    :param threads: Number of emitting threads
+    :param mix: dict of record shape (see SHAPES) -> weight
+    :param sample_interval: Seconds between samples of the backlog and `handler.get_stats()`
+    :param seed: Seed for the order of the record shapes
+    """
+
+    # ----------------------------------------------------------------------
+    def __init__(self, handler, threads=1, mix=None, sample_interval=1.0, seed=0):
+        self._handler = handler
+        self._threads = threads
+        self._sample_interval = sample_interval
+        mix = mix if mix is not None else parse_mix(DEFAULT_MIX)
+        # a fixed, shuffled cycle of shapes keeps choosing them out of the measured emit()
+        total = sum(mix.values())
+        self._shapes = []
+        for name, weight in mix.items():
+            self._shapes.extend([SHAPES[name]] * int(round(weight / total * SHAPE_CYCLE)))
+        random.Random(seed).shuffle(self._shapes)
+        self._logger = logging.getLogger('log_async.loadgen')
+        self._logger.propagate = False
+        self._logger.setLevel(logging.DEBUG)
+
+    # ----------------------------------------------------------------------
+    def run(self, rates, duration):
+        """Run one stage per rate.
+
+        :param rates: Target rates in events per second of all threads, 0 to emit as fast
+                      as possible
+        :param duration: Seconds per stage
+        :return: dict with the list of `stages` and the `timeline` of samples
+        """
+        self._logger.addHandler(self._handler)
+        timeline = []
+        stop_sampling = Event()
+        start = default_timer()
+        sampler = Thread(target=self._sample, args=(start, timeline, stop_sampling),
+                         name='LoadGeneratorSampler')
+        sampler.daemon = True
+        sampler.start()
+        stages = []
+        try:
+            for rate in rates:
+                stages.append(self._run_stage(rate, duration, start))
+        finally:
+            stop_sampling.set()
+            sampler.join()
+            self._logger.removeHandler(self._handler)
+        return dict(stages=stages, timeline=timeline)
+
+    # ----------------------------------------------------------------------
+    def _run_stage(self, rate, duration, start):
+        backlog_start = self._pending()
+        stage_start = default_timer()
+        deadline = stage_start + duration
+        interval = self._threads / rate if rate else 0.0
+        results = [None] * self._threads
+        threads = [Thread(target=self._emit, args=(index, interval, deadline, results),
+                          name='LoadGenerator-{}'.format(index))
+                   for index in range(self._threads)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = default_timer() - stage_start
+
+        latencies = array('d')
+        for thread_latencies in results:
+            latencies.extend(thread_latencies)
+        return dict(
+            rate=rate,
+            started=stage_start - start,
+            duration=elapsed,
+            emitted=len(latencies),
+            backlog_start=backlog_start,
+            backlog_end=self._pending(),
+            latencies=latencies)
+
+    # ----------------------------------------------------------------------
+    def _emit(self, index, interval, deadline, results):
+        latencies = array('d')
+        logger = self._logger
+        shapes = self._shapes
+        # start the threads with an offset to spread them over the interval
+        next_time = default_timer() + interval * index / self._threads
+        number = index
+        while True:
+            now = default_timer()
+            if now >= deadline:
+                break
+            if interval:
+                if now < next_time:
+                    time.sleep(next_time - now)
+                next_time += interval
+            emit = shapes[number % len(shapes)]
+            emit_start = default_timer()
+            emit(logger, number)
+            latencies.append(default_timer() - emit_start)
+            number += self._threads
+        results[index] = latencies
+
+    # ----------------------------------------------------------------------
+    def _pending(self):
+        pending = getattr(self._handler, 'pending', None)
+        return pending if pending is not None else 0
+
+    # ----------------------------------------------------------------------
+    def _sample(self, start, timeline, stop):
+        while True:
+            timeline.append(dict(
+                time=default_timer() - start,
+                backlog=self._pending(),
+                stats=OrderedDict(self._handler.get_stats())))
+            if stop.wait(self._sample_interval):
+                return
+
+
+# ----------------------------------------------------------------------
+def summarize(rate, stage_results):
+    """Merge the results of a stage from several processes.
+
+    :param rate: Target rate of all processes
+    :return: dict of the achieved rates, emit latency percentiles, backlog and saturation
+    """
+    latencies = []
+    for result in stage_results:
+        latencies.extend(result['latencies'])
+    duration = max(result['duration'] for result in stage_results)
+    emitted = sum(result['emitted'] for result in stage_results)
+    backlog_start = sum(result['backlog_start'] for result in stage_results)
+    backlog_end = sum(result['backlog_end'] for result in stage_results)
+    delivered = emitted - (backlog_end - backlog_start)
+    emit_rate = emitted / duration if duration else 0.0
+    saturated = backlog_end > SATURATION_BACKLOG_FACTOR * expected_backlog(emit_rate) or \
+        bool(rate and emit_rate < SATURATION_RATE_RATIO * rate)
+    return OrderedDict([
+        ('rate', rate),
+        ('duration', duration),
+        ('emitted', emitted),
+        ('emit_rate', emit_rate),
+        ('delivered_rate', delivered / duration if duration else 0.0),
+        ('emit_latency_us', percentiles(latencies)),
+        ('backlog', backlog_end),
+        ('saturated', saturated),
+    ])
+
+
+# ----------------------------------------------------------------------
+def create_handler(args, index=0):
+    """
+    :return: tuple of (handler, path of a temporary database file or None)
+    """
+    from .database import DatabaseCache
+    from .handler import AsynchronousLogHandler
+    from .memory_cache import MemoryCache
+
+    temporary_path = None
+    if args.buffer == 'sqlite':
+        if args.database_path:
+            path = args.database_path
+            if args.processes > 1:
+                path = '{}.{}'.format(path, index)
+        else:
+            fd, path = tempfile.mkstemp(prefix='log_async_loadgen_', suffix='.db')
+            os.close(fd)
+            temporary_path = path
+        buffer = DatabaseCache(path)
+    else:
+        buffer = MemoryCache({})
+    handler = AsynchronousLogHandler(
+        args.host, args.port, transport=args.transport, ssl_enable=args.ssl_enable,
+        ssl_verify=not args.ssl_no_verify, ca_certs=args.ca_certs, buffer=buffer,
+        formatter=import_string(args.formatter)())
+    return handler, temporary_path
+
+
+# ----------------------------------------------------------------------
+def run_process(args, index=0):
+    """Run all stages against a new handler and wait for the backlog to be sent.
+
+    :return: dict with the `stages`, the `timeline` and the `drain` time in seconds
+    """
+    handler, temporary_path = create_handler(args, index)
+    generator = LoadGenerator(handler, threads=args.threads, mix=parse_mix(args.mix),
+                              sample_interval=args.sample_interval, seed=index)
+    # the target rates are shared by all processes
+    result = generator.run([rate / args.processes for rate in args.rate], args.duration)
+    start = default_timer()
+    result['pending'] = handler.flush(timeout=args.drain_timeout)
+    result['drain'] = default_timer() - start
+    handler.shutdown(timeout=args.drain_timeout)
+    if temporary_path is not None:
+        os.unlink(temporary_path)
+    for sample in result['timeline']:
+        sample['process'] = index
+    return result
+
+
+# ----------------------------------------------------------------------
+def _run_child(args, index, queue):
+    queue.put(run_process(args, index))
+
+
+# ----------------------------------------------------------------------
+def run(args):
+    """Run the load generator in `args.processes` processes and merge the results"""
+    if args.processes <= 1:
+        results = [run_process(args)]
+    else:
+        queue = multiprocessing.Queue()
+        processes = [multiprocessing.Process(target=_run_child, args=(args, index, queue))
+                     for index in range(args.processes)]
+        for process in processes:
+            process.start()
+        results = [queue.get() for _ in processes]
+        for process in processes:
+            process.join()
+
+    stages = [summarize(rate, [result['stages'][number] for result in results])
+              for number, rate in enumerate(args.rate)]
+    saturated = [stage['rate'] for stage in stages if stage['saturated']]
+    sustained = [stage['emit_rate'] for stage in stages if not stage['saturated']]
+    timeline = sorted((sample for result in results for sample in result['timeline']),
+                      key=lambda sample: sample['time'])
+    return OrderedDict([
+        ('threads', args.threads),
+        ('processes', args.processes),
+        ('mix', parse_mix(args.mix)),
+        ('stages', stages),
+        ('saturated_at', saturated[0] if saturated else None),
+        ('max_sustained_rate', max(sustained) if sustained else None),
+        ('drain_seconds', max(result['drain'] for result in results)),
+        ('pending', sum(result['pending'] or 0 for result in results)),
+        ('timeline', timeline),
+    ])
+
+
+# ----------------------------------------------------------------------
+def format_report(report):
+    lines = ['{:>10} {:>10} {:>12} {:>9} {:>9} {:>9} {:>10} {:>9}  {}'.format(
+        'target/s', 'emitted/s', 'delivered/s', 'p50 us', 'p99 us', 'max us', 'backlog',
+        'events', 'saturated')]
+    for stage in report['stages']:
+        latency = stage['emit_latency_us']
+        lines.append(
+            '{:>10} {:>10,.0f} {:>12,.0f} {:>9.1f} {:>9.1f} {:>9.1f} {:>10,d} {:>9,d}  {}'.format(
+                stage['rate'] or 'max', stage['emit_rate'], stage['delivered_rate'],
+                latency['p50'], latency['p99'], latency['max'], stage['backlog'],
+                stage['emitted'], 'yes' if stage['saturated'] else 'no'))
+
+    # highest backlog per second and process, summed over the processes
+    backlog = OrderedDict()
+    for sample in report['timeline']:
+        processes = backlog.setdefault(int(sample['time']), {})
+        processes[sample['process']] = max(processes.get(sample['process'], 0), sample['backlog'])
+    lines.append('backlog over time: ' + ', '.join(
+        '{}s={}'.format(second, sum(processes.values()))
+        for second, processes in backlog.items()))
+
+    if report['saturated_at'] is not None:
+        lines.append('saturated at {} events/s'.format(report['saturated_at']))
+    else:
+        lines.append('not saturated')
+    if report['max_sustained_rate'] is not None:
+        lines.append('highest sustained rate: {:,.0f} events/s'.format(
+            report['max_sustained_rate']))
+    lines.append('backlog sent within {:.1f}s after the last stage, {} events pending'.format(
+        report['drain_seconds'], report['pending']))
+    return '\n'.join(lines)
+
+
+# ----------------------------------------------------------------------
+def create_parser():
+    parser = argparse.ArgumentParser(
+        prog='python -m log_async.loadgen', description=__doc__.splitlines()[0])
+    parser.add_argument('--host', default='localhost',
+                        help='host of the log forwarding server')
+    parser.add_argument('--port', type=int, default=5959,
+                        help='port of the log forwarding server')
+    parser.add_argument('--transport', default='log_async.transport.TcpTransport',
+                        help='path of the transport class')
+    parser.add_argument('--ssl-enable', action='store_true')
+    parser.add_argument('--ssl-no-verify', action='store_true')
+    parser.add_argument('--ca-certs')
+    parser.add_argument('--buffer', choices=('memory', 'sqlite'), default='memory')
+    parser.add_argument('--database-path',
+                        help='SQLite file for --buffer sqlite, a temporary file by default')
+    parser.add_argument('--formatter', default='log_async.formatter.LogstashFormatter',
+                        help='path of the formatter class')
+    parser.add_argument('--threads', type=int, default=1, help='emitting threads per process')
+    parser.add_argument('--processes', type=int, default=1,
+                        help='processes, each with its own handler')
+    parser.add_argument('--rate', type=float, nargs='+', default=[0],
+                        help='target events per second of all threads and processes, one '
+                             'stage per rate, 0 to emit as fast as possible')
+    parser.add_argument('--duration', type=float, default=30.0,
+                        help='seconds per stage, several times QUEUE_CHECK_INTERVAL and '
+                             'QUEUED_EVENTS_FLUSH_INTERVAL to detect a growing backlog')
+    parser.add_argument('--mix', default=DEFAULT_MIX,
+                        help='weights of the record shapes ({})'.format(', '.join(SHAPES)))
+    parser.add_argument('--sample-interval', type=float, default=1.0,
+                        help='seconds between samples of the backlog and the handler statistics')
+    parser.add_argument('--drain-timeout', type=float, default=60.0,
+                        help='seconds to wait for the backlog to be sent after the last stage')
+    parser.add_argument('--output', help='write the report including the statistics timeline '
+                                         'as JSON to this file')
+    return parser
+
+
+# ----------------------------------------------------------------------
+def main(argv=None):
+    args = create_parser().parse_args(argv)
+    try:
+        parse_mix(args.mix)
+    except ValueError as exc:
+        print(exc, file=sys.stderr)
+        return 2
+    report = run(args)
+    print(format_report(report))
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump(report, output, indent=2)
+            output.write('\n')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -9,6 +9,8 @@ import uuid
 
 from .cache import Cache
 from .constants import constants
+from .hooks import hooks
+from .spool import REASON_EXPIRED, REASON_OVERFLOW
 from .stats import LogStats
 
 
@@ -22,23 +24,34 @@ class MemoryCache(Cache):
     :param max_size: maximum number of buffered events
     :param overflow_fn: Function to call in case of overflow. Important - don't just log to
             the same path or there could be an infinite loop!
+    :param clock: Function returning the current time like time.time(), used for event_ttl,
+            e.g. `log_async.testing.VirtualClock.time`
+    :param spool: DeadLetterSpool receiving the events which overflowed or expired
     """
 
     logger = get_logger(__name__)
 
     # ----------------------------------------------------------------------
-    def __init__(self, cache, event_ttl=None, max_size=None, overflow_fn=None):
+    def __init__(self, cache, event_ttl=None, max_size=None, overflow_fn=None, clock=None,
+                 spool=None):
         self._cache = cache
         self._event_ttl = event_ttl
         self._max_size = max_size
         self._overflow_fn = overflow_fn
+        self._clock = clock
+        self.spool = spool
         self._stats = LogStats(constants.MEMORY_STATS_PREFIX)
 
     # ----------------------------------------------------------------------
-    def add_event(self, event):
+    def add_event(self, event, created=None):
         self._stats.event(1)
         if self._max_size is not None and len(self._cache) >= self._max_size:
             self._stats.discard(1)
+            hook = hooks.on_drop
+            if hook is not None:
+                hook(1, 'overflow')
+            if self.spool is not None:
+                self.spool.add(event, REASON_OVERFLOW)
             if self._overflow_fn:
                 try:
                     self._overflow_fn(event)
@@ -50,16 +63,19 @@ class MemoryCache(Cache):
         self._cache[event_id] = {
             "event_text": event,
             "pending_delete": False,
-            "entry_date": datetime.now(),
+            "entry_date": self._now(),
+            "created": created,
             "id": event_id
         }
         self._stats.buffer(1)
 
     # ----------------------------------------------------------------------
-    def get_queued_events(self):
+    def get_queued_events(self, limit=None):
         events = []
         for event in self._cache.values():
             if not event['pending_delete']:
+                if limit is not None and len(events) >= limit:
+                    break
                 events.append(event)
                 event['pending_delete'] = True
         self._stats.unbuffer(len(events))
@@ -88,17 +104,31 @@ class MemoryCache(Cache):
         ids_to_delete = [event['id'] for event in self._cache.values() if event['pending_delete']]
         self._delete_events(ids_to_delete)
 
+    # ----------------------------------------------------------------------
+    def delete_events(self, events):
+        self._delete_events([event['id'] for event in events])
+
     # ----------------------------------------------------------------------
     def expire_events(self):
         if self._event_ttl is None:
-            return
+            return 0
 
-        delete_time = datetime.now() - timedelta(seconds=self._event_ttl)
+        delete_time = self._now() - timedelta(seconds=self._event_ttl)
         ids_to_delete = [
             event['id']
             for event in self._cache.values()
-            if event['entry_date'] < delete_time]
-        self._delete_events(ids_to_delete)
+            # events being sent would be delivered twice if the send succeeds
+            if event['entry_date'] < delete_time and not event['pending_delete']]
+        if self.spool is not None:
+            for event_id in ids_to_delete:
+                self.spool.add(self._cache[event_id]['event_text'], REASON_EXPIRED)
+        return self._delete_events(ids_to_delete)
+
+    # ----------------------------------------------------------------------
+    def _now(self):
+        if self._clock is None:
+            return datetime.now()
+        return datetime.fromtimestamp(self._clock())
 
     # ----------------------------------------------------------------------
     def _delete_events(self, ids_to_delete):
@@ -114,6 +144,13 @@ class MemoryCache(Cache):
                     "Could not delete event with id {}. "
                     "It does not appear to be in the cache.".format(event_id))
         self._stats.discard(n)
+        return n
+
+    # ----------------------------------------------------------------------
+    def reset_after_fork(self):
+        # the copied events are owned (and sent) by the parent process
+        self._cache = {}
+        self._stats = LogStats(constants.MEMORY_STATS_PREFIX)
 
     # ----------------------------------------------------------------------
     def get_stats(self):
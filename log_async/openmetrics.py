@@ -0,0 +1,187 @@
+# -*- coding: utf-8 -*-
+#
+# This software may be modified and distributed under the terms
+# of the MIT license.  See the LICENSE file for details.
+
+"""Expose the statistics of log handlers in the OpenMetrics text format,
+without depending on prometheus_client"""
+
+from collections import OrderedDict
+from threading import Thread
+from wsgiref.simple_server import make_server, WSGIRequestHandler
+import math
+
+from six import integer_types, text_type
+
+from .stats import describe
+
+
+CONTENT_TYPE = 'application/openmetrics-text; version=1.0.0; charset=utf-8'
+
+_HISTOGRAM_SUFFIXES = ('_bucket', '_count', '_sum')
+
+
+# ----------------------------------------------------------------------
+def _escape(value):
+    return text_type(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+# ----------------------------------------------------------------------
+def _format_value(value):
+    if isinstance(value, bool):
+        return u'1' if value else u'0'
+    if isinstance(value, integer_types):
+        return text_type(value)
+    value = float(value)
+    if math.isnan(value):
+        return u'NaN'
+    if math.isinf(value):
+        return u'+Inf' if value > 0 else u'-Inf'
+    return repr(value)
+
+
+class OpenMetricsExporter(object):
+    """Render the statistics (`get_stats()`) of log handlers in the OpenMetrics text format.
+
+    Every sample is labelled with the name of its handler (`handler`, the name set with
+    `Handler.set_name()` or the class name) and the address of the log forwarding server
+    (`endpoint`). The metric type and help text are taken from the Counter, Gauge and
+    Histogram definitions in log_async.stats, other samples are exposed as `unknown`.
+
+    The exporter can be served by `start_http_server()`, as WSGI application
+    (`exporter.wsgi_app`) or as ASGI application (`make_asgi_app()`).
+
+    :param handlers: Handlers to export, by default all AsynchronousLogHandler instances
+                     of the process. AsyncioLogHandler instances must be passed explicitly.
+    """
+
+    # ----------------------------------------------------------------------
+    def __init__(self, handlers=None):
+        self._handlers = handlers
+        # sample name -> (family, kind, help, sample name, labels of the sample)
+        self._parsed_names = {}
+
+    # ----------------------------------------------------------------------
+    def render(self):
+        """
+        :return: The current statistics of all handlers as UTF-8 encoded OpenMetrics text
+        """
+        families = OrderedDict()
+        for labels, handler in self._labelled_handlers():
+            for name, value in handler.get_stats():
+                family, kind, help_, sample_name, sample_labels = self._parse(name)
+                if family not in families:
+                    families[family] = (kind, help_, [])
+                if sample_labels:
+                    sample_labels = u'{{{},{}}}'.format(labels, sample_labels)
+                else:
+                    sample_labels = u'{{{}}}'.format(labels)
+                families[family][2].append(
+                    u'{}{} {}'.format(sample_name, sample_labels, _format_value(value)))
+
+        lines = []
+        for family, (kind, help_, samples) in families.items():
+            lines.append(u'# TYPE {} {}'.format(family, kind))
+            if help_:
+                lines.append(u'# HELP {} {}'.format(family, _escape(help_)))
+            lines.extend(samples)
+        lines.append(u'# EOF\n')
+        return u'\n'.join(lines).encode('utf-8')
+
+    # ----------------------------------------------------------------------
+    def _labelled_handlers(self):
+        handlers = self._handlers
+        if handlers is None:
+            from .handler import get_handlers
+            handlers = get_handlers()
+
+        labelled = []
+        for handler in handlers:
+            name = handler.get_name() or handler.__class__.__name__
+            endpoint = getattr(handler, 'endpoint', u'')
+            labelled.append((name, endpoint, handler))
+        labelled.sort(key=lambda item: (item[0], item[1]))
+
+        # each label set must be unique, number handlers with the same name and endpoint
+        seen = {}
+        for name, endpoint, handler in labelled:
+            count = seen[name, endpoint] = seen.get((name, endpoint), 0) + 1
+            if count > 1:
+                name = u'{}-{}'.format(name, count)
+            yield u'handler="{}",endpoint="{}"'.format(_escape(name), _escape(endpoint)), handler
+
+    # ----------------------------------------------------------------------
+    def _parse(self, name):
+        parsed = self._parsed_names.get(name)
+        if parsed is None:
+            parsed = self._parsed_names[name] = self._parse_name(name)
+        return parsed
+
+    # ----------------------------------------------------------------------
+    def _parse_name(self, name):
+        base, _, sample_labels = name.partition('{')
+        sample_labels = sample_labels.rstrip('}')
+
+        description = describe(base)
+        if description is not None and description[0] != 'histogram':
+            kind, help_ = description
+            if kind == 'counter':
+                family = base[:-len('_total')] if base.endswith('_total') else base
+                return family, kind, help_, family + '_total', sample_labels
+            return base, kind, help_, base, sample_labels
+
+        for suffix in _HISTOGRAM_SUFFIXES:
+            if base.endswith(suffix):
+                family = base[:-len(suffix)]
+                description = describe(family)
+                if description is not None and description[0] == 'histogram':
+                    return family, 'histogram', description[1], base, sample_labels
+
+        return base, 'unknown', '', base, sample_labels
+
+    # ----------------------------------------------------------------------
+    def wsgi_app(self, environ, start_response):
+        if environ.get('REQUEST_METHOD', 'GET') not in ('GET', 'HEAD'):
+            start_response('405 Method Not Allowed', [('Allow', 'GET, HEAD')])
+            return [b'']
+        body = self.render()
+        start_response('200 OK', [('Content-Type', CONTENT_TYPE),
+                                  ('Content-Length', str(len(body)))])
+        if environ.get('REQUEST_METHOD') == 'HEAD':
+            return [b'']
+        return [body]
+
+
+class _QuietRequestHandler(WSGIRequestHandler):
+
+    # ----------------------------------------------------------------------
+    def log_message(self, format, *args):
+        pass  # don't write every scrape to stderr
+
+
+# ----------------------------------------------------------------------
+def start_http_server(port, addr='127.0.0.1', exporter=None):
+    """Serve the statistics over HTTP from a daemon thread.
+
+    :param port: Port to listen on, 0 to choose a free port (see `server.server_port`)
+    :param addr: Address to listen on, only the local host by default
+    :param exporter: OpenMetricsExporter to serve, by default one for all handlers
+    :return: The server, call `server.shutdown()` to stop it
+    """
+    if exporter is None:
+        exporter = OpenMetricsExporter()
+    server = make_server(addr, port, exporter.wsgi_app, handler_class=_QuietRequestHandler)
+    thread = Thread(target=server.serve_forever, name='OpenMetricsHTTPServer')
+    thread.daemon = True
+    thread.start()
+    return server
+
+
+# ----------------------------------------------------------------------
+def make_asgi_app(exporter=None):
+    """Create an ASGI application serving the statistics (Python 3.7+ only).
+
+    :param exporter: OpenMetricsExporter to serve, by default one for all handlers
+    """
+    from .aio import OpenMetricsASGIApp
+    return OpenMetricsASGIApp(exporter if exporter is not None else OpenMetricsExporter())
@@ -0,0 +1,210 @@
+# -*- coding: utf-8 -*-
+#
+# This software may be modified and distributed under the terms
+# of the MIT license.  See the LICENSE file for details.
+
+"""Tools to profile the log processing pipeline in production, see log_async.hooks"""
+
+from threading import Lock
+import cProfile
+
+from .hooks import hooks as process_hooks
+from .utils import monotonic, safe_log_via_print
+
+
+class _Timing(object):
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.events = 0
+
+    def add(self, duration, events=0):
+        self.count += 1
+        self.total += duration
+        self.max = max(self.max, duration)
+        self.events += events
+
+    def format(self, name, with_events):
+        text = u'{} n={} avg={:.2f}ms max={:.2f}ms'.format(
+            name, self.count, self.total / self.count * 1000 if self.count else 0.0,
+            self.max * 1000)
+        if with_events:
+            text += u' events={}'.format(self.events)
+        return text
+
+
+class TimingSampler(object):
+    """Write periodic summaries of the time spent in the stages of the worker,
+    collected with hooks.
+
+    A summary is written with the first hook call after `interval` seconds and on `stop()`.
+    The sampler does not use `on_enqueue` to keep emit() free of locks, the time spent in
+    emit() is available in the `eventlog_handler_emit_seconds` histogram.
+
+    :param interval: Seconds between summaries
+    :param output: Callable receiving each summary line, by default printed to stderr
+    :param registry: HookRegistry to register with, the hooks of the process by default
+    :param clock: Function returning the current (monotonic) time in seconds
+    """
+
+    # ----------------------------------------------------------------------
+    def __init__(self, interval=60.0, output=None, registry=None, clock=monotonic):
+        self._interval = interval
+        self._output = output if output is not None else self._print
+        self._registry = registry if registry is not None else process_hooks
+        self._clock = clock
+        self._lock = Lock()
+        self._callbacks = dict(
+            on_cache_write=self._on_cache_write,
+            on_claim=self._on_claim,
+            on_send_end=self._on_send_end,
+            on_requeue=self._on_requeue,
+            on_drop=self._on_drop,
+            on_flush_cycle=self._on_flush_cycle)
+        self._reset()
+
+    # ----------------------------------------------------------------------
+    def start(self):
+        with self._lock:
+            self._reset()
+        for name, callback in self._callbacks.items():
+            self._registry.register(name, callback)
+
+    # ----------------------------------------------------------------------
+    def stop(self):
+        for name, callback in self._callbacks.items():
+            self._registry.unregister(name, callback)
+        self._output(self.summary())
+
+    # ----------------------------------------------------------------------
+    def summary(self):
+        """Format the timings collected since the last summary and start a new period"""
+        with self._lock:
+            return self._summary()
+
+    # ----------------------------------------------------------------------
+    def _summary(self):
+        elapsed = self._clock() - self._period_start
+        parts = [
+            self._cache_write.format(u'cache_write', with_events=False),
+            self._claim.format(u'claim', with_events=True),
+            self._send.format(u'send', with_events=True) + u' errors={}'.format(self._errors),
+            self._flush_cycle.format(u'flush_cycle', with_events=True),
+            u'requeued={}'.format(self._requeued),
+            u'dropped={}'.format(self._dropped),
+        ]
+        self._reset()
+        return u'log_async timings over {:.1f}s: {}'.format(elapsed, u'; '.join(parts))
+
+    # ----------------------------------------------------------------------
+    def _reset(self):
+        self._period_start = self._clock()
+        self._cache_write = _Timing()
+        self._claim = _Timing()
+        self._send = _Timing()
+        self._flush_cycle = _Timing()
+        self._errors = 0
+        self._requeued = 0
+        self._dropped = 0
+
+    # ----------------------------------------------------------------------
+    def _record(self, update):
+        # called from the worker thread and the sender thread of a send pipeline
+        with self._lock:
+            update()
+            if self._clock() - self._period_start < self._interval:
+                return
+            summary = self._summary()
+        self._output(summary)
+
+    # ----------------------------------------------------------------------
+    def _on_cache_write(self, event, duration):
+        self._record(lambda: self._cache_write.add(duration))
+
+    # ----------------------------------------------------------------------
+    def _on_claim(self, events, duration):
+        self._record(lambda: self._claim.add(duration, len(events)))
+
+    # ----------------------------------------------------------------------
+    def _on_send_end(self, events, duration, error):
+        def update():
+            self._send.add(duration, len(events))
+            if error is not None:
+                self._errors += 1
+        self._record(update)
+
+    # ----------------------------------------------------------------------
+    def _on_requeue(self, events, error):
+        def update():
+            self._requeued += len(events)
+        self._record(update)
+
+    # ----------------------------------------------------------------------
+    def _on_drop(self, count, reason):
+        def update():
+            self._dropped += count
+        self._record(update)
+
+    # ----------------------------------------------------------------------
+    def _on_flush_cycle(self, count, duration):
+        self._record(lambda: self._flush_cycle.add(duration, count))
+
+    # ----------------------------------------------------------------------
+    def _print(self, summary):
+        safe_log_via_print('info', u'%s', summary)
+
+
+class WorkerProfiler(object):
+    """Profile the worker thread with cProfile and optionally trace memory allocations
+    with tracemalloc (Python 3 only).
+
+    Pass the profiler to `AsynchronousLogHandler.set_profiler()`. The worker thread calls
+    `start()` and `stop()` itself because cProfile only profiles the thread which enabled it.
+    tracemalloc traces the allocations of all threads of the process.
+
+    :param cpu: Enable cProfile
+    :param memory: Enable tracemalloc, unless it is already tracing
+    :param memory_frames: Number of frames stored per allocation by tracemalloc
+    """
+
+    # ----------------------------------------------------------------------
+    def __init__(self, cpu=True, memory=False, memory_frames=1):
+        self._cpu = cpu
+        self._memory = memory
+        self._memory_frames = memory_frames
+        self._profile = None
+        self._started_tracemalloc = False
+        # results, available after stop()
+        self.profile = None
+        self.snapshot = None
+
+    # ----------------------------------------------------------------------
+    def start(self):
+        if self._memory:
+            import tracemalloc
+            if not tracemalloc.is_tracing():
+                tracemalloc.start(self._memory_frames)
+                self._started_tracemalloc = True
+        if self._cpu:
+            self._profile = cProfile.Profile()
+            self._profile.enable()
+
+    # ----------------------------------------------------------------------
+    def stop(self):
+        if self._profile is not None:
+            self._profile.disable()
+            self.profile, self._profile = self._profile, None
+        if self._memory:
+            import tracemalloc
+            if tracemalloc.is_tracing():
+                self.snapshot = tracemalloc.take_snapshot()
+            if self._started_tracemalloc:
+                tracemalloc.stop()
+                self._started_tracemalloc = False
+
+    # ----------------------------------------------------------------------
+    def dump(self, path):
+        """Write the cProfile results to `path`, to be loaded with pstats or e.g. snakeviz"""
+        self.profile.dump_stats(path)
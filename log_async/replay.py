@@ -0,0 +1,660 @@
+# -*- coding: utf-8 -*-
+#
+# This software may be modified and distributed under the terms
+# of the MIT license.  See the LICENSE file for details.
+
+"""Send the events left in SQLite buffer files (see DatabaseCache), e.g. after an outage
+on hosts whose processes have exited, and the events of dead-letter spool directories
+(see log_async.spool).
+
+Usage: python -m log_async.replay PATH [PATH ...] --host HOST --port PORT
+                                  [--transport PATH] [--connections N] [--batch-size N]
+                                  [--rate EVENTS_PER_SECOND] [--spool DIRECTORY]
+                                  [--reclaim] [--dry-run]
+"""
+
+from __future__ import division, print_function
+
+from collections import deque
+from itertools import islice
+from threading import Thread
+import argparse
+import errno
+import os
+import socket
+import sqlite3
+import sys
+import time
+import uuid
+
+from six.moves.queue import Empty, Queue
+
+from .constants import constants
+from .database import DatabaseCache, DatabaseLockedError
+from .spool import (
+    DeadLetterSpool,
+    PROGRESS_SUFFIX,
+    read_spool_file,
+    REASON_REJECTED,
+    REPLAYING_SUFFIX,
+    SPOOL_SUFFIX,
+    WRITING_SUFFIX,
+)
+from .transport import PartialSendError, RejectedEventError
+from .utils import ichunked, import_string, monotonic
+
+
+# values of `pending_delete`: queued, claimed by the worker of a process, claimed for replay
+PENDING_QUEUED = 0
+PENDING_CLAIMED = 1
+PENDING_REPLAY = 2
+
+# seconds to wait before retrying an operation on a locked database
+LOCKED_RETRY_DELAY = 0.1
+
+
+class ReplayError(Exception):
+    """Replaying a file was aborted, the events which were not sent are kept"""
+
+
+class ReplayBuffer(DatabaseCache):
+    """A DatabaseCache file read by the replay tool.
+
+    Events are claimed in bounded batches, marked with `pending_delete` = PENDING_REPLAY,
+    so a process still using the file neither sends nor deletes them as its own, and
+    deleted once they were sent. The claims record the replay owning them
+    (`replay_owner`: host, process id and a token of the buffer), events left claimed by
+    an interrupted replay are queued again by `release()` when the next replay starts,
+    while the events claimed by a replay which is still running are left alone.
+
+    :param path: Path to the SQLite database, which must exist
+    """
+
+    # ----------------------------------------------------------------------
+    def __init__(self, path):
+        if not os.path.exists(path):
+            raise ReplayError(u'Buffer file {} does not exist'.format(path))
+        super(ReplayBuffer, self).__init__(path)
+        self._owner = u'{}:{}:{}'.format(socket.gethostname(), os.getpid(), uuid.uuid4().hex)
+
+    # ----------------------------------------------------------------------
+    @property
+    def path(self):
+        return self._database_path
+
+    # ----------------------------------------------------------------------
+    def _upgrade_schema(self, cursor):
+        super(ReplayBuffer, self)._upgrade_schema(cursor)
+        # only added to the files which are replayed, the handler does not use the column
+        columns = [row[1] for row in cursor.execute('PRAGMA table_info(`event`)')]
+        if 'replay_owner' in columns:
+            return
+        try:
+            cursor.execute('ALTER TABLE `event` ADD COLUMN `replay_owner` TEXT')
+        except sqlite3.OperationalError as e:
+            if 'duplicate column' not in str(e):
+                raise  # otherwise added by another replay meanwhile
+
+    # ----------------------------------------------------------------------
+    def claim(self, limit):
+        """
+        :return: list of up to `limit` (event_id, event_text) rows, oldest first
+        """
+        query_fetch = 'SELECT `event_id`, `event_text` FROM `event` ' \
+            'WHERE `pending_delete` = ? ORDER BY `event_id` LIMIT ?'
+        query_update_base = 'UPDATE `event` SET `pending_delete`={}, `replay_owner`=? ' \
+            'WHERE `event_id` IN (%s);'.format(PENDING_REPLAY)
+        with self._connect() as connection:
+            cursor = connection.cursor()
+            cursor.execute(query_fetch, (PENDING_QUEUED, limit))
+            events = cursor.fetchall()
+            # split into multiple queries as SQLite has a maximum 1000 variables per query
+            event_ids = [event[0] for event in events]
+            for event_ids_subset in ichunked(event_ids, constants.DATABASE_EVENT_CHUNK_SIZE - 1):
+                statement = query_update_base % ','.join('?' * len(event_ids_subset))
+                cursor.execute(statement, [self._owner] + event_ids_subset)
+        return events
+
+    # ----------------------------------------------------------------------
+    def release(self, events=None, reclaim=False):
+        """Queue claimed events again.
+
+        :param events: Events returned by `claim()`, None for the events claimed by replays
+                       which are not running any longer
+        :param reclaim: Also queue the events claimed by the worker of a process and by
+                        other replays, only safe if no process uses the file
+        """
+        with self._connect() as connection:
+            cursor = connection.cursor()
+            if events is not None:
+                query_update_base = 'UPDATE `event` SET `pending_delete`={}, ' \
+                    '`replay_owner`=NULL WHERE `event_id` IN (%s);'.format(PENDING_QUEUED)
+                return self._bulk_update_events(cursor, events, query_update_base)
+            query_update = 'UPDATE `event` SET `pending_delete`=?, `replay_owner`=NULL ' \
+                'WHERE `pending_delete` = ?'
+            count = 0
+            if reclaim:
+                cursor.execute(query_update, (PENDING_QUEUED, PENDING_CLAIMED))
+                count += cursor.rowcount
+            owners = [row[0] for row in cursor.execute(
+                'SELECT DISTINCT `replay_owner` FROM `event` WHERE `pending_delete` = ?;',
+                (PENDING_REPLAY,))]
+            for owner in owners:
+                if not reclaim and owner != self._owner and _is_running(owner):
+                    continue
+                if owner is None:
+                    cursor.execute(query_update + ' AND `replay_owner` IS NULL;',
+                                   (PENDING_QUEUED, PENDING_REPLAY))
+                else:
+                    cursor.execute(query_update + ' AND `replay_owner` = ?;',
+                                   (PENDING_QUEUED, PENDING_REPLAY, owner))
+                count += cursor.rowcount
+            return count
+
+    # ----------------------------------------------------------------------
+    def count_queued(self):
+        with self._connect() as connection:
+            return connection.execute(
+                'SELECT COUNT(*) FROM `event` WHERE `pending_delete` = ?;',
+                (PENDING_QUEUED,)).fetchone()[0]
+
+    # ----------------------------------------------------------------------
+    def finish(self):
+        """Called once all events were sent"""
+        pass
+
+
+class ReplaySpoolFile(object):
+    """A file of a dead-letter spool read by the replay tool.
+
+    The file is renamed to end with REPLAYING_SUFFIX before it is replayed (see
+    `Replayer.replay()`), so neither another replay nor a spool deleting its oldest files
+    touches it. Events are read in bounded batches and the number of events sent in order
+    is kept in a progress file, so an interrupted replay continues after them. The file is
+    deleted once all its events were sent.
+
+    :param path: Path of the spool file
+    """
+
+    # ----------------------------------------------------------------------
+    def __init__(self, path):
+        self.path = path
+        self._progress_path = path + PROGRESS_SUFFIX
+        # number of events at the start of the file which were sent
+        self._done = self._read_progress()
+        self._events = None
+        self._claimed = self._done
+        self._sent = set()
+        self._count = None
+
+    # ----------------------------------------------------------------------
+    def claim(self, limit):
+        """
+        :return: list of up to `limit` (number, event) tuples, in the order of the file
+        """
+        if self._events is None:
+            self._events = (event for _, _, event in read_spool_file(self.path))
+            for _ in islice(self._events, self._done):
+                pass
+        events = list(enumerate(islice(self._events, limit), self._claimed))
+        self._claimed += len(events)
+        return events
+
+    # ----------------------------------------------------------------------
+    def release(self, events=None, reclaim=False):
+        # events which were not sent are read again after the last event sent in order
+        return 0
+
+    # ----------------------------------------------------------------------
+    def delete_events(self, events):
+        self._sent.update(number for number, _ in events)
+        done = self._done
+        while done in self._sent:
+            self._sent.remove(done)
+            done += 1
+        if done != self._done:
+            self._done = done
+            self._write_progress()
+
+    # ----------------------------------------------------------------------
+    def count_queued(self):
+        if self._count is None:
+            self._count = sum(1 for _ in read_spool_file(self.path))
+        return self._count - self._done
+
+    # ----------------------------------------------------------------------
+    def finish(self):
+        """Called once all events were sent"""
+        for path in (self.path, self._progress_path):
+            if os.path.exists(path):
+                os.remove(path)
+
+    # ----------------------------------------------------------------------
+    def _read_progress(self):
+        try:
+            with open(self._progress_path) as progress_file:
+                return int(progress_file.read())
+        except (IOError, ValueError):
+            return 0
+
+    # ----------------------------------------------------------------------
+    def _write_progress(self):
+        temporary_path = self._progress_path + '.tmp'
+        with open(temporary_path, 'w') as progress_file:
+            progress_file.write(str(self._done))
+        os.rename(temporary_path, self._progress_path)
+
+
+class _SenderPool(object):
+    """Threads sending batches, each over its own transport connection"""
+
+    # ----------------------------------------------------------------------
+    def __init__(self, transport_factory, connections):
+        self._batches = Queue()
+        self._results = Queue()
+        self.in_flight = 0
+        self._threads = [Thread(target=self._run, args=(transport_factory,),
+                                name='ReplaySender-{}'.format(index))
+                         for index in range(connections)]
+        for thread in self._threads:
+            thread.daemon = True
+            thread.start()
+
+    # ----------------------------------------------------------------------
+    def submit(self, batch):
+        self.in_flight += 1
+        self._batches.put(batch)
+
+    # ----------------------------------------------------------------------
+    def collect(self, timeout):
+        """
+        :return: list of (batch, error) tuples of the sent batches, error is None on success
+        """
+        results = []
+        try:
+            if timeout:
+                results.append(self._results.get(timeout=timeout))
+            while True:
+                results.append(self._results.get(block=False))
+        except Empty:
+            pass
+        self.in_flight -= len(results)
+        return results
+
+    # ----------------------------------------------------------------------
+    def stop(self):
+        for _ in self._threads:
+            self._batches.put(None)
+        for thread in self._threads:
+            thread.join()
+
+    # ----------------------------------------------------------------------
+    def _run(self, transport_factory):
+        transport = None
+        while True:
+            batch = self._batches.get()
+            if batch is None:
+                break
+            try:
+                if transport is None:
+                    transport = transport_factory()
+                transport.send([event[1] for event in batch])
+            except Exception as e:
+                self._results.put((batch, e))
+            else:
+                self._results.put((batch, None))
+        if transport is not None:
+            transport.close()
+
+
+class Replayer(object):
+    """Send the events of buffer files over several connections at a limited rate.
+
+    Events are claimed in batches of `batch_size`, at most `connections` batches are in
+    flight and sent batches are deleted right away, so memory use does not depend on the
+    size of the file. Failed batches are retried with exponential backoff, after
+    `max_failures` consecutive failures the replay is aborted and the unsent events are
+    queued again. Events rejected by the transport (RejectedEventError) are removed and
+    written to `spool`, if given. Events are sent at least once: if the replay is
+    interrupted between sending a batch and deleting it, the batch is sent again by the
+    next replay.
+
+    :param transport_factory: Callable returning a new transport
+    :param connections: Number of parallel connections
+    :param batch_size: Maximum number of events per batch
+    :param rate: Maximum number of events per second, None for no limit
+    :param max_failures: Number of consecutive failed sends after which the replay is aborted
+    :param reclaim: Also send the events claimed by the worker of a process which
+                    exited while sending them, only safe if no process uses the files
+    :param backoff_initial: Delay in seconds after the first failed send, doubled with every
+                            further consecutive failure
+    :param backoff_max: Maximum delay in seconds after failed sends
+    :param progress: Callable receiving progress messages, None to not report progress
+    :param progress_interval: Seconds between progress messages
+    :param spool: DeadLetterSpool receiving the rejected events, None to drop them
+    """
+
+    # ----------------------------------------------------------------------
+    def __init__(self, transport_factory, connections=4, batch_size=500, rate=None,
+                 max_failures=10, reclaim=False, backoff_initial=1.0, backoff_max=30.0,
+                 progress=None, progress_interval=10.0, spool=None):
+        self._transport_factory = transport_factory
+        self._connections = connections
+        self._batch_size = batch_size
+        self._rate = rate
+        self._max_failures = max_failures
+        self._reclaim = reclaim
+        self._backoff_initial = backoff_initial
+        self._backoff_max = backoff_max
+        self._progress = progress
+        self._progress_interval = progress_interval
+        self._spool = spool
+
+    # ----------------------------------------------------------------------
+    def replay(self, path):
+        """Send and delete the queued events of a buffer file, or the events of the
+        completed files of a spool directory, oldest first. With `reclaim`, the files
+        which a process was writing when it exited are replayed too.
+
+        :param path: Path of a buffer file or of a spool directory
+        :return: Number of events sent
+        :raises ReplayError: if sending failed `max_failures` times in a row
+        """
+        if os.path.isdir(path):
+            return sum(self._replay(ReplaySpoolFile(spool_path))
+                       for spool_path in self._claim_spool_files(path))
+        return self._replay(ReplayBuffer(path))
+
+    # ----------------------------------------------------------------------
+    def _claim_spool_files(self, directory):
+        # names start with the time the file was created
+        for name in sorted(os.listdir(directory)):
+            path = os.path.join(directory, name)
+            if name.endswith(SPOOL_SUFFIX + REPLAYING_SUFFIX):
+                yield path  # continue an interrupted replay
+                continue
+            if name.endswith(SPOOL_SUFFIX):
+                claimed_path = path + REPLAYING_SUFFIX
+            elif self._reclaim and name.endswith(SPOOL_SUFFIX + WRITING_SUFFIX):
+                claimed_path = path[:-len(WRITING_SUFFIX)] + REPLAYING_SUFFIX
+            else:
+                continue
+            try:
+                os.rename(path, claimed_path)
+            except OSError:
+                continue  # claimed by another replay or deleted meanwhile
+            yield claimed_path
+
+    # ----------------------------------------------------------------------
+    def _replay(self, buffer):
+        state = _ReplayState(buffer)
+        self._retry_locked(state.buffer.release, reclaim=self._reclaim)
+        pool = _SenderPool(self._transport_factory, self._connections)
+        try:
+            self._run(state, pool)
+        finally:
+            pool.stop()
+            # apply the results of the batches which were in flight and queue unsent events
+            for batch, error in pool.collect(timeout=0):
+                self._handle_result(state, batch, error)
+            if state.retry:
+                self._retry_locked(state.buffer.release, [
+                    event for batch in state.retry for event in batch])
+            self._delete_sent(state, force=True)
+        state.buffer.finish()
+        self._report(state, force=True)
+        return state.sent
+
+    # ----------------------------------------------------------------------
+    def _run(self, state, pool):
+        while True:
+            can_submit = pool.in_flight < self._connections and \
+                (state.retry or not state.exhausted)
+            for batch, error in pool.collect(timeout=0 if can_submit else 0.1):
+                self._handle_result(state, batch, error)
+            if state.failures >= self._max_failures:
+                raise ReplayError(u'Sending failed {} times in a row: {}'.format(
+                    state.failures, state.error))
+            self._delete_sent(state)
+            self._report(state)
+
+            if not state.retry and state.exhausted and not pool.in_flight:
+                return
+            if pool.in_flight >= self._connections:
+                continue  # wait for batches in flight
+            delay = state.not_before - monotonic()
+            if delay > 0:
+                # wait for the backoff delay, still applying the results of batches in flight
+                for batch, error in pool.collect(timeout=min(delay, 0.1)):
+                    self._handle_result(state, batch, error)
+                continue
+            if state.retry:
+                batch = state.retry.popleft()
+            elif not state.exhausted:
+                try:
+                    batch = state.buffer.claim(self._batch_size)
+                except DatabaseLockedError:
+                    # the process using the file holds the lock, try again after a delay
+                    state.not_before = monotonic() + LOCKED_RETRY_DELAY
+                    continue
+                if not batch:
+                    state.exhausted = True
+                    continue
+            else:
+                continue
+            self._limit_rate(state, len(batch))
+            pool.submit(batch)
+
+    # ----------------------------------------------------------------------
+    def _handle_result(self, state, batch, error):
+        if error is None:
+            state.sent += len(batch)
+            state.unsent_deletes.extend(batch)
+            state.failures = 0
+            return
+
+        if isinstance(error, PartialSendError):
+            state.sent += error.sent
+            done = error.sent
+            if isinstance(error, RejectedEventError):
+                self._reject(state, batch[done])
+                done += 1
+            state.unsent_deletes.extend(batch[:done])
+            batch = batch[done:]
+            if isinstance(error, RejectedEventError):
+                # the server is reachable, only the rejected event cannot be sent
+                state.failures = 0
+                if batch:
+                    state.retry.appendleft(batch)
+                return
+            if error.sent:
+                state.failures = 0
+        state.retry.appendleft(batch)
+        state.failures += 1
+        state.error = error
+        delay = min(self._backoff_initial * 2 ** (state.failures - 1), self._backoff_max)
+        state.not_before = monotonic() + delay
+
+    # ----------------------------------------------------------------------
+    def _reject(self, state, event):
+        state.rejected += 1
+        if self._spool is not None:
+            self._spool.add(event[1], REASON_REJECTED)
+
+    # ----------------------------------------------------------------------
+    def _delete_sent(self, state, force=False):
+        if not state.unsent_deletes:
+            return
+        if force:
+            self._retry_locked(state.buffer.delete_events, state.unsent_deletes)
+        else:
+            try:
+                state.buffer.delete_events(state.unsent_deletes)
+            except DatabaseLockedError:
+                return  # try again with the next sent batch
+        state.unsent_deletes = []
+
+    # ----------------------------------------------------------------------
+    def _limit_rate(self, state, count):
+        if not self._rate:
+            return
+        now = monotonic()
+        if state.rate_next > now:
+            time.sleep(state.rate_next - now)
+            now = state.rate_next
+        state.rate_next = now + count / self._rate
+
+    # ----------------------------------------------------------------------
+    def _report(self, state, force=False):
+        if self._progress is None:
+            return
+        now = monotonic()
+        if not force and now - state.reported < self._progress_interval:
+            return
+        state.reported = now
+        try:
+            queued = state.buffer.count_queued()
+        except DatabaseLockedError:
+            queued = u'?'
+        elapsed = now - state.start
+        rejected = u', {} rejected'.format(state.rejected) if state.rejected else u''
+        self._progress(u'{}: {} events sent ({:.0f}/s){}, {} queued'.format(
+            state.buffer.path, state.sent, state.sent / elapsed if elapsed else 0.0,
+            rejected, queued))
+
+    # ----------------------------------------------------------------------
+    def _retry_locked(self, function, *args, **kwargs):
+        while True:
+            try:
+                return function(*args, **kwargs)
+            except DatabaseLockedError:
+                time.sleep(LOCKED_RETRY_DELAY)
+
+
+# ----------------------------------------------------------------------
+def _is_running(owner):
+    """
+    :param owner: `replay_owner` of claimed events, None for claims of older versions
+    :return: False if the replay which claimed the events is known to have exited
+    """
+    if owner is None:
+        return False
+    host, pid, _ = owner.rsplit(u':', 2)
+    if host != socket.gethostname() or os.name == 'nt':
+        return True  # cannot be checked, the events are only released by --reclaim
+    try:
+        os.kill(int(pid), 0)
+    except OSError as e:
+        return e.errno == errno.EPERM
+    return True
+
+
+class _ReplayState(object):
+
+    def __init__(self, buffer):
+        self.buffer = buffer
+        self.sent = 0
+        self.rejected = 0
+        self.retry = deque()
+        self.unsent_deletes = []
+        self.exhausted = False
+        self.failures = 0
+        self.error = None
+        self.not_before = 0.0
+        self.rate_next = 0.0
+        self.start = self.reported = monotonic()
+
+
+# ----------------------------------------------------------------------
+def count_queued(path, reclaim=False):
+    """
+    :param path: Path of a buffer file or of a spool directory
+    :return: Number of events which a replay of the path would send
+    """
+    if not os.path.isdir(path):
+        return ReplayBuffer(path).count_queued()
+    suffixes = (SPOOL_SUFFIX, SPOOL_SUFFIX + REPLAYING_SUFFIX)
+    if reclaim:
+        suffixes += (SPOOL_SUFFIX + WRITING_SUFFIX,)
+    return sum(ReplaySpoolFile(os.path.join(path, name)).count_queued()
+               for name in os.listdir(path) if name.endswith(suffixes))
+
+
+# ----------------------------------------------------------------------
+def create_parser():
+    parser = argparse.ArgumentParser(
+        prog='python -m log_async.replay', description=__doc__.splitlines()[0])
+    parser.add_argument('paths', nargs='+', metavar='PATH',
+                        help='SQLite buffer files and dead-letter spool directories')
+    parser.add_argument('--host', default='localhost',
+                        help='host of the log forwarding server')
+    parser.add_argument('--port', type=int, default=5959,
+                        help='port of the log forwarding server')
+    parser.add_argument('--transport', default='log_async.transport.TcpTransport',
+                        help='path of the transport class')
+    parser.add_argument('--ssl-enable', action='store_true')
+    parser.add_argument('--ssl-no-verify', action='store_true')
+    parser.add_argument('--keyfile')
+    parser.add_argument('--certfile')
+    parser.add_argument('--ca-certs')
+    parser.add_argument('--connections', type=int, default=4,
+                        help='number of parallel connections')
+    parser.add_argument('--batch-size', type=int, default=500,
+                        help='maximum number of events per batch')
+    parser.add_argument('--rate', type=float,
+                        help='maximum number of events per second, unlimited by default')
+    parser.add_argument('--max-failures', type=int, default=10,
+                        help='consecutive failed sends after which a file is skipped')
+    parser.add_argument('--spool', metavar='DIRECTORY',
+                        help='dead-letter spool directory for events rejected by the '
+                             'transport, which are dropped by default')
+    parser.add_argument('--reclaim', action='store_true',
+                        help='also send events claimed by a process which exited while '
+                             'sending them and spool files it was writing; only use if '
+                             'no process uses the files')
+    parser.add_argument('--progress-interval', type=float, default=10.0,
+                        help='seconds between progress messages')
+    parser.add_argument('--dry-run', action='store_true',
+                        help='only print the number of queued events of each path')
+    return parser
+
+
+# ----------------------------------------------------------------------
+def main(argv=None):
+    args = create_parser().parse_args(argv)
+    transport_class = import_string(args.transport)
+
+    def create_transport():
+        return transport_class(
+            host=args.host, port=args.port, ssl_enable=args.ssl_enable,
+            ssl_verify=not args.ssl_no_verify, keyfile=args.keyfile, certfile=args.certfile,
+            ca_certs=args.ca_certs)
+
+    spool = DeadLetterSpool(args.spool) if args.spool else None
+    replayer = Replayer(
+        create_transport, connections=args.connections, batch_size=args.batch_size,
+        rate=args.rate, max_failures=args.max_failures, reclaim=args.reclaim,
+        backoff_initial=constants.CIRCUIT_BREAKER_BACKOFF_INITIAL,
+        backoff_max=constants.CIRCUIT_BREAKER_BACKOFF_MAX,
+        progress=print, progress_interval=args.progress_interval,
+        spool=spool)
+    status = 0
+    try:
+        for path in args.paths:
+            try:
+                if args.dry_run:
+                    print(u'{}: {} events queued'.format(
+                        path, count_queued(path, reclaim=args.reclaim)))
+                else:
+                    replayer.replay(path)
+            except (ReplayError, DatabaseLockedError) as e:
+                print(u'{}: {}'.format(path, e), file=sys.stderr)
+                status = 1
+    finally:
+        if spool is not None:
+            spool.close()
+    return status
+
+
+if __name__ == '__main__':
+    sys.exit(main())
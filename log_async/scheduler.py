@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+#
+# This software may be modified and distributed under the terms
+# of the MIT license.  See the LICENSE file for details.
+
+from .utils import monotonic
+
+
+class _Task(object):
+
+    def __init__(self, name, interval, callback, priority, last_run):
+        self.name = name
+        self.interval = interval
+        self.callback = callback
+        self.priority = priority
+        self.last_run = last_run
+
+    def get_interval(self):
+        return self.interval() if callable(self.interval) else self.interval
+
+
+class MaintenanceScheduler(object):
+    """Run periodic housekeeping tasks of the worker thread, each with its own interval.
+
+    The scheduler does not start threads, the owner calls `run_due()` from its own loop.
+    Intervals are measured with a monotonic clock, so changes of the system time
+    do not delay or bunch up tasks.
+
+    :param clock: Function returning the current (monotonic) time in seconds
+    """
+
+    # ----------------------------------------------------------------------
+    def __init__(self, clock=monotonic):
+        self._clock = clock
+        self._tasks = []
+
+    # ----------------------------------------------------------------------
+    def add(self, name, interval, callback, priority=0):
+        """Register a task.
+
+        :param name: Name of the task, to be used with `reset()` and `is_due()`
+        :param interval: Interval in seconds, or a callable returning the current interval
+        :param callback: Callable without arguments
+        :param priority: Tasks with a lower priority value are run first
+        """
+        self._tasks.append(_Task(name, interval, callback, priority, self._clock()))
+        self._tasks.sort(key=lambda task: task.priority)
+
+    # ----------------------------------------------------------------------
+    def is_due(self, name):
+        task = self._get_task(name)
+        return self._clock() - task.last_run >= task.get_interval()
+
+    # ----------------------------------------------------------------------
+    def reset(self, name):
+        """Restart the interval of a task, e.g. if its work was done outside of the scheduler"""
+        self._get_task(name).last_run = self._clock()
+
+    # ----------------------------------------------------------------------
+    def time_until_next(self):
+        """Seconds until the next task is due, 0 if a task is due already"""
+        now = self._clock()
+        delays = [task.last_run + task.get_interval() - now for task in self._tasks]
+        return max(0, min(delays)) if delays else None
+
+    # ----------------------------------------------------------------------
+    def run_due(self, budget=None):
+        """Run the due tasks in priority order.
+
+        :param budget: Time in seconds after which no further tasks are started in this call,
+                       remaining due tasks are run by the next call. The first due task
+                       is always run.
+        :return: List of the names of the tasks which were run
+        """
+        start = self._clock()
+        executed = []
+        for task in self._tasks:
+            now = self._clock()
+            if now - task.last_run < task.get_interval():
+                continue
+            if executed and budget is not None and now - start >= budget:
+                break
+            task.last_run = now
+            task.callback()
+            executed.append(task.name)
+        return executed
+
+    # ----------------------------------------------------------------------
+    def _get_task(self, name):
+        for task in self._tasks:
+            if task.name == name:
+                return task
+        raise KeyError(name)
@@ -0,0 +1,299 @@
+# -*- coding: utf-8 -*-
+#
+# This software may be modified and distributed under the terms
+# of the MIT license.  See the LICENSE file for details.
+
+import multiprocessing
+import os
+import struct
+import time
+
+from .constants import constants
+from .hooks import hooks
+from .stats import Counter, Gauge, StatsCollector
+from .utils import safe_log_via_print
+from .worker import LogProcessingWorker
+
+
+# capacity, head (total bytes written), tail (total bytes read)
+_HEADER = struct.Struct('=QQQ')
+_LENGTH = struct.Struct('=I')
+
+
+class SharedMemoryRingBuffer(object):
+    """Multi-producer, single-consumer ring buffer of byte strings in shared memory.
+
+    Producers (application processes) append events while holding `lock`, the consumer
+    (the shipper process) copies the pending events out without holding the lock and only
+    takes it to read and advance the offsets. Requires Python 3.8+ (multiprocessing.shared_memory).
+
+    :param size: Capacity in bytes (when creating a new buffer)
+    :param name: Name of an existing buffer to attach to
+    :param lock: multiprocessing.Lock shared by all users of the buffer
+    """
+
+    # ----------------------------------------------------------------------
+    def __init__(self, size=None, name=None, lock=None):
+        from multiprocessing import shared_memory
+        if name is None:
+            self._shm = shared_memory.SharedMemory(create=True, size=_HEADER.size + size)
+            _HEADER.pack_into(self._shm.buf, 0, size, 0, 0)
+            self._owner = True
+        else:
+            self._shm = shared_memory.SharedMemory(name=name)
+            self._owner = False
+        self._buf = self._shm.buf
+        self._capacity = _HEADER.unpack_from(self._buf, 0)[0]
+        self._lock = lock if lock is not None else multiprocessing.Lock()
+
+    # ----------------------------------------------------------------------
+    @property
+    def name(self):
+        return self._shm.name
+
+    # ----------------------------------------------------------------------
+    @property
+    def lock(self):
+        return self._lock
+
+    # ----------------------------------------------------------------------
+    def put(self, data):
+        """Append an event, never blocks on a full buffer.
+
+        :return: False if there is not enough free space for the event
+        """
+        needed = _LENGTH.size + len(data)
+        with self._lock:
+            _, head, tail = _HEADER.unpack_from(self._buf, 0)
+            if needed > self._capacity - (head - tail):
+                return False
+            self._write(head, _LENGTH.pack(len(data)))
+            self._write(head + _LENGTH.size, data)
+            struct.pack_into('=Q', self._buf, 8, head + needed)
+        return True
+
+    # ----------------------------------------------------------------------
+    def get_all(self):
+        """Remove and return all pending events (to be called by a single consumer only)"""
+        with self._lock:
+            _, head, tail = _HEADER.unpack_from(self._buf, 0)
+        events = []
+        position = tail
+        while position < head:
+            length, = _LENGTH.unpack(self._read(position, _LENGTH.size))
+            events.append(self._read(position + _LENGTH.size, length))
+            position += _LENGTH.size + length
+        if position != tail:
+            with self._lock:
+                struct.pack_into('=Q', self._buf, 16, position)
+        return events
+
+    # ----------------------------------------------------------------------
+    def used_bytes(self):
+        _, head, tail = _HEADER.unpack_from(self._buf, 0)
+        return head - tail
+
+    # ----------------------------------------------------------------------
+    def _write(self, position, data):
+        offset = position % self._capacity
+        first = min(len(data), self._capacity - offset)
+        start = _HEADER.size + offset
+        self._buf[start:start + first] = data[:first]
+        if first < len(data):
+            self._buf[_HEADER.size:_HEADER.size + len(data) - first] = data[first:]
+
+    # ----------------------------------------------------------------------
+    def _read(self, position, length):
+        offset = position % self._capacity
+        first = min(length, self._capacity - offset)
+        start = _HEADER.size + offset
+        data = bytes(self._buf[start:start + first])
+        if first < length:
+            data += bytes(self._buf[_HEADER.size:_HEADER.size + length - first])
+        return data
+
+    # ----------------------------------------------------------------------
+    def close(self):
+        self._buf = None
+        self._shm.close()
+        if self._owner:
+            self._shm.unlink()
+
+
+class ShipperStats(StatsCollector):
+
+    def __init__(self, prefix):
+        super(ShipperStats, self).__init__(prefix)
+        self._events = Counter(prefix + "events_total", "events written to the ring buffer")
+        self._dropped = Counter(prefix + "dropped_total", "events dropped on a full ring buffer")
+        self._restarts = Counter(prefix + "restarts_total", "shipper process restarts")
+        self._ring_used = Gauge(prefix + "ring_used_bytes", "bytes pending in the ring buffer")
+        self._all.extend([self._events, self._dropped, self._restarts, self._ring_used])
+
+    def event(self, n=1):
+        self._events.inc(n)
+
+    def drop(self, n=1):
+        self._dropped.inc(n)
+
+    def restart(self, n=1):
+        self._restarts.inc(n)
+
+    def set_ring_used(self, nbytes):
+        self._ring_used.set(nbytes)
+
+
+# ----------------------------------------------------------------------
+def get_fork_context():
+    """The shipper process is always started with the 'fork' start method: the worker
+    arguments (transport, buffer, spool) hold locks and sockets and cannot be pickled as
+    the 'spawn' and 'forkserver' start methods would require.
+
+    :return: multiprocessing context of the 'fork' start method
+    :raises ValueError: if the platform does not support forking
+    """
+    if 'fork' not in multiprocessing.get_all_start_methods():
+        raise ValueError(u'Shipper mode requires the "fork" start method of multiprocessing, '
+                         u'which is not available on this platform')
+    return multiprocessing.get_context('fork')
+
+
+# ----------------------------------------------------------------------
+def run_shipper(ring_name, lock, shutdown_event, flush_event, worker_kwargs):
+    """Entry point of the shipper process: move events from the ring buffer to a
+    LogProcessingWorker which caches and sends them like in the application process"""
+    ring = SharedMemoryRingBuffer(name=ring_name, lock=lock)
+    worker = LogProcessingWorker(**worker_kwargs)
+    worker.start()
+    parent_pid = os.getppid()
+    try:
+        while not shutdown_event.wait(constants.SHIPPER_POLL_INTERVAL):
+            for event in ring.get_all():
+                worker.enqueue_event(event)
+            if flush_event.is_set():
+                flush_event.clear()
+                worker.force_flush_queued_events()
+            if os.getppid() != parent_pid:
+                break  # the application process died, send what we have and exit
+        for event in ring.get_all():
+            worker.enqueue_event(event)
+    finally:
+        worker.shutdown()
+        worker.join()
+        try:
+            worker_kwargs['transport'].close()
+        except Exception as e:
+            safe_log_via_print('error', u'Error on closing transport: {}'.format(e))
+        ring.close()
+
+
+class ShipperClient(object):
+    """Used by AsynchronousLogHandler in place of a LogProcessingWorker to run the
+    caching and sending in a separate shipper process.
+
+    The handler only appends the formatted events to a shared memory ring buffer, the
+    shipper process (started and restarted if necessary by this client in the process which
+    created it) runs the buffer, flush loop and transport. Child processes forked from the
+    application process inherit the client and write into the same ring buffer, so they all
+    share one shipper process.
+
+    :param ring_size: Capacity of the ring buffer in bytes; events which do not fit
+                      are dropped (and counted) instead of blocking the application
+    :param worker_kwargs: Arguments for the LogProcessingWorker in the shipper process,
+                          inherited by forking (see get_fork_context())
+    """
+
+    # ----------------------------------------------------------------------
+    def __init__(self, ring_size, worker_kwargs):
+        self._context = get_fork_context()
+        self._ring = SharedMemoryRingBuffer(size=ring_size, lock=self._context.Lock())
+        self._worker_kwargs = worker_kwargs
+        self._shutdown_event = self._context.Event()
+        self._flush_event = self._context.Event()
+        self._process = None
+        self._owner_pid = os.getpid()
+        self._next_check = 0
+        self._stopped = False
+        self._stats = ShipperStats(constants.SHIPPER_STATS_PREFIX)
+
+    # ----------------------------------------------------------------------
+    @property
+    def transport(self):
+        return self._worker_kwargs['transport']
+
+    # ----------------------------------------------------------------------
+    def start(self):
+        self._process = self._context.Process(
+            target=run_shipper,
+            name='log_async-shipper',
+            args=(self._ring.name, self._ring.lock, self._shutdown_event, self._flush_event,
+                  self._worker_kwargs))
+        self._process.daemon = True
+        self._process.start()
+
+    # ----------------------------------------------------------------------
+    def is_alive(self):
+        if not self._stopped:
+            return True
+        # after shutdown, until the shipper process sent the remaining events and exited
+        return os.getpid() == self._owner_pid and self._process is not None and \
+            self._process.is_alive()
+
+    # ----------------------------------------------------------------------
+    def enqueue_event(self, event, created=None):
+        # called from application threads (of any process sharing the ring buffer),
+        # the ring buffer only carries the event data
+        self._stats.event()
+        if not self._ring.put(event):
+            self._stats.drop()
+            hook = hooks.on_drop
+            if hook is not None:
+                hook(1, 'ring_full')
+        now = time.time()
+        if now >= self._next_check:
+            self._next_check = now + constants.SHIPPER_SUPERVISE_INTERVAL
+            self._supervise()
+
+    # ----------------------------------------------------------------------
+    def _supervise(self):
+        if os.getpid() != self._owner_pid or self._stopped:
+            return  # only the process which started the shipper can supervise it
+        if self._process is None or not self._process.is_alive():
+            if self._process is not None:
+                self._stats.restart()
+                safe_log_via_print(
+                    'warning', u'Shipper process died (exit code %s), restarting',
+                    self._process.exitcode)
+            self.start()
+
+    # ----------------------------------------------------------------------
+    def force_flush_queued_events(self):
+        self._flush_event.set()
+
+    # ----------------------------------------------------------------------
+    def shutdown(self):
+        self._stopped = True
+        if os.getpid() == self._owner_pid:
+            self._shutdown_event.set()
+
+    # ----------------------------------------------------------------------
+    def join(self, timeout=None):
+        """Wait for the shipper process to exit and release the ring buffer
+
+        :param timeout: Maximum number of seconds to wait, None to wait until it exited
+        :return: False if the shipper process is still running after the timeout, the ring
+                 buffer is kept then and released by a later call
+        """
+        if os.getpid() != self._owner_pid or self._process is None:
+            return True
+        self._process.join(timeout)
+        if self._process.is_alive():
+            return False
+        self._process = None
+        self._ring.close()
+        return True
+
+    # ----------------------------------------------------------------------
+    def get_stats(self):
+        self._stats.set_ring_used(self._ring.used_bytes())
+        return self._stats.get_stats()
@@ -0,0 +1,311 @@
+# -*- coding: utf-8 -*-
+#
+# This software may be modified and distributed under the terms
+# of the MIT license.  See the LICENSE file for details.
+
+"""Dead-letter spool: append-only, compressed files keeping the events which a cache could
+not buffer (overflow), which expired or which were rejected permanently, until they are
+sent with `python -m log_async.replay`."""
+
+from threading import Lock
+import errno
+import itertools
+import os
+import struct
+import time
+import zlib
+
+from .constants import constants
+from .stats import Counter, StatsCollector
+from .utils import monotonic
+
+
+REASON_OVERFLOW = 'overflow'
+REASON_EXPIRED = 'expired'
+REASON_REJECTED = 'rejected'
+
+# suffix of completed spool files, which are ready to be replayed
+SPOOL_SUFFIX = '.spool.gz'
+# suffixes appended to the name of a spool file while a process writes it and while it is
+# replayed, and of the file keeping the progress of the replay
+WRITING_SUFFIX = '.open'
+REPLAYING_SUFFIX = '.replay'
+PROGRESS_SUFFIX = '.progress'
+
+# gzip format, every block written is a gzip member of its own
+_GZIP_WBITS = 16 + zlib.MAX_WBITS
+# record header: length of the reason, length of the event and time the event was spooled
+_HEADER = struct.Struct('>BId')
+_READ_SIZE = 64 * 1024
+
+_file_numbers = itertools.count()
+
+
+class SpoolStats(StatsCollector):
+
+    def __init__(self, prefix):
+        super(SpoolStats, self).__init__(prefix)
+        self._written_bytes = Counter(prefix + "written_bytes_total",
+                                      "compressed bytes written to spool files")
+        self._dropped = Counter(prefix + "dropped_total",
+                                "events dropped because the spool was full or not writable")
+        self._deleted_files = Counter(prefix + "deleted_files_total",
+                                      "spool files deleted to stay below the maximum size")
+        self._all.extend([self._written_bytes, self._dropped, self._deleted_files])
+        # reason -> counter of spooled events
+        self._reasons = {}
+
+    def spool(self, reason, n=1):
+        counter = self._reasons.get(reason)
+        if counter is None:
+            counter = Counter(self.prefix + reason + "_total",
+                              "events spooled with reason " + reason)
+            self._reasons[reason] = counter
+            self._all.append(counter)
+        counter.inc(n)
+
+    def written(self, nbytes):
+        self._written_bytes.inc(nbytes)
+
+    def drop(self, n=1):
+        self._dropped.inc(n)
+
+    def delete_file(self):
+        self._deleted_files.inc(1)
+
+
+class DeadLetterSpool(object):
+    """Append events with a reason code to compressed files in a directory.
+
+    Events are collected in memory until `block_size` bytes are reached or the oldest of
+    them was held for `flush_interval` seconds, then compressed and appended to the current
+    file as a gzip member of its own. A block which was not written completely when the
+    process was killed only ends the file early. Once a file reaches `max_file_size` it is
+    completed (renamed to end with SPOOL_SUFFIX) and a new file is started. If the files in
+    the directory exceed `max_total_size`, the oldest completed files are deleted; if that is
+    not enough, new events are dropped. The directory may be shared by several processes.
+
+    :param directory: Directory of the spool files, created if it does not exist
+    :param max_file_size: Compressed size in bytes after which a file is completed
+    :param max_total_size: Maximum size in bytes of all spool files in the directory
+    :param block_size: Number of bytes of events collected before they are written
+    :param flush_interval: Maximum time in seconds events are held in memory
+    :param compresslevel: zlib compression level (1-9)
+    """
+
+    # ----------------------------------------------------------------------
+    def __init__(self, directory, max_file_size=None, max_total_size=None, block_size=None,
+                 flush_interval=None, compresslevel=6):
+        self._directory = directory
+        self._max_file_size = max_file_size or constants.SPOOL_MAX_FILE_SIZE
+        self._max_total_size = max_total_size or constants.SPOOL_MAX_TOTAL_SIZE
+        self._block_size = block_size or constants.SPOOL_BLOCK_SIZE
+        self._flush_interval = flush_interval if flush_interval is not None \
+            else constants.SPOOL_FLUSH_INTERVAL
+        self._compresslevel = compresslevel
+        self._lock = Lock()
+        self._stats = SpoolStats(constants.SPOOL_STATS_PREFIX)
+        self._reset()
+        try:
+            os.makedirs(directory)
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+
+    # ----------------------------------------------------------------------
+    def _reset(self):
+        self._block = []
+        self._block_bytes = 0
+        self._block_count = 0
+        self._block_started = None
+        self._file = None
+        self._path = None
+        self._file_size = 0
+        # size of the other files in the directory when it was last listed
+        self._other_size = None
+
+    # ----------------------------------------------------------------------
+    @property
+    def directory(self):
+        return self._directory
+
+    # ----------------------------------------------------------------------
+    def add(self, event, reason):
+        """
+        :param event: The formatted event
+        :param reason: Why the event is spooled, e.g. REASON_OVERFLOW (ASCII, at most 255
+                       characters)
+        """
+        if not isinstance(event, bytes):
+            event = event.encode('utf-8')
+        reason_bytes = reason.encode('ascii')
+        header = _HEADER.pack(len(reason_bytes), len(event), time.time())
+        with self._lock:
+            self._block.extend((header, reason_bytes, event))
+            self._block_bytes += len(header) + len(reason_bytes) + len(event)
+            self._block_count += 1
+            self._stats.spool(reason)
+            now = monotonic()
+            if self._block_started is None:
+                self._block_started = now
+            full = self._block_bytes >= self._block_size
+            if full or now - self._block_started >= self._flush_interval:
+                self._write_block()
+
+    # ----------------------------------------------------------------------
+    def flush(self):
+        """Write the events held in memory"""
+        with self._lock:
+            self._write_block()
+
+    # ----------------------------------------------------------------------
+    def close(self):
+        """Write the events held in memory and complete the current file, so it can be
+        replayed. Further events are written to a new file."""
+        with self._lock:
+            self._write_block()
+            self._complete_file()
+
+    # ----------------------------------------------------------------------
+    def reset_after_fork(self):
+        # the events held in memory and the current file belong to the parent process
+        self._lock = Lock()
+        self._stats = SpoolStats(constants.SPOOL_STATS_PREFIX)
+        self._reset()
+
+    # ----------------------------------------------------------------------
+    def get_stats(self):
+        return self._stats.get_stats()
+
+    # ----------------------------------------------------------------------
+    def _write_block(self):
+        if not self._block:
+            return
+        compressor = zlib.compressobj(self._compresslevel, zlib.DEFLATED, _GZIP_WBITS)
+        data = compressor.compress(b''.join(self._block)) + compressor.flush()
+        count = self._block_count
+        self._block = []
+        self._block_bytes = 0
+        self._block_count = 0
+        self._block_started = None
+
+        if not self._reserve(len(data)):
+            self._stats.drop(count)
+            return
+        try:
+            if self._file is None:
+                self._open_file()
+            self._file.write(data)
+            self._file.flush()
+        except EnvironmentError:
+            # e.g. the disk is full, continue with a new file next time
+            self._stats.drop(count)
+            self._complete_file()
+            return
+        self._file_size += len(data)
+        self._stats.written(len(data))
+        if self._file_size >= self._max_file_size:
+            self._complete_file()
+
+    # ----------------------------------------------------------------------
+    def _reserve(self, size):
+        """
+        :return: Whether `size` more bytes fit into the maximum total size, after deleting
+                 the oldest completed files if necessary
+        """
+        needed = self._file_size + size
+        if self._other_size is None or self._other_size + needed > self._max_total_size:
+            # other processes may have written meanwhile
+            self._other_size = self._delete_oldest_files(needed)
+        return self._other_size + needed <= self._max_total_size
+
+    # ----------------------------------------------------------------------
+    def _delete_oldest_files(self, needed):
+        """
+        :return: Total size of the spool files other than the current one
+        """
+        files = []
+        for name in os.listdir(self._directory):
+            path = os.path.join(self._directory, name)
+            if SPOOL_SUFFIX not in name or path == self._path:
+                continue
+            try:
+                files.append((name, path, os.path.getsize(path)))
+            except OSError:
+                pass  # deleted or renamed meanwhile
+        total = sum(size for _, _, size in files)
+        # names start with the time the file was created
+        for name, path, size in sorted(files):
+            if total + needed <= self._max_total_size:
+                break
+            if not name.endswith(SPOOL_SUFFIX):
+                continue  # written or replayed right now
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+            self._stats.delete_file()
+        return total
+
+    # ----------------------------------------------------------------------
+    def _open_file(self):
+        name = u'{:017d}-{}-{}{}'.format(
+            int(time.time() * 1000000), os.getpid(), next(_file_numbers), SPOOL_SUFFIX)
+        self._path = os.path.join(self._directory, name + WRITING_SUFFIX)
+        self._file = open(self._path, 'ab')
+        self._file_size = 0
+
+    # ----------------------------------------------------------------------
+    def _complete_file(self):
+        if self._file is None:
+            return
+        try:
+            self._file.close()
+            os.rename(self._path, self._path[:-len(WRITING_SUFFIX)])
+        except EnvironmentError:
+            pass  # the file can still be replayed with `reclaim`
+        self._file = None
+        self._path = None
+        self._file_size = 0
+        self._other_size = None
+
+
+# ----------------------------------------------------------------------
+def read_spool_file(path):
+    """Read the events of a spool file without loading it into memory.
+
+    A block which was not written completely, e.g. because the process writing the file
+    was killed, ends the file.
+
+    :param path: Path of a spool file
+    :return: Iterator of (reason, spooled, event) tuples, `spooled` being the time
+             (as returned by time.time()) the event was spooled
+    """
+    with open(path, 'rb') as spool_file:
+        decompressor = zlib.decompressobj(_GZIP_WBITS)
+        data = b''
+        while True:
+            chunk = spool_file.read(_READ_SIZE)
+            if not chunk:
+                return
+            try:
+                while chunk:
+                    data += decompressor.decompress(chunk)
+                    # the start of the next gzip member
+                    chunk = decompressor.unused_data
+                    if chunk:
+                        decompressor = zlib.decompressobj(_GZIP_WBITS)
+            except zlib.error:
+                return
+            offset = 0
+            while len(data) - offset >= _HEADER.size:
+                reason_length, event_length, spooled = _HEADER.unpack_from(data, offset)
+                start = offset + _HEADER.size
+                end = start + reason_length + event_length
+                if end > len(data):
+                    break
+                reason = data[start:start + reason_length].decode('ascii')
+                yield reason, spooled, data[start + reason_length:end]
+                offset = end
+            data = data[offset:]
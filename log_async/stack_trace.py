@@ -0,0 +1,132 @@
+# -*- coding: utf-8 -*-
+#
+# This software may be modified and distributed under the terms
+# of the MIT license.  See the LICENSE file for details.
+
+from collections import OrderedDict
+from threading import Lock
+import hashlib
+import time
+import traceback
+
+from six import text_type
+
+
+# ----------------------------------------------------------------------
+def _exception_chain(exc_type, exc_value, tb):
+    """Yield (type, value, traceback) for the exception and its causes/contexts,
+    in the same order as traceback.format_exception() considers them"""
+    seen = set()
+    while exc_type is not None and id(exc_value) not in seen:
+        seen.add(id(exc_value))
+        yield exc_type, exc_value, tb
+        cause = getattr(exc_value, '__cause__', None)
+        if cause is None and not getattr(exc_value, '__suppress_context__', False):
+            cause = getattr(exc_value, '__context__', None)
+        if cause is None:
+            return
+        exc_type, exc_value, tb = type(cause), cause, getattr(cause, '__traceback__', None)
+
+
+# ----------------------------------------------------------------------
+def fingerprint_exception(exc_type, exc_value, tb):
+    """Compute a stable fingerprint of an exception from its type and the code locations
+    of its frames (including chained exceptions). The exception message is not part
+    of the fingerprint, so e.g. KeyErrors for different keys raised at the same place
+    share one fingerprint.
+
+    :return: hex digest string
+    """
+    digest = hashlib.sha1()
+    for chained_type, _, chained_tb in _exception_chain(exc_type, exc_value, tb):
+        name = u'{}.{}'.format(
+            getattr(chained_type, '__module__', ''),
+            getattr(chained_type, '__name__', chained_type))
+        digest.update(name.encode('utf-8'))
+        while chained_tb is not None:
+            code = chained_tb.tb_frame.f_code
+            location = u'|{}:{}:{}'.format(code.co_filename, code.co_name, chained_tb.tb_lineno)
+            digest.update(location.encode('utf-8'))
+            chained_tb = chained_tb.tb_next
+        digest.update(b';')
+    return digest.hexdigest()
+
+
+# ----------------------------------------------------------------------
+def _exception_messages(exc_type, exc_value, tb):
+    messages = []
+    for _, chained_value, _ in _exception_chain(exc_type, exc_value, tb):
+        try:
+            messages.append(text_type(chained_value))
+        except Exception:
+            messages.append(u'<unprintable>')
+    return u'\n'.join(messages)
+
+
+class StackTraceCache(object):
+    """Bounded LRU cache of rendered stack traces, keyed by the exception fingerprint
+    and the exception messages.
+
+    If `dedup_window` is set, the full stack trace of a fingerprint is only returned for the
+    first occurrence within the window (in seconds), repeated occurrences return no
+    stack trace but the number of repetitions within the current window.
+
+    :param max_size: Maximum number of rendered stack traces (and fingerprints) to remember
+    :param dedup_window: Window in seconds to suppress repeated stack traces, None to disable
+    :param clock: Function returning the current time in seconds
+    """
+
+    # ----------------------------------------------------------------------
+    def __init__(self, max_size=256, dedup_window=None, clock=time.time):
+        self._max_size = max_size
+        self._dedup_window = dedup_window
+        self._clock = clock
+        self._rendered = OrderedDict()
+        self._windows = OrderedDict()
+        self._lock = Lock()
+
+    # ----------------------------------------------------------------------
+    def get(self, exc_info):
+        """Look up (or render) the stack trace for an exc_info tuple.
+
+        :return: tuple of (fingerprint, stack_trace, repeats, cache_hit), stack_trace is None
+                 if it was suppressed by deduplication, repeats is the number of occurrences
+                 in the current dedup window (1 for the first occurrence)
+        """
+        fingerprint = fingerprint_exception(*exc_info)
+        repeats = 1
+        with self._lock:
+            if self._dedup_window is not None:
+                repeats = self._count_occurrence(fingerprint)
+                if repeats > 1:
+                    return fingerprint, None, repeats, True
+
+            key = (fingerprint, _exception_messages(*exc_info))
+            stack_trace = self._rendered.pop(key, None)
+            cache_hit = stack_trace is not None
+            if stack_trace is None:
+                stack_trace = ''.join(traceback.format_exception(*exc_info))
+            self._rendered[key] = stack_trace
+            self._trim(self._rendered)
+        return fingerprint, stack_trace, repeats, cache_hit
+
+    # ----------------------------------------------------------------------
+    def reset_after_fork(self):
+        # the lock might have been held by another thread while forking
+        self._lock = Lock()
+
+    # ----------------------------------------------------------------------
+    def _count_occurrence(self, fingerprint):
+        now = self._clock()
+        window = self._windows.pop(fingerprint, None)
+        if window is None or now - window[0] >= self._dedup_window:
+            window = [now, 0]
+        window[1] += 1
+        self._windows[fingerprint] = window
+        self._trim(self._windows)
+        return window[1]
+
+    # ----------------------------------------------------------------------
+    def _trim(self, cache):
+        while len(cache) > self._max_size:
+            cache.popitem(last=False)
@@ -1,35 +1,166 @@
 # stat counters for logging handlers
 
-try:
-    from prometheus_client import Counter, Gauge
-except ImportError:
-    # to avoid a forced dependency on prometheus_client,
-    # use a super-minimalist implementation of counter.
-    # since these are used within same thread, no mutexes are needed.
-    class Value:
-        def __init__(self, name, desc=''):
-            self._name = name
-            self._desc = desc
-            self._value = 0
+from bisect import bisect_left
+import threading
 
-        def inc(self, n=1):
-            self._value += n
+from six.moves._thread import get_ident
 
-        def dec(self, n=1):
-            self._value -= n
 
-        def val(self):
-            return (self._name, self._value)
+# upper bounds of histogram buckets
+# durations of single operations (seconds)
+LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1,
+                   0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# age of events, which may be buffered for a long time while the server is unreachable (seconds)
+AGE_BUCKETS = (0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 10.0, 30.0, 60.0, 300.0, 900.0, 3600.0,
+               21600.0, 86400.0)
+# number of events
+COUNT_BUCKETS = (1, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+# number of bytes
+BYTES_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216)
 
-        def reset(self):
-            self._value = 0
+# kind and description of the metrics by name, for exposition (see log_async.openmetrics)
+_descriptions = {}
 
-    class Counter(Value):
-        pass
 
-    class Gauge(Value):
-        def set(self, n):
-            self._value = n
+def describe(name):
+    """
+    :param name: Name of a metric
+    :return: Tuple of kind ('counter', 'gauge', 'histogram' or 'unknown') and description,
+             None if no metric with this name was created
+    """
+    return _descriptions.get(name)
+
+
+class Value(object):
+    """Metric value which can be updated from any thread without taking a lock.
+
+    Each thread adds to its own shard (keyed by the thread id), so concurrent updates
+    are not lost, and the shards are summed up when the value is read. Thread ids of
+    finished threads are reused by new threads, so the number of shards stays close to
+    the number of threads updating the value at the same time.
+    """
+
+    kind = 'unknown'
+
+    def __init__(self, name, desc=''):
+        self._name = name
+        self._desc = desc
+        _descriptions[name] = (self.kind, desc)
+        self._shards = {}
+        # only taken by set() and reset(), which replace all shards
+        self._lock = threading.Lock()
+
+    @property
+    def name(self):
+        return self._name
+
+    @property
+    def description(self):
+        return self._desc
+
+    def inc(self, n=1):
+        shards = self._shards
+        ident = get_ident()
+        # only this thread writes this key, so the read-modify-write cannot race
+        shards[ident] = shards.get(ident, 0) + n
+
+    def dec(self, n=1):
+        self.inc(-n)
+
+    def value(self):
+        # list() copies the values without releasing the GIL, a shard added
+        # by another thread meanwhile cannot break the iteration
+        return sum(list(self._shards.values()))
+
+    def val(self):
+        return (self._name, self.value())
+
+    def samples(self):
+        return [self.val()]
+
+    def reset(self):
+        self._set(0)
+
+    def _set(self, n):
+        with self._lock:
+            self._shards = {get_ident(): n}
+
+
+class Counter(Value):
+    kind = 'counter'
+
+
+class Gauge(Value):
+    kind = 'gauge'
+
+    def set(self, n):
+        """Set the value, updates by other threads racing with this call may be lost"""
+        self._set(n)
+
+
+class Histogram(object):
+    """Distribution of observed values, counted in buckets with fixed upper bounds.
+
+    Like Value, each thread records into its own shard, so observe() takes no lock.
+    The samples follow the Prometheus naming: cumulative counts per bucket
+    (`<name>_bucket{le="<bound>"}`), `<name>_count` and `<name>_sum`.
+    """
+
+    kind = 'histogram'
+
+    def __init__(self, name, desc='', buckets=LATENCY_BUCKETS):
+        self._name = name
+        self._desc = desc
+        _descriptions[name] = (self.kind, desc)
+        self._buckets = tuple(buckets)
+        self._shards = {}
+
+    @property
+    def name(self):
+        return self._name
+
+    @property
+    def description(self):
+        return self._desc
+
+    @property
+    def buckets(self):
+        return self._buckets
+
+    def observe(self, value):
+        shards = self._shards
+        ident = get_ident()
+        shard = shards.get(ident)
+        if shard is None:
+            # one count per bucket, one for values above the largest bound and the sum
+            shard = shards[ident] = [0] * (len(self._buckets) + 2)
+        shard[bisect_left(self._buckets, value)] += 1
+        shard[-1] += value
+
+    def totals(self):
+        """
+        :return: Tuple of the (non-cumulative) counts per bucket including the overflow
+                 bucket, and the sum of all observed values
+        """
+        totals = [0] * (len(self._buckets) + 2)
+        for shard in list(self._shards.values()):
+            for i, n in enumerate(shard):
+                totals[i] += n
+        return totals[:-1], totals[-1]
+
+    def samples(self):
+        counts, total = self.totals()
+        samples = []
+        cumulative = 0
+        for bound, n in zip(self._buckets + ('+Inf',), counts):
+            cumulative += n
+            samples.append(('{}_bucket{{le="{}"}}'.format(self._name, bound), cumulative))
+        samples.append((self._name + '_count', cumulative))
+        samples.append((self._name + '_sum', total))
+        return samples
+
+    def reset(self):
+        self._shards = {}
 
 
 class StatsCollector(object):
@@ -38,7 +169,7 @@ class StatsCollector(object):
         self.prefix = prefix
 
     def get_stats(self):
-        return [v.val() for v in self._all]
+        return [sample for v in self._all for sample in v.samples()]
 
 
 class LogStats(StatsCollector):
@@ -64,7 +195,10 @@ class LogStats(StatsCollector):
         self._buffered.inc(n)
 
     def unbuffer(self, n=1):
-        self._buffered.dec(min(self._buffered.val()[1], n))
+        self._buffered.dec(min(self._buffered.value(), n))
+
+    def buffered(self):
+        return self._buffered.value()
 
 
 # lookup - finds stat with s in the name. s should be lower case. Used for testing
@@ -0,0 +1,144 @@
+# -*- coding: utf-8 -*-
+#
+# This software may be modified and distributed under the terms
+# of the MIT license.  See the LICENSE file for details.
+
+from collections import OrderedDict
+from threading import Lock
+import hashlib
+import time
+
+from six import text_type
+
+
+TEMPLATE_ID_FIELD = 'message_template_id'
+TEMPLATE_TEXT_FIELD = 'message_template'
+TEMPLATE_ARGS_FIELD = 'message_args'
+
+
+# ----------------------------------------------------------------------
+def template_id(template):
+    """Stable id of a message template, equal across processes and hosts"""
+    if isinstance(template, text_type):
+        template = template.encode('utf-8')
+    return hashlib.sha1(template).hexdigest()[:16]
+
+
+class TemplateRegistry(object):
+    """Keeps track of the message templates sent recently, used by the formatter to decide
+    whether the template text needs to be included in an event.
+
+    :param refresh_interval: Interval in seconds after which a template text is sent again,
+                             so that receivers which missed it (or restarted) learn it again
+    :param max_size: Maximum number of templates to track, the least recently used templates
+                     are announced again once evicted
+    :param clock: Function returning the current time in seconds
+    """
+
+    # ----------------------------------------------------------------------
+    def __init__(self, refresh_interval=300, max_size=4096, clock=time.time):
+        self._refresh_interval = refresh_interval
+        self._max_size = max_size
+        self._clock = clock
+        self._ids = {}
+        self._announced = OrderedDict()
+        self._lock = Lock()
+
+    # ----------------------------------------------------------------------
+    def lookup(self, template, announce=True):
+        """
+        :param announce: Whether to record the template text as sent if it has to be sent,
+                         pass False to call announce() once it was actually included in an event
+        :return: tuple of (template id, flag whether the template text has to be sent)
+        """
+        now = self._clock()
+        with self._lock:
+            id_ = self._ids.get(template)
+            if id_ is None:
+                id_ = template_id(template)
+                if len(self._ids) >= self._max_size:
+                    self._ids.clear()
+                self._ids[template] = id_
+            announced = self._announced.pop(id_, None)
+            send_text = announced is None or now - announced >= self._refresh_interval
+            if send_text and announce:
+                announced = now
+            if announced is not None:
+                self._add_announced(id_, announced)
+        return id_, send_text
+
+    # ----------------------------------------------------------------------
+    def announce(self, id_):
+        """Record the text of the template with the given id as sent"""
+        now = self._clock()
+        with self._lock:
+            self._announced.pop(id_, None)
+            self._add_announced(id_, now)
+
+    # ----------------------------------------------------------------------
+    def _add_announced(self, id_, announced):
+        self._announced[id_] = announced
+        while len(self._announced) > self._max_size:
+            self._announced.popitem(last=False)
+
+    # ----------------------------------------------------------------------
+    def reset(self):
+        """Forget all announced templates, e.g. after reconnecting to another receiver"""
+        with self._lock:
+            self._announced.clear()
+
+    # ----------------------------------------------------------------------
+    def reset_after_fork(self):
+        # the lock might have been held by another thread while forking
+        self._lock = Lock()
+
+
+class TemplateDecoder(object):
+    """Rebuild the messages of template encoded events at the receiving side.
+
+    Feed all events (as decoded dictionaries) in the order they were received to `decode()`.
+
+    :param extra_prefix: The extra_prefix configured on the formatter
+    """
+
+    # ----------------------------------------------------------------------
+    def __init__(self, extra_prefix='extra'):
+        self._extra_prefix = extra_prefix
+        self._templates = {}
+        self.unknown_templates = 0
+
+    # ----------------------------------------------------------------------
+    def decode(self, event):
+        """Set the `message` field of a template encoded event (in place).
+
+        :return: the event, events with an unknown template are returned unchanged
+        """
+        fields = event.get(self._extra_prefix, event) if self._extra_prefix else event
+        id_ = fields.get(TEMPLATE_ID_FIELD)
+        if id_ is None:
+            return event  # not template encoded
+
+        template = fields.get(TEMPLATE_TEXT_FIELD)
+        if template is not None:
+            self._templates[id_] = template
+        else:
+            template = self._templates.get(id_)
+        if template is None:
+            self.unknown_templates += 1
+            return event
+
+        event['message'] = self._interpolate(template, fields.get(TEMPLATE_ARGS_FIELD))
+        return event
+
+    # ----------------------------------------------------------------------
+    def _interpolate(self, template, args):
+        if args is None:
+            return template
+        if isinstance(args, list):
+            args = tuple(args)
+        try:
+            return template % args
+        except (TypeError, ValueError, KeyError):
+            # events of older formatters sent the repr of arguments, which might not
+            # match the format string
+            return u'{} {!r}'.format(template, args)
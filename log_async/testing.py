@@ -0,0 +1,412 @@
+# -*- coding: utf-8 -*-
+#
+# This software may be modified and distributed under the terms
+# of the MIT license.  See the LICENSE file for details.
+
+"""Tools to test the behaviour of the log processing pipeline under failures of the
+log forwarding server: a transport injecting faults on a schedule, a virtual clock and
+a soak test running hours of simulated time within seconds."""
+
+from collections import Counter
+from threading import Event, Lock
+import errno
+import socket
+import time
+
+from .constants import constants
+from .memory_cache import MemoryCache
+from .transport import PartialSendError
+from .utils import monotonic
+from .worker import LogProcessingWorker
+
+
+class VirtualClock(object):
+    """Simulated time, which only advances when told to.
+
+    The clock itself is a monotonic clock to be passed as `clock` to LogProcessingWorker,
+    MaintenanceScheduler, CircuitBreaker or FaultInjectingTransport, `time()` is the matching
+    wall clock for `MemoryCache(clock=...)` and `LogProcessingWorker(wall_clock=...)`.
+
+    :param start: Initial value of the monotonic clock
+    :param epoch: Wall clock time at `start`, the current time by default
+    """
+
+    # ----------------------------------------------------------------------
+    def __init__(self, start=0.0, epoch=None):
+        self._lock = Lock()
+        self._now = start
+        self._epoch = (time.time() if epoch is None else epoch) - start
+
+    # ----------------------------------------------------------------------
+    def __call__(self):
+        return self._now
+
+    # ----------------------------------------------------------------------
+    def time(self):
+        return self._epoch + self._now
+
+    # ----------------------------------------------------------------------
+    def advance(self, seconds):
+        # called by the test and by transports simulating slow sends
+        with self._lock:
+            self._now += seconds
+
+    # ----------------------------------------------------------------------
+    def sleep(self, seconds):
+        """Simulate blocking for `seconds`, to be passed as `sleep` to FaultInjectingTransport"""
+        self.advance(seconds)
+
+
+class Fault(object):
+    """A failure of the log forwarding server, injected by FaultInjectingTransport"""
+
+    name = 'fault'
+
+    # ----------------------------------------------------------------------
+    def apply(self, events, sleep):
+        """
+        :param events: The batch to send
+        :param sleep: Function to simulate time spent sending
+        :return: tuple of (number of leading events which reach the server,
+                 exception to raise after sending them or None)
+        """
+        raise NotImplementedError()
+
+
+class Latency(Fault):
+    """Delay each send by `seconds`"""
+
+    name = 'latency'
+
+    def __init__(self, seconds):
+        self._seconds = seconds
+
+    def apply(self, events, sleep):
+        sleep(self._seconds)
+        return len(events), None
+
+
+class SlowRead(Fault):
+    """The server reads only `bytes_per_second`, sends take time proportional to their size"""
+
+    name = 'slow_read'
+
+    def __init__(self, bytes_per_second):
+        self._bytes_per_second = float(bytes_per_second)
+
+    def apply(self, events, sleep):
+        sleep(sum(len(event) for event in events) / self._bytes_per_second)
+        return len(events), None
+
+
+class PartialWrite(Fault):
+    """Only the first `fraction` of each batch is written, the transport reports how many
+    events were sent (PartialSendError), so nothing is sent twice"""
+
+    name = 'partial_write'
+
+    def __init__(self, fraction=0.5):
+        self._fraction = fraction
+
+    def apply(self, events, sleep):
+        sent = int(len(events) * self._fraction)
+        error = socket.error(errno.EPIPE, 'Broken pipe')
+        return sent, PartialSendError(error, sent)
+
+
+class Disconnect(Fault):
+    """The connection is reset after the first `fraction` of each batch reached the server,
+    the transport cannot tell how much was received, so the batch is sent again later and
+    the server receives duplicates"""
+
+    name = 'disconnect'
+
+    def __init__(self, fraction=0.5):
+        self._fraction = fraction
+
+    def apply(self, events, sleep):
+        return int(len(events) * self._fraction), \
+            socket.error(errno.ECONNRESET, 'Connection reset by peer')
+
+
+class Refused(Fault):
+    """The server is down, connections are refused immediately"""
+
+    name = 'refused'
+
+    def apply(self, events, sleep):
+        return 0, socket.error(errno.ECONNREFUSED, 'Connection refused')
+
+
+class Blackhole(Fault):
+    """Packets are silently dropped, each send times out after `timeout` seconds
+    (constants.SOCKET_TIMEOUT by default)"""
+
+    name = 'blackhole'
+
+    def __init__(self, timeout=None):
+        self._timeout = timeout
+
+    def apply(self, events, sleep):
+        sleep(self._timeout if self._timeout is not None else constants.SOCKET_TIMEOUT)
+        return 0, socket.timeout('timed out')
+
+
+class RecordingTransport(object):
+    """Transport keeping the sent events in memory, e.g. as the server behind a
+    FaultInjectingTransport"""
+
+    # ----------------------------------------------------------------------
+    def __init__(self):
+        self._lock = Lock()
+        self.events = []
+        self.counts = Counter()
+
+    # ----------------------------------------------------------------------
+    def send(self, events):
+        # the sender thread of a send pipeline may send while the test inspects the events
+        with self._lock:
+            self.events.extend(events)
+            self.counts.update(events)
+
+    # ----------------------------------------------------------------------
+    def close(self):
+        pass
+
+    # ----------------------------------------------------------------------
+    def get_stats(self):
+        return []
+
+    # ----------------------------------------------------------------------
+    @property
+    def duplicates(self):
+        """Number of events received more than once (each further copy counts)"""
+        with self._lock:
+            return len(self.events) - len(self.counts)
+
+
+class FaultInjectingTransport(object):
+    """Wrap a transport and inject faults in time windows.
+
+    :param transport: The transport to wrap, receives the events which reach the server
+    :param schedule: Iterable of (start, end, Fault) tuples, in seconds since the transport
+                     was created, `end` None for a fault which does not end
+    :param clock: Function returning the current (monotonic) time in seconds,
+                  e.g. a VirtualClock
+    :param sleep: Function to simulate time spent sending, e.g. `VirtualClock.sleep`
+    """
+
+    # ----------------------------------------------------------------------
+    def __init__(self, transport, schedule=(), clock=monotonic, sleep=time.sleep):
+        self._transport = transport
+        self._schedule = list(schedule)
+        self._clock = clock
+        self._sleep = sleep
+        self._start = clock()
+        # fault name -> number of batches it affected
+        self.injected = Counter()
+
+    # ----------------------------------------------------------------------
+    def active_faults(self):
+        elapsed = self._clock() - self._start
+        return [fault for start, end, fault in self._schedule
+                if start <= elapsed and (end is None or elapsed < end)]
+
+    # ----------------------------------------------------------------------
+    def send(self, events):
+        sent = len(events)
+        error = None
+        for fault in self.active_faults():
+            self.injected[fault.name] += 1
+            fault_sent, fault_error = fault.apply(events, self._sleep)
+            if fault_error is not None and error is None:
+                sent, error = fault_sent, fault_error
+        if sent:
+            self._transport.send(events[:sent])
+        if error is not None:
+            raise error
+
+    # ----------------------------------------------------------------------
+    def close(self):
+        self._transport.close()
+
+    # ----------------------------------------------------------------------
+    def get_stats(self):
+        return self._transport.get_stats()
+
+
+class SimulatedWorker(LogProcessingWorker):
+    """LogProcessingWorker running in lock-step with a test which advances a VirtualClock.
+
+    Instead of waiting for new events, the worker waits until `step()` is called. The
+    messages of the worker are collected in `messages` instead of being logged.
+    """
+
+    # ----------------------------------------------------------------------
+    def __init__(self, *args, **kwargs):
+        super(SimulatedWorker, self).__init__(*args, **kwargs)
+        self._idle = Event()
+        self._resume = Event()
+        self.messages = []
+
+    # ----------------------------------------------------------------------
+    def step(self, timeout=10.0):
+        """Let the worker process the queued events and run its due tasks until it would
+        wait for new events.
+        """
+        self._idle.clear()
+        self._resume.set()
+        self.wait_idle(timeout)
+
+    # ----------------------------------------------------------------------
+    def wait_idle(self, timeout=10.0):
+        deadline = monotonic() + timeout
+        while not self._idle.wait(0.1):
+            if not self.is_alive():
+                raise RuntimeError(u'The worker thread stopped')
+            if monotonic() >= deadline:
+                raise RuntimeError(u'The worker did not finish the step within {} seconds'.format(
+                    timeout))
+
+    # ----------------------------------------------------------------------
+    def shutdown(self):
+        super(SimulatedWorker, self).shutdown()
+        self._resume.set()
+
+    # ----------------------------------------------------------------------
+    def _delay_processing(self):
+        if self._pipeline is not None and self._pipeline.in_flight:
+            # let the batches in flight complete within the current step
+            self._pipeline.wait(constants.QUEUE_CHECK_INTERVAL)
+            return
+        self._idle.set()
+        self._resume.wait()
+        self._resume.clear()
+
+    # ----------------------------------------------------------------------
+    def _safe_log_impl(self, log_level, message, *args, **kwargs):
+        self.messages.append((log_level, message % args if args else message))
+
+
+class SoakResult(object):
+    """Outcome of a SoakTest.
+
+    `samples` is a list of dicts with the simulated `time`, the number of `enqueued` events,
+    the `backlog` (events neither sent nor expired), the number of events `received` by the
+    server (including duplicates) and `unique` events received.
+    """
+
+    # ----------------------------------------------------------------------
+    def __init__(self, samples, enqueued, received, unique):
+        self.samples = samples
+        self.enqueued = enqueued
+        self.received = received
+        self.unique = unique
+        self.duplicated = received - unique
+        self.lost = enqueued - unique
+
+    # ----------------------------------------------------------------------
+    @property
+    def max_backlog(self):
+        return max(sample['backlog'] for sample in self.samples) if self.samples else 0
+
+    # ----------------------------------------------------------------------
+    @property
+    def peak_drain_rate(self):
+        """Highest decrease of the backlog between two samples, in events per second"""
+        rates = [0.0]
+        for previous, sample in zip(self.samples, self.samples[1:]):
+            elapsed = sample['time'] - previous['time']
+            if elapsed > 0:
+                rates.append((previous['backlog'] - sample['backlog']) / elapsed)
+        return max(rates)
+
+
+class SoakTest(object):
+    """Run a worker for a long span of simulated time against a server failing on a schedule.
+
+    Events are enqueued at a constant `rate` of simulated time. Each step enqueues the events
+    of `step` seconds, advances the clock and lets the worker process, so hours of simulated
+    time take seconds::
+
+        soak = SoakTest(schedule=[(3600, 5400, Refused())], rate=5, step=5)
+        result = soak.run(4 * 3600)
+        assert result.lost == 0
+
+    The worker uses the configured `constants`, e.g. the flush interval and the circuit
+    breaker settings. Expiry with `event_ttl` follows the simulated time only for caches
+    using the clock, like the default MemoryCache.
+
+    :param schedule: Faults of the server, see FaultInjectingTransport
+    :param rate: Events per simulated second
+    :param step: Simulated seconds per step of the worker
+    :param sample_interval: Simulated seconds between samples
+    :param buffer: Cache for the worker, a MemoryCache using the virtual clock by default
+    :param clock: VirtualClock, a new one by default
+    """
+
+    # ----------------------------------------------------------------------
+    def __init__(self, schedule=(), rate=10.0, step=1.0, sample_interval=60.0, buffer=None,
+                 clock=None):
+        self.clock = clock if clock is not None else VirtualClock()
+        self.server = RecordingTransport()
+        self.transport = FaultInjectingTransport(
+            self.server, schedule, clock=self.clock, sleep=self.clock.sleep)
+        self.buffer = buffer if buffer is not None else MemoryCache({}, clock=self.clock.time)
+        self.worker = SimulatedWorker(
+            host='localhost', port=0, transport=self.transport, ssl_enable=False,
+            ssl_verify=False, keyfile=None, certfile=None, ca_certs=None, buffer=self.buffer,
+            clock=self.clock, wall_clock=self.clock.time)
+        self._rate = rate
+        self._step = step
+        self._sample_interval = sample_interval
+        self._origin = self.clock()
+        self._enqueued = 0
+
+    # ----------------------------------------------------------------------
+    def run(self, duration, shutdown=True):
+        """
+        :param duration: Simulated seconds to run
+        :param shutdown: Shut the worker down at the end, which makes a last attempt to send
+        :return: SoakResult
+        """
+        if not self.worker.is_alive():
+            self.worker.start()
+            self.worker.wait_idle()
+
+        samples = []
+        start = self.clock()
+        next_sample = start
+        while True:
+            now = self.clock()
+            if now >= next_sample:
+                samples.append(self._sample())
+                next_sample += self._sample_interval
+            if now - start >= duration:
+                break
+            self._enqueue_until(now + self._step)
+            self.clock.advance(self._step)
+            self.worker.step()
+
+        if shutdown:
+            self.worker.shutdown()
+            self.worker.join()
+            samples.append(self._sample())
+        return SoakResult(samples, self._enqueued, len(self.server.events),
+                          len(self.server.counts))
+
+    # ----------------------------------------------------------------------
+    def _enqueue_until(self, end):
+        created = self.clock.time()
+        while self._enqueued < int((end - self._origin) * self._rate):
+            self.worker.enqueue_event(u'soak-{}'.format(self._enqueued), created=created)
+            self._enqueued += 1
+
+    # ----------------------------------------------------------------------
+    def _sample(self):
+        return dict(
+            time=self.clock(),
+            enqueued=self._enqueued,
+            backlog=self._enqueued - self.worker._delivered_sequence,
+            received=len(self.server.events),
+            unique=len(self.server.counts))
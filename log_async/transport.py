@@ -3,12 +3,48 @@
 # This software may be modified and distributed under the terms
 # of the MIT license.  See the LICENSE file for details.
 
+import errno
 import socket
 import ssl
 import sys
 
+import six
+
 from log_async.constants import constants
-from log_async.stats import Counter, StatsCollector
+from log_async.framing import LengthPrefixFraming
+from log_async.hooks import hooks
+from log_async.stats import BYTES_BUCKETS, COUNT_BUCKETS, Counter, Histogram, StatsCollector
+from log_async.utils import monotonic
+
+
+class PartialSendError(Exception):
+    """Raised by transports if sending a batch failed after some of its events were sent.
+
+    :param error: The original exception
+    :param sent: Number of events at the start of the batch which were written
+                 completely before the error occurred
+    """
+
+    # ----------------------------------------------------------------------
+    def __init__(self, error, sent):
+        super(PartialSendError, self).__init__(error, sent)
+        self.error = error
+        self.sent = sent
+
+    # ----------------------------------------------------------------------
+    def __str__(self):
+        return u'{} (after {} events were sent)'.format(self.error, self.sent)
+
+
+class RejectedEventError(PartialSendError):
+    """Raised by transports if an event can never be sent, e.g. a datagram exceeding the
+    maximum message size. The event is the one following the `sent` events; the events
+    after it were not sent and can be retried.
+    """
+
+    # ----------------------------------------------------------------------
+    def __str__(self):
+        return u'Event rejected: {} (after {} events were sent)'.format(self.error, self.sent)
 
 
 class TransportStats(StatsCollector):
@@ -17,13 +53,30 @@ class TransportStats(StatsCollector):
         self._bytes_sent = Counter(prefix + "sent_bytes", "bytes transmitted")
         self._events_sent = Counter(prefix + "sent_msgs", "events transmitted")
         self._errors = Counter(prefix + "errors_total", "socket disconnects")
-        self._all.extend([self._bytes_sent, self._events_sent, self._errors])
+        self._batch_seconds = Histogram(prefix + "batch_send_seconds", "time to send a batch")
+        self._batch_events = Histogram(
+            prefix + "batch_size_events", "events per sent batch", COUNT_BUCKETS)
+        self._batch_bytes = Histogram(
+            prefix + "batch_size_bytes", "bytes per sent batch", BYTES_BUCKETS)
+        self._all.extend([self._bytes_sent, self._events_sent, self._errors,
+                          self._batch_seconds, self._batch_events, self._batch_bytes])
+        # bytes of the batch currently being sent
+        self._pending_bytes = 0
 
     def socket_error(self):
         self._errors.inc(1)
 
     def bytes_sent(self, n):
         self._bytes_sent.inc(n)
+        self._pending_bytes += n
+
+    def begin_batch(self):
+        self._pending_bytes = 0
+
+    def batch_sent(self, events, duration):
+        self._batch_seconds.observe(duration)
+        self._batch_events.observe(events)
+        self._batch_bytes.observe(self._pending_bytes)
 
     def events_sent(self, n):
         self._events_sent.inc(n)
@@ -42,13 +95,36 @@ class UdpTransport(object):
 
     # ----------------------------------------------------------------------
     def send(self, events):
+        start = monotonic()
+        hook = hooks.on_send_start
+        if hook is not None:
+            hook(events)
+        error = None
+        try:
+            self._send_batch(events, start)
+        except Exception as e:
+            error = e
+            raise
+        finally:
+            hook = hooks.on_send_end
+            if hook is not None:
+                hook(events, monotonic() - start, error)
+
+    # ----------------------------------------------------------------------
+    def _send_batch(self, events, start):
         # Ideally we would keep the socket open but this is risky because we might not notice
         # a broken TCP connection and send events into the dark.
         # On UDP we push into the dark by design :)
+        self._stats.begin_batch()
         self._create_socket()
         try:
             self._send(events)
             self._stats.events_sent(len(events))
+            self._stats.batch_sent(len(events), monotonic() - start)
+        except PartialSendError as e:
+            self._stats.events_sent(e.sent)
+            self._stats.socket_error()
+            raise
         except Exception:
             self._stats.socket_error()
             raise
@@ -66,8 +142,18 @@ class UdpTransport(object):
 
     # ----------------------------------------------------------------------
     def _send(self, events):
+        sent = 0
         for event in events:
-            self._send_via_socket(event)
+            try:
+                self._send_via_socket(event)
+            except Exception as e:
+                if getattr(e, 'errno', None) == errno.EMSGSIZE:
+                    six.reraise(
+                        RejectedEventError, RejectedEventError(e, sent), sys.exc_info()[2])
+                if not sent:
+                    raise
+                six.reraise(PartialSendError, PartialSendError(e, sent), sys.exc_info()[2])
+            sent += 1
 
     # ----------------------------------------------------------------------
     def _send_via_socket(self, data):
@@ -96,6 +182,16 @@ class UdpTransport(object):
     def close(self):
         self._close(force=True)
 
+    # ----------------------------------------------------------------------
+    def reset_after_fork(self):
+        """Drop the socket inherited from the parent process (in a forked child)"""
+        sock, self._sock = self._sock, None
+        if sock is not None:
+            try:
+                sock.close()
+            except Exception:
+                pass
+
     # ----------------------------------------------------------------------
     def get_stats(self):
         return self._stats.get_stats()
@@ -144,3 +240,49 @@ class TcpTransport(UdpTransport):
         data_to_send = self._convert_data_to_send(data)
         self._sock.sendall(data_to_send)
         self._stats.bytes_sent(len(data_to_send))
+
+
+class UnixSocketTransport(UdpTransport):
+    """Send events length prefixed over a Unix domain stream socket to a local process,
+    e.g. to a `log_async.forwarder.LocalForwarder` which ships the events of several
+    processes over a single connection.
+
+    :param path: Path of the Unix domain socket
+    """
+
+    _keep_connection = True
+
+    # ----------------------------------------------------------------------
+    def __init__(self, path, **kwargs):
+        super(UnixSocketTransport, self).__init__(host=path, port=None)
+        self._path = path
+        self._framing = LengthPrefixFraming()
+
+    # ----------------------------------------------------------------------
+    def send(self, events):
+        try:
+            super(UnixSocketTransport, self).send(events)
+        except Exception:
+            # the receiver may have been restarted, reconnect on the next attempt
+            self._close(force=True)
+            raise
+
+    # ----------------------------------------------------------------------
+    def _create_socket(self, timeout=constants.SOCKET_TIMEOUT):
+        if self._sock is not None:
+            return
+
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(timeout)
+        try:
+            sock.connect(self._path)
+        except Exception:
+            sock.close()
+            raise
+        self._sock = sock
+
+    # ----------------------------------------------------------------------
+    def _send_via_socket(self, data):
+        data_to_send = self._framing.frame(self._convert_data_to_send(data))
+        self._sock.sendall(data_to_send)
+        self._stats.bytes_sent(len(data_to_send))
@@ -8,12 +8,18 @@ from __future__ import print_function
 from datetime import datetime
 from importlib import import_module
 from itertools import chain, islice
+import inspect
 import sys
+import time
 import traceback
 
 import six
 
 
+# clock for measuring durations, time.monotonic is not available on Python 2
+monotonic = getattr(time, 'monotonic', time.time)
+
+
 # ----------------------------------------------------------------------
 def ichunked(seq, chunksize):
     """Yields items from an iterator in iterable chunks.
@@ -63,3 +69,34 @@ def import_string(dotted_path):
     except AttributeError:
         msg = 'Module "{}" does not define a "{}" attribute/class'.format(module_path, class_name)
         six.reraise(ImportError, ImportError(msg), sys.exc_info()[2])
+
+
+# ----------------------------------------------------------------------
+def accepts_argument(function, name):
+    """Check whether `function` can be called with the keyword argument `name`, e.g. for
+    caches implemented before an argument was added to the methods of log_async.Cache"""
+    if six.PY2:
+        try:
+            spec = inspect.getargspec(function)
+        except TypeError:
+            return False
+        return name in spec.args or spec.keywords is not None
+    try:
+        parameters = inspect.signature(function).parameters
+    except (TypeError, ValueError):
+        return False
+    parameter = parameters.get(name)
+    if parameter is not None:
+        return parameter.kind in (parameter.POSITIONAL_OR_KEYWORD, parameter.KEYWORD_ONLY)
+    return any(parameter.kind == parameter.VAR_KEYWORD for parameter in parameters.values())
+
+
+# ----------------------------------------------------------------------
+def overrides_method(instance, name, cls):
+    """Check whether `instance` implements the method `name` rather than inheriting the
+    default of `cls`, e.g. for the optional methods of log_async.Cache"""
+    method = getattr(type(instance), name, None)
+    if method is None:
+        return False
+    default = getattr(cls, name)
+    return getattr(method, '__func__', method) is not getattr(default, '__func__', default)
@@ -3,9 +3,11 @@
 # This software may be modified and distributed under the terms
 # of the MIT license.  See the LICENSE file for details.
 
-from datetime import datetime
+from collections import deque
 from logging import getLogger as get_logger
-from threading import Event, Thread
+from logging import LogRecord
+from threading import Condition, Event, Lock, Thread
+import time
 
 from limits import parse as parse_rate_limit
 from limits.storage import MemoryStorage
@@ -13,10 +15,19 @@ from limits.strategies import FixedWindowRateLimiter
 from six import integer_types
 from six.moves.queue import Empty, Queue
 
+from .breaker import CircuitBreaker, STATE_VALUES
+from .cache import Cache
 from .constants import constants
 from .database import DatabaseLockedError
-from .stats import Gauge, LogStats
-from .utils import safe_log_via_print
+from .flush_controller import AdaptiveFlushController
+from .framing import DelimiterFraming
+from .hooks import hooks
+from .ingress import DequeIngressQueue
+from .scheduler import MaintenanceScheduler
+from .spool import REASON_REJECTED
+from .stats import AGE_BUCKETS, Counter, Gauge, Histogram, LogStats
+from .transport import PartialSendError, RejectedEventError
+from .utils import accepts_argument, monotonic, overrides_method, safe_log_via_print
 
 
 class WorkerStats(LogStats):
@@ -24,16 +35,143 @@ class WorkerStats(LogStats):
     def __init__(self, prefix):
         super(WorkerStats, self).__init__(prefix)
         self._queue = Gauge(prefix + "queue_size", "events in queue to process")
-        self._all.extend([self._queue, ])
+        self._in_flight = Gauge(prefix + "batches_in_flight", "batches being sent")
+        self._breaker_state = Gauge(
+            prefix + "breaker_state", "circuit breaker state (0 closed, 1 open, 2 half-open)")
+        self._breaker_trips = Counter(prefix + "breaker_trips_total", "circuit breaker openings")
+        self._flush_interval = Gauge(prefix + "flush_interval_seconds", "current flush interval")
+        self._flush_count = Gauge(prefix + "flush_count", "current flush count (batch size)")
+        self._queue_wait = Histogram(
+            prefix + "queue_wait_seconds", "time events spent in the queue to process")
+        self._cache_insert = Histogram(
+            prefix + "cache_insert_seconds", "time to add an event to the cache")
+        self._cache_claim = Histogram(
+            prefix + "cache_claim_seconds", "time to claim a batch of events from the cache")
+        self._event_age = Histogram(
+            prefix + "event_age_seconds", "time from creating the log record until it was sent",
+            AGE_BUCKETS)
+        self._all.extend([self._queue, self._in_flight, self._breaker_state, self._breaker_trips,
+                          self._flush_interval, self._flush_count, self._queue_wait,
+                          self._cache_insert, self._cache_claim, self._event_age])
 
     def set_queue_size(self, val):
         self._queue.set(val)
 
+    def set_batches_in_flight(self, val):
+        self._in_flight.set(val)
+
+    def set_breaker_state(self, val):
+        self._breaker_state.set(val)
+
+    def breaker_trip(self, n=1):
+        self._breaker_trips.inc(n)
+
+    def set_flush_parameters(self, interval, count):
+        self._flush_interval.set(interval)
+        self._flush_count.set(count)
+
+    def queue_wait(self, duration):
+        self._queue_wait.observe(duration)
+
+    def cache_insert(self, duration):
+        self._cache_insert.observe(duration)
+
+    def cache_claim(self, duration):
+        self._cache_claim.observe(duration)
+
+    def event_age(self, age):
+        self._event_age.observe(age)
+
 
 class ProcessingError(Exception):
     """"""
 
 
+class SendPipeline(object):
+    """Send batches of cached events from a separate thread.
+
+    The worker thread claims batches from the cache and submits them, the sender thread
+    transmits them one after the other and reports each result back. Results are collected
+    and applied to the cache by the worker thread, so the cache is only ever accessed from
+    the worker thread.
+
+    :param send: Callable sending a list of events
+    :param depth: Maximum number of batches submitted and not yet collected
+    """
+
+    # ----------------------------------------------------------------------
+    def __init__(self, send, depth):
+        self._send = send
+        self._depth = depth
+        self._batches = Queue()
+        self._results = Queue()
+        self._result_event = Event()
+        self._in_flight = 0
+        self._thread = None
+
+    # ----------------------------------------------------------------------
+    @property
+    def in_flight(self):
+        return self._in_flight
+
+    # ----------------------------------------------------------------------
+    def start(self):
+        self._thread = Thread(target=self._run, name='LogProcessingSender')
+        self._thread.daemon = True
+        self._thread.start()
+
+    # ----------------------------------------------------------------------
+    def stop(self):
+        if self._thread is not None:
+            self._batches.put(None)
+            self._thread.join()
+            self._thread = None
+
+    # ----------------------------------------------------------------------
+    def can_submit(self):
+        return self._in_flight < self._depth
+
+    # ----------------------------------------------------------------------
+    def submit(self, batch):
+        self._in_flight += 1
+        self._batches.put(batch)
+
+    # ----------------------------------------------------------------------
+    def collect(self):
+        """Yield (batch, error) for each batch sent since the last call, without blocking"""
+        while True:
+            try:
+                result = self._results.get(block=False)
+            except Empty:
+                return
+            self._in_flight -= 1
+            yield result
+
+    # ----------------------------------------------------------------------
+    def wait(self, timeout):
+        """Wait until a batch was sent, the timeout elapsed or wake() was called"""
+        self._result_event.wait(timeout)
+        self._result_event.clear()
+
+    # ----------------------------------------------------------------------
+    def wake(self):
+        self._result_event.set()
+
+    # ----------------------------------------------------------------------
+    def _run(self):
+        while True:
+            batch = self._batches.get()
+            if batch is None:
+                return
+            error = None
+            try:
+                self._send([event['event_text'] for event in batch])
+            except Exception as e:
+                error = e
+            self._results.put((batch, error))
+            self._result_event.set()
+
+
 class LogProcessingWorker(Thread):
     """"""
 
@@ -48,6 +186,19 @@ class LogProcessingWorker(Thread):
         self._certfile = kwargs.pop('certfile')
         self._ca_certs = kwargs.pop('ca_certs')
         self._database = kwargs.pop('buffer')
+        # caches implemented before batches were limited return all pending events
+        self._cache_accepts_limit = accepts_argument(self._database.get_queued_events, 'limit')
+        # and do not keep the creation time of events
+        self._cache_accepts_created = accepts_argument(self._database.add_event, 'created')
+        # delete_queued_events() deletes the events claimed by all processes sharing a
+        # database, caches implementing delete_events() only delete the events sent
+        self._cache_deletes_events = overrides_method(self._database, 'delete_events', Cache)
+        self._clock = kwargs.pop('clock', monotonic)
+        self._wall_clock = kwargs.pop('wall_clock', time.time)
+        # with deferred formatting, log records are enqueued and formatted a batch at a time
+        self._formatter = kwargs.pop('formatter', None)
+        self._framing = kwargs.pop('framing', None) or DelimiterFraming()
+        ingress_queue = kwargs.pop('ingress_queue', None)
 
         super(LogProcessingWorker, self).__init__(*args, **kwargs)
         self.daemon = True
@@ -55,56 +206,220 @@ class LogProcessingWorker(Thread):
 
         self._shutdown_event = Event()
         self._flush_event = Event()
-        self._queue = Queue()
+        self._wakeup_event = Event()
+        self._queue = ingress_queue if ingress_queue is not None else DequeIngressQueue()
+        # events taken from the ingress queue but not yet written to the cache
+        self._batch = deque()
+        # sequence numbers: events taken from the ingress queue and events done (sent or expired)
+        self._dequeued_sequence = 0
+        # held while events are taken from the ingress queue and counted, so that `sequence`
+        # counts every event exactly once (producers do not take it)
+        self._sequence_lock = Lock()
+        self._delivery_condition = Condition()
+        self._delivered_sequence = 0
+        self._stopped = False
 
         self._event = None
-        self._last_event_flush_date = None
         self._non_flushed_event_count = None
         self._logger = None
         self._rate_limit_storage = None
         self._rate_limit_strategy = None
         self._rate_limit_item = None
+        self._pipeline = None
+        self._undeleted_events = []
+        self._profiler = None
+        self._profiler_lock = Lock()
+        self._profiler_request = None
+        self._circuit_breaker = CircuitBreaker(
+            failure_threshold=constants.CIRCUIT_BREAKER_FAILURE_THRESHOLD,
+            backoff_initial=constants.CIRCUIT_BREAKER_BACKOFF_INITIAL,
+            backoff_max=constants.CIRCUIT_BREAKER_BACKOFF_MAX,
+            clock=self._clock)
+        self._flush_controller = None
+        if constants.ADAPTIVE_FLUSH:
+            self._flush_controller = AdaptiveFlushController(
+                min_interval=constants.ADAPTIVE_FLUSH_MIN_INTERVAL,
+                max_latency=constants.ADAPTIVE_FLUSH_MAX_LATENCY,
+                min_count=constants.ADAPTIVE_FLUSH_MIN_COUNT,
+                max_count=constants.ADAPTIVE_FLUSH_MAX_COUNT,
+                clock=self._clock)
+        self._scheduler = self._create_scheduler()
 
         self._stats = WorkerStats(constants.WORKER_STATS_PREFIX)
 
     # ----------------------------------------------------------------------
-    def enqueue_event(self, event):
-        # called from other threads
-        self._stats.event()
-        self._queue.put(event)
+    @property
+    def transport(self):
+        return self._transport
+
+    # ----------------------------------------------------------------------
+    @property
+    def sequence(self):
+        """Sequence number of the last enqueued event, to be passed to wait_for_delivery()"""
+        with self._sequence_lock:
+            return self._dequeued_sequence + self._queue.qsize()
+
+    # ----------------------------------------------------------------------
+    @property
+    def pending(self):
+        """Number of enqueued events which were neither sent nor expired yet"""
+        return max(0, self.sequence - self._delivered_sequence)
+
+    # ----------------------------------------------------------------------
+    def enqueue_event(self, event, created=None):
+        """
+        :param event: Formatted event
+        :param created: Creation time of the log record (time.time()), if known
+        """
+        # called from other threads, events are counted once the worker takes them
+        self._queue.put((event, created, self._clock()))
 
     # ----------------------------------------------------------------------
     def shutdown(self):
         # called from other threads
         self._shutdown_event.set()
+        self._wakeup()
+
+    # ----------------------------------------------------------------------
+    def wait_for_delivery(self, sequence, timeout=None):
+        """Block until the events up to `sequence` are done, i.e. sent or expired,
+        the worker stopped or the timeout elapsed.
+
+        Events are counted, not tracked individually: if a batch fails while later
+        batches are sent (with QUEUED_EVENTS_PIPELINE_DEPTH > 1), the later events
+        may be counted in place of the failed ones.
+
+        :param sequence: Sequence number as returned by the `sequence` property
+        :param timeout: Maximum time to wait in seconds, None to wait without limit
+        :return: Number of events up to `sequence` which are still pending
+        """
+        deadline = None if timeout is None else monotonic() + timeout
+        with self._delivery_condition:
+            while self._delivered_sequence < sequence and not self._stopped:
+                if deadline is None:
+                    self._delivery_condition.wait()
+                else:
+                    remaining = deadline - monotonic()
+                    if remaining <= 0:
+                        break
+                    self._delivery_condition.wait(remaining)
+            return max(0, sequence - self._delivered_sequence)
+
+    # ----------------------------------------------------------------------
+    def set_profiler(self, profiler, timeout=None):
+        """Start profiling the worker thread, or stop the current profiler.
+
+        The profiler is started resp. stopped by the worker thread once its queue is empty.
+
+        :param profiler: log_async.profiling.WorkerProfiler, None to stop profiling
+        :param timeout: Maximum time to wait for the worker thread in seconds,
+                        None to wait without limit
+        :return: True if the change was applied
+        """
+        applied = Event()
+        with self._profiler_lock:
+            self._profiler_request = (profiler, applied)
+        self._wakeup()
+        deadline = None if timeout is None else monotonic() + timeout
+        while True:
+            wait = constants.QUEUE_CHECK_INTERVAL
+            if deadline is not None:
+                wait = max(0, min(wait, deadline - monotonic()))
+            if applied.wait(wait):
+                return True
+            if not self.is_alive() or (deadline is not None and monotonic() >= deadline):
+                with self._profiler_lock:
+                    # withdraw the request unless the worker took it meanwhile
+                    if self._profiler_request is not None and \
+                            self._profiler_request[1] is applied:
+                        self._profiler_request = None
+                return applied.is_set()
+
+    # ----------------------------------------------------------------------
+    def _apply_profiler_request(self, stop=False):
+        with self._profiler_lock:
+            request, self._profiler_request = self._profiler_request, None
+        if request is None and not stop:
+            return
+        profiler, applied = request if request is not None else (None, None)
+        if self._profiler is not None:
+            self._profiler.stop()
+        self._profiler = None if stop else profiler
+        if self._profiler is not None:
+            self._profiler.start()
+        if applied is not None:
+            applied.set()
+
+    # ----------------------------------------------------------------------
+    def _mark_delivered(self, count):
+        if not count:
+            return
+        with self._delivery_condition:
+            self._delivered_sequence += count
+            self._delivery_condition.notify_all()
+
+    # ----------------------------------------------------------------------
+    def _mark_stopped(self):
+        with self._delivery_condition:
+            self._stopped = True
+            self._delivery_condition.notify_all()
+
+    # ----------------------------------------------------------------------
+    def _wakeup(self):
+        self._wakeup_event.set()
+        pipeline = self._pipeline
+        if pipeline is not None:
+            pipeline.wake()
 
     # ----------------------------------------------------------------------
     def run(self):
         self._reset_flush_counters()
         self._setup_logger()
+        self._setup_pipeline()
         try:
             self._fetch_events()
         except Exception as e:
             # we really should not get anything here, and if, the worker thread is dying
             # too early resulting in undefined application behaviour
             self._log_general_error(e)
+        finally:
+            self._stop_pipeline()
+            self._flush_spool()
+            self._apply_profiler_request(stop=True)
+            self._mark_stopped()
         # check for empty queue and report if not
         self._warn_about_non_empty_queue_on_shutdown()
 
     # ----------------------------------------------------------------------
     def get_stats(self):
-        self._stats.set_queue_size(self._queue.qsize())
+        self._stats.set_queue_size(self._queue_size())
+        pipeline = self._pipeline
+        self._stats.set_batches_in_flight(pipeline.in_flight if pipeline is not None else 0)
+        self._stats.set_breaker_state(STATE_VALUES[self._circuit_breaker.state])
+        self._stats.set_flush_parameters(self._flush_interval(), self._flush_count())
         return self._stats.get_stats()
 
     # ----------------------------------------------------------------------
     def force_flush_queued_events(self):
         self._flush_event.set()
+        self._wakeup()
 
     # ----------------------------------------------------------------------
     def _reset_flush_counters(self):
-        self._last_event_flush_date = datetime.now()
+        self._scheduler.reset('flush')
         self._non_flushed_event_count = 0
 
+    # ----------------------------------------------------------------------
+    def _create_scheduler(self):
+        # tasks in order of priority, the flush interval may be changed at runtime
+        scheduler = MaintenanceScheduler(clock=self._clock)
+        scheduler.add('flush', self._flush_interval, self._flush_queued_events_on_interval, 0)
+        scheduler.add('expire', constants.MAINTENANCE_EXPIRE_INTERVAL, self._expire_events, 1)
+        scheduler.add('stats', constants.MAINTENANCE_STATS_INTERVAL, self._refresh_stats, 2)
+        scheduler.add('vacuum', constants.MAINTENANCE_VACUUM_INTERVAL, self._vacuum, 3)
+        scheduler.add('spool', constants.SPOOL_FLUSH_INTERVAL, self._flush_spool, 4)
+        return scheduler
+
     # ----------------------------------------------------------------------
     def _clear_flush_event(self):
         self._flush_event.clear()
@@ -119,6 +434,23 @@ class LogProcessingWorker(Thread):
             self._rate_limit_strategy = FixedWindowRateLimiter(self._rate_limit_storage)
             self._rate_limit_item = parse_rate_limit(rate_limit_setting)
 
+    # ----------------------------------------------------------------------
+    def _setup_pipeline(self):
+        if constants.QUEUED_EVENTS_PIPELINE_DEPTH > 0:
+            if not self._cache_deletes_events:
+                # deleting all claimed events would delete the batches still in flight
+                self._safe_log(
+                    u'warning',
+                    u'The buffer does not implement delete_events(), sending without pipeline')
+                return
+            self._pipeline = SendPipeline(self._send_events, constants.QUEUED_EVENTS_PIPELINE_DEPTH)
+            self._pipeline.start()
+
+    # ----------------------------------------------------------------------
+    def _stop_pipeline(self):
+        if self._pipeline is not None:
+            self._pipeline.stop()
+
     # ----------------------------------------------------------------------
     def _fetch_events(self):
         while True:
@@ -134,8 +466,10 @@ class LogProcessingWorker(Thread):
 
                 force_flush = self._flush_requested()
                 self._flush_queued_events(force=force_flush)
+                self._scheduler.run_due(budget=constants.MAINTENANCE_TIME_BUDGET)
+                if self._profiler_request is not None:
+                    self._apply_profiler_request()
                 self._delay_processing()
-                self._expire_events()
             except (DatabaseLockedError, ProcessingError):
                 if self._shutdown_requested():
                     return
@@ -145,7 +479,56 @@ class LogProcessingWorker(Thread):
 
     # ----------------------------------------------------------------------
     def _fetch_event(self):
-        self._event = self._queue.get(block=False)
+        if not self._batch:
+            with self._sequence_lock:
+                events = self._queue.get_batch()
+                self._dequeued_sequence += len(events)
+            if not events:
+                raise Empty()
+            self._stats.event(len(events))
+            now = self._clock()
+            for _, _, enqueued in events:
+                self._stats.queue_wait(now - enqueued)
+            if self._formatter is not None:
+                events = self._format_records(events)
+                if not events:
+                    raise Empty()
+            self._batch.extend(events)
+        self._event = self._batch.popleft()
+
+    # ----------------------------------------------------------------------
+    def _format_records(self, events):
+        """Format the enqueued log records (events forwarded by child processes are already
+        formatted) with a single format_batch_events() call"""
+        indexes = [i for i, event in enumerate(events) if isinstance(event[0], LogRecord)]
+        if not indexes:
+            return events
+        records = [events[i][0] for i in indexes]
+        try:
+            formatted = self._formatter.format_batch_events(records, self._framing)
+        except Exception:
+            # find the record which cannot be formatted
+            formatted = [self._format_record(record) for record in records]
+        events = list(events)
+        for i, data in zip(indexes, formatted):
+            events[i] = (data,) + tuple(events[i][1:])
+        dropped = sum(1 for event in events if event[0] is None)
+        if dropped:
+            self._mark_delivered(dropped)
+            events = [event for event in events if event[0] is not None]
+        return events
+
+    # ----------------------------------------------------------------------
+    def _format_record(self, record):
+        try:
+            return self._framing.frame(self._formatter.format(record))
+        except Exception as e:
+            self._safe_log(u'exception', u'Error formatting log record: %s', e, exc=e)
+            return None
+
+    # ----------------------------------------------------------------------
+    def _queue_size(self):
+        return self._queue.qsize() + len(self._batch)
 
     # ----------------------------------------------------------------------
     def _process_event(self):
@@ -155,7 +538,7 @@ class LogProcessingWorker(Thread):
             self._safe_log(
                 u'debug',
                 u'Database is locked, will try again later (queue length %d)',
-                self._queue.qsize(),
+                self._queue_size(),
                 exc=e)
             raise
         except Exception as e:
@@ -167,24 +550,54 @@ class LogProcessingWorker(Thread):
     # ----------------------------------------------------------------------
     def _expire_events(self):
         try:
-            self._database.expire_events()
+            count = self._database.expire_events() or 0
         except DatabaseLockedError:
             # Nothing to handle, if it fails, we will either successfully publish
             # these messages next time or we will delete them on the next pass.
-            pass
+            return
+        self._mark_delivered(count)
+        hook = hooks.on_drop
+        if hook is not None and count:
+            hook(count, 'expired')
+
+    # ----------------------------------------------------------------------
+    def _refresh_stats(self):
+        try:
+            self._database.refresh_stats()
+        except DatabaseLockedError:
+            pass  # keep the previous values
+
+    # ----------------------------------------------------------------------
+    def _vacuum(self):
+        try:
+            self._database.vacuum()
+        except DatabaseLockedError:
+            pass  # try again with the next interval
+        except Exception as e:
+            self._safe_log(u'exception', u'Error compacting the buffer: %s', e, exc=e)
 
     # ----------------------------------------------------------------------
     def _log_processing_error(self, exception):
         self._safe_log(
             u'exception',
             u'Log processing error (queue size: %3s): %s',
-            self._queue.qsize(),
+            self._queue_size(),
             exception,
             exc=exception)
 
     # ----------------------------------------------------------------------
     def _delay_processing(self):
-        self._shutdown_event.wait(constants.QUEUE_CHECK_INTERVAL)
+        if self._pipeline is not None and self._pipeline.in_flight:
+            # wake up as soon as a batch was sent to claim the next one
+            self._pipeline.wait(self._queue_check_interval())
+        else:
+            self._wakeup_event.wait(self._queue_check_interval())
+            self._wakeup_event.clear()
+
+    # ----------------------------------------------------------------------
+    def _queue_check_interval(self):
+        # do not oversleep scheduled tasks, e.g. short flush intervals
+        return min(constants.QUEUE_CHECK_INTERVAL, self._scheduler.time_until_next())
 
     # ----------------------------------------------------------------------
     def _shutdown_requested(self):
@@ -196,29 +609,60 @@ class LogProcessingWorker(Thread):
 
     # ----------------------------------------------------------------------
     def _requeue_event(self):
-        self._queue.put(self._event)
+        # retry before the following events to keep the order
+        self._batch.appendleft(self._event)
 
     # ----------------------------------------------------------------------
     def _write_event_to_database(self):
-        self._database.add_event(self._event)
+        event, created, _ = self._event
+        start = self._clock()
+        if self._cache_accepts_created:
+            self._database.add_event(event, created=created)
+        else:
+            self._database.add_event(event)
+        duration = self._clock() - start
+        self._stats.cache_insert(duration)
+        hook = hooks.on_cache_write
+        if hook is not None:
+            hook(event, duration)
         self._non_flushed_event_count += 1
+        if self._flush_controller is not None:
+            self._flush_controller.record_arrival()
 
     # ----------------------------------------------------------------------
     def _flush_queued_events(self, force=False):
-        # check if necessary and abort if not
-        if not force and not self._queued_event_interval_reached() and \
-                not self._queued_event_count_reached():
+        if self._flush_controller is not None:
+            self._flush_controller.update(
+                backlog=self._non_flushed_event_count + self._queue_size())
+
+        if self._pipeline is not None:
+            if self._shutdown_requested():
+                self._drain_pipeline()
+            else:
+                self._flush_queued_events_pipelined(force)
+            return
+
+        # check if necessary and abort if not, the flush interval is handled by the scheduler
+        if not force and not self._queued_event_count_reached():
             return
 
         self._clear_flush_event()
+        self._scheduler.reset('flush')
+        if not self._send_allowed():
+            return  # the circuit breaker is open, try again later
 
+        start = self._clock()
+        probing = self._probing()
         try:
-            queued_events = self._database.get_queued_events()
+            if probing:
+                queued_events = self._get_queued_events(limit=constants.CIRCUIT_BREAKER_PROBE_SIZE)
+            else:
+                queued_events = self._get_queued_events()
         except DatabaseLockedError as e:
             self._safe_log(
                 u'debug',
                 u'Database is locked, will try again later (queue length %d)',
-                self._queue.qsize(),
+                self._queue_size(),
                 exc=e)
             return  # try again later
         except Exception as e:
@@ -236,10 +680,219 @@ class LogProcessingWorker(Thread):
                     u'An error occurred while sending events: %s',
                     e,
                     exc=e)
-                self._database.requeue_queued_events(queued_events)
+                self._handle_failed_batch(queued_events, e)
+                self._record_send_error(e, probing)
             else:
-                self._delete_queued_events_from_database()
+                if self._cache_deletes_events:
+                    self._delete_events_from_database(queued_events)
+                else:
+                    self._delete_queued_events_from_database()
                 self._reset_flush_counters()
+                self._mark_delivered(len(queued_events))
+                self._record_event_age(queued_events)
+                self._record_send_success(probing)
+            self._flush_cycle_done(len(queued_events), start)
+
+    # ----------------------------------------------------------------------
+    def _flush_queued_events_pipelined(self, force=False):
+        """Apply the results of sent batches and submit further batches until the
+        pipeline is full.
+
+        :return: False if no further batches can currently be sent (nothing left,
+                 a send failed or the cache is locked)
+        """
+        send_failed = self._collect_sent_batches()
+        # once started, keep the pipeline busy until the cache is drained
+        if not force and not self._pipeline.in_flight and \
+                not self._queued_event_count_reached():
+            return False
+
+        self._clear_flush_event()
+        self._scheduler.reset('flush')
+        if send_failed or not self._send_allowed():
+            return False  # retry with the next flush
+
+        probing = self._probing()
+        if probing and self._pipeline.in_flight:
+            return False  # wait for the outcome of the probe
+
+        start = self._clock()
+        submitted = 0
+        more = True
+        while self._pipeline.can_submit():
+            limit = constants.CIRCUIT_BREAKER_PROBE_SIZE if probing \
+                else self._batch_size()
+            try:
+                batch = self._get_queued_events(limit=limit)
+            except DatabaseLockedError as e:
+                self._safe_log(
+                    u'debug',
+                    u'Database is locked, will try again later (queue length %d)',
+                    self._queue_size(),
+                    exc=e)
+                more = False  # try again later
+                break
+            except Exception as e:
+                self._safe_log(u'exception', u'Error retrieving queued events: %s', e, exc=e)
+                more = False
+                break
+            if not batch:
+                more = False
+                break
+            self._pipeline.submit(batch)
+            submitted += len(batch)
+            if probing:
+                break
+        self._flush_cycle_done(submitted, start)
+        return more
+
+    # ----------------------------------------------------------------------
+    def _collect_sent_batches(self):
+        send_failed = False
+        for batch, error in self._pipeline.collect():
+            if error is None:
+                probing = self._circuit_breaker.probing
+                self._delete_events_from_database(batch)
+                self._reset_flush_counters()
+                self._mark_delivered(len(batch))
+                self._record_event_age(batch)
+                self._record_send_success(probing)
+            else:
+                probing = self._circuit_breaker.probing
+                send_failed = send_failed or not isinstance(error, RejectedEventError)
+                self._safe_log(
+                    u'exception',
+                    u'An error occurred while sending events: %s',
+                    error,
+                    exc=error)
+                self._handle_failed_batch(batch, error)
+                self._record_send_error(error, probing)
+        return send_failed
+
+    # ----------------------------------------------------------------------
+    def _flush_cycle_done(self, count, start):
+        hook = hooks.on_flush_cycle
+        if hook is not None and count:
+            hook(count, self._clock() - start)
+
+    # ----------------------------------------------------------------------
+    def _drain_pipeline(self):
+        # on shutdown, send all cached events and wait for the batches in flight
+        while self._flush_queued_events_pipelined(force=True) or self._pipeline.in_flight:
+            self._pipeline.wait(constants.QUEUE_CHECK_INTERVAL)
+        self._collect_sent_batches()
+
+    # ----------------------------------------------------------------------
+    def _handle_failed_batch(self, events, error):
+        if isinstance(error, PartialSendError):
+            # only requeue the events which were not sent to avoid duplicates downstream
+            done = error.sent
+            if isinstance(error, RejectedEventError):
+                # retrying the rejected event cannot succeed, remove it with the sent events
+                self._reject_event(events[done])
+                done += 1
+            self._database.complete_queued_events(events, done)
+            self._mark_delivered(done)
+            self._record_event_age(events[:error.sent])
+            events = events[done:]
+        else:
+            self._database.requeue_queued_events(events)
+        hook = hooks.on_requeue
+        if hook is not None:
+            hook(events, error)
+
+    # ----------------------------------------------------------------------
+    def _reject_event(self, event):
+        spool = getattr(self._database, 'spool', None)
+        if spool is not None:
+            spool.add(event['event_text'], REASON_REJECTED)
+        hook = hooks.on_drop
+        if hook is not None:
+            hook(1, 'rejected')
+
+    # ----------------------------------------------------------------------
+    def _flush_spool(self):
+        spool = getattr(self._database, 'spool', None)
+        if spool is not None:
+            spool.flush()
+
+    # ----------------------------------------------------------------------
+    def _get_queued_events(self, limit=None):
+        start = self._clock()
+        if limit is not None and self._cache_accepts_limit:
+            events = self._database.get_queued_events(limit=limit)
+        else:
+            events = self._database.get_queued_events()
+        duration = self._clock() - start
+        self._stats.cache_claim(duration)
+        hook = hooks.on_claim
+        if hook is not None:
+            hook(events, duration)
+        return events
+
+    # ----------------------------------------------------------------------
+    def _record_event_age(self, events):
+        # record.created is wall clock time
+        now = self._wall_clock()
+        try:
+            created = [event['created'] for event in events]
+        except (KeyError, IndexError):
+            return  # the cache does not keep the creation time
+        for value in created:
+            if value is not None:
+                self._stats.event_age(now - value)
+
+    # ----------------------------------------------------------------------
+    def _flush_queued_events_on_interval(self):
+        self._flush_queued_events(force=True)
+
+    # ----------------------------------------------------------------------
+    def _send_allowed(self):
+        # on shutdown, make a last attempt regardless of the circuit breaker
+        return self._shutdown_requested() or self._circuit_breaker.allow()
+
+    # ----------------------------------------------------------------------
+    def _probing(self):
+        return self._circuit_breaker.probing and not self._shutdown_requested()
+
+    # ----------------------------------------------------------------------
+    def _record_send_success(self, probing):
+        self._circuit_breaker.record_success()
+        if probing:
+            # the server is reachable again, send the backlog right away
+            self._safe_log(u'info', u'Sending events succeeded again, resuming')
+            self._flush_event.set()
+
+    # ----------------------------------------------------------------------
+    def _record_send_error(self, error, probing):
+        if isinstance(error, RejectedEventError):
+            # the server is reachable, only the rejected event cannot be sent
+            self._record_send_success(probing)
+        else:
+            self._record_send_failure()
+
+    # ----------------------------------------------------------------------
+    def _record_send_failure(self):
+        if self._circuit_breaker.record_failure():
+            self._stats.breaker_trip()
+            self._safe_log(
+                u'warning',
+                u'Sending events failed, pausing for %.1f seconds',
+                self._circuit_breaker.retry_in())
+
+    # ----------------------------------------------------------------------
+    def _delete_events_from_database(self, events):
+        events = self._undeleted_events + events
+        try:
+            self._database.delete_events(events)
+        except DatabaseLockedError:
+            self._undeleted_events = events  # try again with the next sent batch
+        except Exception as e:
+            # just log the exception and hope we can recover from the error
+            self._undeleted_events = events
+            self._safe_log(u'exception', u'Error deleting sent events: %s', e, exc=e)
+        else:
+            self._undeleted_events = []
 
     # ----------------------------------------------------------------------
     def _delete_queued_events_from_database(self):
@@ -249,17 +902,33 @@ class LogProcessingWorker(Thread):
             pass  # nothing to handle, if it fails, we delete those events in a later run
 
     # ----------------------------------------------------------------------
-    def _queued_event_interval_reached(self):
-        delta = datetime.now() - self._last_event_flush_date
-        return delta.total_seconds() > constants.QUEUED_EVENTS_FLUSH_INTERVAL
+    def _queued_event_count_reached(self):
+        return self._non_flushed_event_count > self._flush_count()
 
     # ----------------------------------------------------------------------
-    def _queued_event_count_reached(self):
-        return self._non_flushed_event_count > constants.QUEUED_EVENTS_FLUSH_COUNT
+    def _flush_interval(self):
+        if self._flush_controller is not None:
+            return self._flush_controller.interval
+        return constants.QUEUED_EVENTS_FLUSH_INTERVAL
+
+    # ----------------------------------------------------------------------
+    def _flush_count(self):
+        if self._flush_controller is not None:
+            return self._flush_controller.count
+        return constants.QUEUED_EVENTS_FLUSH_COUNT
+
+    # ----------------------------------------------------------------------
+    def _batch_size(self):
+        if self._flush_controller is not None:
+            return self._flush_controller.count
+        return constants.QUEUED_EVENTS_BATCH_SIZE
 
     # ----------------------------------------------------------------------
     def _send_events(self, events):
+        start = self._clock()
         self._transport.send(events)
+        if self._flush_controller is not None:
+            self._flush_controller.record_send(self._clock() - start)
 
     # ----------------------------------------------------------------------
     def _log_general_error(self, exc):
@@ -312,10 +981,73 @@ class LogProcessingWorker(Thread):
 
     # ----------------------------------------------------------------------
     def _warn_about_non_empty_queue_on_shutdown(self):
-        queue_size = self._queue.qsize()
+        queue_size = self._queue_size()
         if queue_size:
             self._safe_log(
                 'warn',
                 u'Non-empty queue while shutting down ({} events pending). '
                 u'This indicates a previous error.'.format(queue_size),
                 extra=dict(queue_size=queue_size))
+
+
+class WorkerPool(object):
+    """Share worker threads between log handlers.
+
+    Handlers passing the same pool and using the same key (the host and port of the log
+    forwarding server, the transport, SSL and buffer configuration of the handler) send their
+    events through a single LogProcessingWorker, using the transport and buffer of the handler
+    which started it. The worker is shut down once the
+    last handler using it is shut down. Handlers with different keys still get their own
+    workers and ship independently from each other.
+    """
+
+    # ----------------------------------------------------------------------
+    def __init__(self):
+        self._workers = {}
+        self._owners = {}
+        self._lock = Lock()
+
+    # ----------------------------------------------------------------------
+    def acquire(self, key, owner, factory):
+        """Get the running worker for `key` or create and start one using `factory`.
+
+        :param key: Hashable key identifying the destination
+        :param owner: Object using the worker (usually the handler)
+        :param factory: Callable returning a new, not yet started worker
+        :return: running worker
+        """
+        with self._lock:
+            worker = self._workers.get(key)
+            if worker is None or not worker.is_alive():
+                worker = factory()
+                worker.start()
+                self._workers[key] = worker
+            self._owners.setdefault(key, set()).add(id(owner))
+            return worker
+
+    # ----------------------------------------------------------------------
+    def release(self, key, owner):
+        """Release the worker for `key`.
+
+        :return: True if `owner` was the last user and should shut down the worker
+        """
+        with self._lock:
+            owners = self._owners.get(key, set())
+            owners.discard(id(owner))
+            if owners:
+                return False
+            self._owners.pop(key, None)
+            self._workers.pop(key, None)
+            return True
+
+    # ----------------------------------------------------------------------
+    def reset_after_fork(self):
+        """Forget the workers of the parent process, their threads do not exist in the child"""
+        self._lock = Lock()
+        self._workers = {}
+        self._owners = {}
+
+    # ----------------------------------------------------------------------
+    def get_workers(self):
+        with self._lock:
+            return dict(self._workers)
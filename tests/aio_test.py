@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+#
+# This software may be modified and distributed under the terms
+# of the MIT license.  See the LICENSE file for details.
+
+import logging
+import sys
+import unittest
+
+
+@unittest.skipIf(sys.version_info < (3, 7), 'asyncio handler requires Python 3.7')
+class AsyncioLogHandlerTest(unittest.TestCase):
+
+    # ----------------------------------------------------------------------
+    def _record(self, msg):
+        return logging.LogRecord('test', logging.INFO, __file__, 1, msg, None, None)
+
+    # ----------------------------------------------------------------------
+    def test_tcp_on_application_loop(self):
+        import asyncio
+        from log_async.aio import AsyncioLogHandler
+        received = []
+
+        async def handle_client(reader, writer):
+            received.append(await reader.read())
+            writer.close()
+
+        async def main():
+            server = await asyncio.start_server(handle_client, '127.0.0.1', 0)
+            port = server.sockets[0].getsockname()[1]
+            handler = AsyncioLogHandler('127.0.0.1', port)
+            for i in range(3):
+                handler.emit(self._record('event {}'.format(i)))
+            await handler.flush_async()
+            await handler.shutdown_async()
+            server.close()
+            await server.wait_closed()
+
+        asyncio.run(main())
+        data = b''.join(received)
+        self.assertEqual(3, data.count(b'\n'))
+        self.assertIn(b'event 2', data)
+
+    # ----------------------------------------------------------------------
+    def test_udp_on_dedicated_loop(self):
+        import socket
+        from log_async.aio import AsyncioLogHandler
+        sink = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sink.bind(('127.0.0.1', 0))
+        sink.settimeout(10)
+        handler = AsyncioLogHandler(
+            '127.0.0.1', sink.getsockname()[1], transport='log_async.aio.AsyncioUdpTransport')
+        handler.emit(self._record('datagram'))
+        handler.close()
+        data, _ = sink.recvfrom(65536)
+        sink.close()
+        self.assertIn(b'datagram', data)
+
+    # ----------------------------------------------------------------------
+    def test_emit_before_loop_runs(self):
+        import asyncio
+        from log_async.aio import AsyncioLogHandler
+        received = []
+
+        async def handle_client(reader, writer):
+            received.append(await reader.read())
+            writer.close()
+
+        loop = asyncio.new_event_loop()
+        server = loop.run_until_complete(asyncio.start_server(handle_client, '127.0.0.1', 0))
+        handler = AsyncioLogHandler('127.0.0.1', server.sockets[0].getsockname()[1], loop=loop)
+        # the loop is not running, emit must not wait for it
+        handler.emit(self._record('early event'))
+
+        async def main():
+            await handler.flush_async()
+            await handler.shutdown_async()
+            server.close()
+            await server.wait_closed()
+
+        loop.run_until_complete(main())
+        loop.close()
+        self.assertIn(b'early event', b''.join(received))
+
+    # ----------------------------------------------------------------------
+    def test_cancelled_while_sending(self):
+        import asyncio
+        from log_async.aio import AsyncioLogHandler
+
+        class BlockingTransport(object):
+
+            def __init__(self):
+                self.sending = asyncio.Event()
+
+            async def send(self, events):
+                self.sending.set()
+                await asyncio.Event().wait()
+
+            async def close(self):
+                pass
+
+            def get_stats(self):
+                return []
+
+        async def main():
+            transport = BlockingTransport()
+            handler = AsyncioLogHandler('127.0.0.1', 0, transport=transport)
+            handler.emit(self._record('claimed event'))
+            handler.flush()
+            await transport.sending.wait()
+            task = handler._task
+            task.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await task
+            return handler._buffer.get_queued_events()
+
+        events = asyncio.run(main())
+        self.assertEqual(1, len(events))
+        self.assertIn(b'claimed event', events[0]['event_text'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+#
+# This software may be modified and distributed under the terms
+# of the MIT license.  See the LICENSE file for details.
+
+import unittest
+
+from log_async.breaker import CircuitBreaker, STATE_CLOSED, STATE_HALF_OPEN, STATE_OPEN
+
+
+class FakeClock(object):
+
+    def __init__(self):
+        self.now = 100.0
+
+    def __call__(self):
+        return self.now
+
+
+class CircuitBreakerTest(unittest.TestCase):
+
+    # ----------------------------------------------------------------------
+    def setUp(self):
+        self.clock = FakeClock()
+        self.breaker = CircuitBreaker(
+            failure_threshold=2, backoff_initial=1.0, backoff_max=4.0,
+            clock=self.clock, random_=lambda: 1.0)
+
+    # ----------------------------------------------------------------------
+    def test_opens_after_threshold(self):
+        self.assertFalse(self.breaker.record_failure())
+        self.assertEqual(STATE_CLOSED, self.breaker.state)
+        self.assertTrue(self.breaker.record_failure())
+        self.assertEqual(STATE_OPEN, self.breaker.state)
+        self.assertFalse(self.breaker.allow())
+        self.assertEqual(1.0, self.breaker.retry_in())
+        self.assertEqual(1, self.breaker.trips)
+
+    # ----------------------------------------------------------------------
+    def test_half_open_probe(self):
+        self.breaker.record_failure()
+        self.breaker.record_failure()
+        self.clock.now += 1.0
+        self.assertTrue(self.breaker.allow())
+        self.assertEqual(STATE_HALF_OPEN, self.breaker.state)
+        self.assertTrue(self.breaker.probing)
+        self.breaker.record_success()
+        self.assertEqual(STATE_CLOSED, self.breaker.state)
+        self.assertFalse(self.breaker.probing)
+
+    # ----------------------------------------------------------------------
+    def test_exponential_backoff(self):
+        self.breaker.record_failure()
+        self.breaker.record_failure()
+        delays = [self.breaker.retry_in()]
+        for _ in range(3):
+            self.clock.now += delays[-1]
+            self.assertTrue(self.breaker.allow())
+            # a failed probe opens the breaker again right away
+            self.assertTrue(self.breaker.record_failure())
+            delays.append(self.breaker.retry_in())
+        self.assertEqual([1.0, 2.0, 4.0, 4.0], delays)
+
+    # ----------------------------------------------------------------------
+    def test_jitter(self):
+        breaker = CircuitBreaker(
+            failure_threshold=1, backoff_initial=10.0, clock=self.clock, random_=lambda: 0.0)
+        breaker.record_failure()
+        self.assertEqual(5.0, breaker.retry_in())
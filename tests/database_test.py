@@ -116,6 +116,83 @@ class DatabaseCacheTest(unittest.TestCase):
         events = self.cache.get_queued_events()
         self.assertEqual(len(events), 0)
 
+    # ----------------------------------------------------------------------
+    def test_get_queued_events_limit(self):
+        for i in range(5):
+            self.cache.add_event('message %d' % i)
+        events = self.cache.get_queued_events(limit=3)
+        self.assertEqual([event['event_text'] for event in events],
+                         ['message 0', 'message 1', 'message 2'])
+        events = self.cache.get_queued_events(limit=3)
+        self.assertEqual(len(events), 2)
+
+    # ----------------------------------------------------------------------
+    def test_delete_events(self):
+        for i in range(4):
+            self.cache.add_event('message %d' % i)
+        first = self.cache.get_queued_events(limit=2)
+        second = self.cache.get_queued_events(limit=2)
+        self.cache.delete_events(second)
+        self.cache.requeue_queued_events(first)
+
+        events = self.cache.get_queued_events()
+        self.assertEqual([event['event_text'] for event in events], ['message 0', 'message 1'])
+
+    # ----------------------------------------------------------------------
+    def test_complete_queued_events(self):
+        for i in range(4):
+            self.cache.add_event('message %d' % i)
+        events = self.cache.get_queued_events()
+        self.cache.complete_queued_events(events, 3)
+        self.cache.delete_queued_events()
+
+        events = self.cache.get_queued_events()
+        self.assertEqual([event['event_text'] for event in events], ['message 3'])
+
+    # ----------------------------------------------------------------------
+    def test_vacuum(self):
+        for i in range(500):
+            self.cache.add_event('message %d' % i * 20)
+        self.assertFalse(self.cache.vacuum())
+        self.cache.get_queued_events()
+        self.cache.delete_queued_events()
+        self.cache.refresh_stats()
+        size_before = lookup(self.cache.get_stats(), 'file_bytes')
+        self.assertTrue(self.cache.vacuum())
+        self.cache.refresh_stats()
+        self.assertLess(lookup(self.cache.get_stats(), 'file_bytes'), size_before)
+
+    # ----------------------------------------------------------------------
+    def test_created(self):
+        self.cache.add_event('message 1', created=1500000000.5)
+        self.cache.add_event('message 2')
+        events = self.cache.get_queued_events()
+        self.assertEqual([1500000000.5, None], [event['created'] for event in events])
+
+    # ----------------------------------------------------------------------
+    def test_upgrade_schema(self):
+        path = 'test_upgrade.db'
+        connection = sqlite3.connect(path)
+        connection.execute('''
+            CREATE TABLE `event` (
+            `event_id`          INTEGER NOT NULL PRIMARY KEY AUTOINCREMENT,
+            `event_text`        TEXT NOT NULL,
+            `pending_delete`    INTEGER NOT NULL,
+            `entry_date`        TEXT NOT NULL);''')
+        connection.execute('''
+            INSERT INTO `event` (`event_text`, `pending_delete`, `entry_date`)
+            VALUES ('old message', 0, datetime('now'))''')
+        connection.commit()
+        connection.close()
+        try:
+            cache = DatabaseCache(path)
+            cache.add_event('new message', created=1500000000.0)
+            events = cache.get_queued_events()
+            self.assertEqual([('old message', None), ('new message', 1500000000.0)],
+                             [(event['event_text'], event['created']) for event in events])
+        finally:
+            os.remove(path)
+
     # ----------------------------------------------------------------------
     def test_dont_delete_unqueued_events(self):
         self.cache.add_event('message')
@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+#
+# This software may be modified and distributed under the terms
+# of the MIT license.  See the LICENSE file for details.
+
+import unittest
+
+from log_async.flush_controller import AdaptiveFlushController
+
+
+class FakeClock(object):
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class AdaptiveFlushControllerTest(unittest.TestCase):
+
+    # ----------------------------------------------------------------------
+    def setUp(self):
+        self.clock = FakeClock()
+        self.controller = AdaptiveFlushController(
+            min_interval=1.0, max_latency=10.0, min_count=10, max_count=5000,
+            target_utilization=0.5, smoothing=1.0, clock=self.clock)
+
+    # ----------------------------------------------------------------------
+    def _tick(self, arrivals, backlog=0, seconds=1.0):
+        self.controller.record_arrival(arrivals)
+        self.clock.now += seconds
+        self.controller.update(backlog=backlog)
+
+    # ----------------------------------------------------------------------
+    def test_quiet_period(self):
+        self._tick(arrivals=1)
+        self.assertEqual(1.0, self.controller.interval)
+        self.assertEqual(10, self.controller.count)
+
+    # ----------------------------------------------------------------------
+    def test_burst_increases_batch_size(self):
+        self.controller.record_send(2.0)
+        self._tick(arrivals=1000)
+        self.assertEqual(4.0, self.controller.interval)
+        self.assertEqual(4000, self.controller.count)
+        self._tick(arrivals=100000)
+        self.assertEqual(5000, self.controller.count)
+
+    # ----------------------------------------------------------------------
+    def test_slow_sends_bounded_by_max_latency(self):
+        self.controller.record_send(30.0)
+        self._tick(arrivals=1)
+        self.assertEqual(10.0, self.controller.interval)
+
+    # ----------------------------------------------------------------------
+    def test_backlog_flushes_quickly(self):
+        self.controller.record_send(2.0)
+        self._tick(arrivals=100, backlog=1000)
+        self.assertEqual(1.0, self.controller.interval)
+
+    # ----------------------------------------------------------------------
+    def test_rate_window(self):
+        self._tick(arrivals=100, seconds=0.1)
+        self.assertEqual(0.0, self.controller.arrival_rate)
+        self._tick(arrivals=0, seconds=0.9)
+        self.assertEqual(100.0, self.controller.arrival_rate)
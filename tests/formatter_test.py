@@ -0,0 +1,195 @@
+# -*- coding: utf-8 -*-
+#
+# This software may be modified and distributed under the terms
+# of the MIT license.  See the LICENSE file for details.
+
+import json
+import logging
+import sys
+import unittest
+
+from log_async.formatter import CborLogstashFormatter, LogstashFormatter, MsgpackLogstashFormatter
+from log_async.framing import LengthPrefixFraming
+from log_async.handler import AsynchronousLogHandler
+from log_async.stats import lookup
+
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    import cbor2
+except ImportError:
+    cbor2 = None
+
+
+class LogstashFormatterTest(unittest.TestCase):
+
+    # ----------------------------------------------------------------------
+    def _make_record(self, msg='message', extra=None, exc_info=None):
+        record = logging.LogRecord(
+            'test', logging.INFO, __file__, 1, msg, None, exc_info)
+        for key, value in (extra or {}).items():
+            setattr(record, key, value)
+        return record
+
+    # ----------------------------------------------------------------------
+    def _format(self, formatter, record):
+        return json.loads(formatter.format(record).decode('utf-8'))
+
+    # ----------------------------------------------------------------------
+    def test_format_without_limits(self):
+        formatter = LogstashFormatter()
+        record = self._make_record(extra={'payload': {'a': [1, 2, 3]}})
+        event = self._format(formatter, record)
+        self.assertEqual(event['message'], 'message')
+        self.assertEqual(event['extra']['payload'], {'a': [1, 2, 3]})
+        self.assertNotIn('truncated', event['extra'])
+
+    # ----------------------------------------------------------------------
+    def test_format_batch(self):
+        formatter = LogstashFormatter(tags=['batch'])
+        records = [self._make_record(msg='message {}'.format(i), extra={'payload': i})
+                   for i in range(3)]
+        batch = formatter.format_batch(records)
+        events = [json.loads(line.decode('utf-8')) for line in batch.splitlines()]
+        self.assertEqual([self._format(formatter, record) for record in records], events)
+        self.assertEqual(['batch'], events[0]['tags'])
+        framed = formatter.format_batch_events(records)
+        self.assertEqual(3, len(framed))
+        self.assertTrue(all(event.endswith(b'\n') for event in framed))
+        self.assertEqual(batch, b''.join(framed))
+
+    # ----------------------------------------------------------------------
+    def test_format_batch_record_fields_replace_envelope(self):
+        formatter = LogstashFormatter(extra_prefix='')
+        record = self._make_record(extra={'host': 'other', 'payload': 1})
+        event = json.loads(formatter.format_batch([record]).decode('utf-8'))
+        self.assertEqual(self._format(formatter, record), event)
+        self.assertEqual('other', event['host'])
+
+    # ----------------------------------------------------------------------
+    def test_format_batch_with_limits(self):
+        formatter = LogstashFormatter(max_string_length=10)
+        records = [self._make_record(msg='x' * 100)]
+        self.assertEqual(formatter.format(records[0]) + b'\n', formatter.format_batch(records))
+
+    # ----------------------------------------------------------------------
+    def test_max_string_length(self):
+        formatter = LogstashFormatter(max_string_length=10)
+        record = self._make_record(msg='x' * 100, extra={'payload': 'y' * 100})
+        event = self._format(formatter, record)
+        self.assertEqual(len(event['message']), 10)
+        self.assertTrue(event['message'].endswith('...'))
+        self.assertEqual(len(event['extra']['payload']), 10)
+        self.assertTrue(event['extra']['truncated'])
+        self.assertEqual(1, lookup(formatter.get_stats(), 'truncated_total'))
+
+    # ----------------------------------------------------------------------
+    def test_max_collection_length(self):
+        formatter = LogstashFormatter(max_collection_length=3)
+        record = self._make_record(extra={'payload': list(range(100))})
+        event = self._format(formatter, record)
+        self.assertEqual(event['extra']['payload'], [0, 1, 2])
+        self.assertTrue(event['extra']['truncated'])
+
+    # ----------------------------------------------------------------------
+    def test_max_depth(self):
+        formatter = LogstashFormatter(max_depth=2)
+        record = self._make_record(extra={'payload': {'a': {'b': {'c': 1}}}})
+        event = self._format(formatter, record)
+        self.assertEqual(event['extra']['payload'], {'a': {'b': '...'}})
+        self.assertTrue(event['extra']['truncated'])
+
+    # ----------------------------------------------------------------------
+    def test_max_event_bytes(self):
+        formatter = LogstashFormatter(max_event_bytes=2048)
+        payload = dict(('key{}'.format(i), 'v' * 100) for i in range(1000))
+        record = self._make_record(extra={'payload': payload})
+        serialized = formatter.format(record)
+        self.assertLessEqual(len(serialized), 2048)
+        event = json.loads(serialized.decode('utf-8'))
+        self.assertEqual(event['message'], 'message')
+        self.assertTrue(event['extra']['truncated'])
+
+    # ----------------------------------------------------------------------
+    def test_max_event_bytes_escaped_message(self):
+        formatter = LogstashFormatter(max_event_bytes=1024)
+        record = self._make_record(msg=u'ä' * 2000)
+        serialized = formatter.format(record)
+        self.assertLessEqual(len(serialized), 1024)
+        event = json.loads(serialized.decode('utf-8'))
+        self.assertTrue(event['extra']['truncated'])
+
+    # ----------------------------------------------------------------------
+    def test_stack_trace_keeps_tail(self):
+        formatter = LogstashFormatter(max_string_length=40)
+        try:
+            raise ValueError('boom')
+        except ValueError:
+            record = self._make_record(exc_info=sys.exc_info())
+        event = self._format(formatter, record)
+        stack_trace = event['extra']['stack_trace']
+        self.assertTrue(stack_trace.startswith('...'))
+        self.assertTrue(stack_trace.rstrip().endswith('ValueError: boom'))
+
+    # ----------------------------------------------------------------------
+    def test_stack_trace_dedup(self):
+        formatter = LogstashFormatter(stack_trace_dedup_window=60)
+        events = []
+        for _ in range(2):
+            try:
+                raise ValueError('boom')
+            except ValueError:
+                events.append(self._format(formatter, self._make_record(exc_info=sys.exc_info())))
+        first, second = events[0]['extra'], events[1]['extra']
+        self.assertIn('stack_trace', first)
+        self.assertNotIn('stack_trace', second)
+        self.assertEqual(first['stack_trace_fingerprint'], second['stack_trace_fingerprint'])
+        self.assertEqual(2, second['stack_trace_repeats'])
+        self.assertEqual(1, lookup(formatter.get_stats(), 'stack_trace_deduplicated'))
+
+
+class BinaryFormatterTest(unittest.TestCase):
+
+    # ----------------------------------------------------------------------
+    def _roundtrip(self, formatter):
+        handler = AsynchronousLogHandler(
+            'localhost', 0, enable=False, formatter=formatter, framing=LengthPrefixFraming())
+        record = logging.LogRecord(
+            'test', logging.INFO, __file__, 1, u'message \n ä', None, None)
+        record.payload = {'data': [1, 2.5, None]}
+        frames = LengthPrefixFraming().decoder().feed(handler._format_record(record))
+        self.assertEqual(1, len(frames))
+        return formatter.deserialize(frames[0])
+
+    # ----------------------------------------------------------------------
+    @unittest.skipIf(msgpack is None, 'msgpack is not installed')
+    def test_msgpack(self):
+        event = self._roundtrip(MsgpackLogstashFormatter())
+        self.assertEqual(u'message \n ä', event['message'])
+        self.assertEqual({'data': [1, 2.5, None]}, event['extra']['payload'])
+
+    # ----------------------------------------------------------------------
+    @unittest.skipIf(msgpack is None, 'msgpack is not installed')
+    def test_msgpack_format_batch(self):
+        formatter = MsgpackLogstashFormatter()
+        records = [
+            logging.LogRecord('test', logging.INFO, __file__, 1, str(i), None, None)
+            for i in range(3)]
+        frames = LengthPrefixFraming().decoder().feed(formatter.format_batch(records))
+        self.assertEqual(['0', '1', '2'], [formatter.deserialize(f)['message'] for f in frames])
+        self.assertEqual([formatter.format(record) for record in records], frames)
+
+    # ----------------------------------------------------------------------
+    @unittest.skipIf(cbor2 is None, 'cbor2 is not installed')
+    def test_cbor(self):
+        event = self._roundtrip(CborLogstashFormatter())
+        self.assertEqual(u'message \n ä', event['message'])
+        self.assertEqual({'data': [1, 2.5, None]}, event['extra']['payload'])
+
+
+if __name__ == '__main__':
+    unittest.main()
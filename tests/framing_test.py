@@ -0,0 +1,48 @@
+# -*- coding: utf-8 -*-
+#
+# This software may be modified and distributed under the terms
+# of the MIT license.  See the LICENSE file for details.
+
+import unittest
+
+from log_async.framing import DelimiterFraming, LengthPrefixFraming
+
+
+class FramingTest(unittest.TestCase):
+
+    # ----------------------------------------------------------------------
+    def _roundtrip(self, framing, events, chunk_size):
+        stream = b''.join(framing.frame(event) for event in events)
+        decoder = framing.decoder()
+        decoded = []
+        for start in range(0, len(stream), chunk_size):
+            decoded.extend(decoder.feed(stream[start:start + chunk_size]))
+        self.assertEqual(0, decoder.pending())
+        return decoded
+
+    # ----------------------------------------------------------------------
+    def test_delimiter_framing(self):
+        events = [b'{"a": 1}', b'{"b": 2}', b'']
+        for chunk_size in (1, 3, 1024):
+            self.assertEqual(events, self._roundtrip(DelimiterFraming(b'\n'), events, chunk_size))
+
+    # ----------------------------------------------------------------------
+    def test_length_prefix_framing(self):
+        events = [b'\x00\n\xff', b'', b'x' * 1000]
+        for chunk_size in (1, 3, 1024):
+            self.assertEqual(events, self._roundtrip(LengthPrefixFraming(), events, chunk_size))
+
+    # ----------------------------------------------------------------------
+    def test_frame_into(self):
+        buffer_ = bytearray()
+        framing = LengthPrefixFraming()
+        framing.frame_into(buffer_, b'abc')
+        self.assertEqual(bytes(buffer_), framing.frame(b'abc'))
+
+    # ----------------------------------------------------------------------
+    def test_empty_delimiter(self):
+        self.assertEqual(b'abc', DelimiterFraming(b'').frame(b'abc'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,242 @@
+# -*- coding: utf-8 -*-
+#
+# This software may be modified and distributed under the terms
+# of the MIT license.  See the LICENSE file for details.
+
+import logging
+import os
+import tempfile
+import unittest
+
+from log_async.handler import AsynchronousLogHandler
+from log_async.memory_cache import MemoryCache
+from log_async.stats import lookup
+from log_async.worker import WorkerPool
+
+
+class RecordingTransport(object):
+
+    def __init__(self):
+        self.events = []
+        self.closed = False
+
+    def send(self, events):
+        self.events.extend(events)
+
+    def close(self):
+        self.closed = True
+
+    def get_stats(self):
+        return []
+
+
+class FailingTransport(RecordingTransport):
+
+    def send(self, events):
+        raise IOError('connection refused')
+
+
+class AsynchronousLogHandlerTest(unittest.TestCase):
+
+    # ----------------------------------------------------------------------
+    def _create_handler(self, host='localhost', **kwargs):
+        transport = RecordingTransport()
+        handler = AsynchronousLogHandler(
+            host, 5959, transport=transport, buffer=MemoryCache({}), **kwargs)
+        return handler, transport
+
+    # ----------------------------------------------------------------------
+    def _emit(self, handler, msg):
+        handler.emit(logging.LogRecord('test', logging.INFO, __file__, 1, msg, None, None))
+
+    # ----------------------------------------------------------------------
+    def test_worker_per_handler(self):
+        app_handler, app_transport = self._create_handler('app')
+        audit_handler, audit_transport = self._create_handler('audit')
+        self._emit(app_handler, 'app')
+        self._emit(audit_handler, 'audit')
+        self.assertIsNot(app_handler._worker_thread, audit_handler._worker_thread)
+        app_handler.shutdown()
+        audit_handler.shutdown()
+        self.assertEqual(1, len(app_transport.events))
+        self.assertIn(b'"app"', app_transport.events[0])
+        self.assertEqual(1, len(audit_transport.events))
+        self.assertIn(b'"audit"', audit_transport.events[0])
+
+    # ----------------------------------------------------------------------
+    def test_shared_worker_pool(self):
+        pool = WorkerPool()
+        transport = RecordingTransport()
+        buffer_ = MemoryCache({})
+        handler1, handler2 = [
+            AsynchronousLogHandler('localhost', 5959, transport=transport, buffer=buffer_,
+                                   worker_pool=pool)
+            for _ in range(2)]
+        self._emit(handler1, 'first')
+        self._emit(handler2, 'second')
+        worker = handler1._worker_thread
+        self.assertIs(worker, handler2._worker_thread)
+        handler1.shutdown()
+        self.assertTrue(worker.is_alive())
+        handler2.shutdown()
+        self.assertFalse(worker.is_alive())
+        self.assertEqual(2, len(transport.events))
+        self.assertTrue(transport.closed)
+
+    # ----------------------------------------------------------------------
+    def test_worker_pool_configuration_mismatch(self):
+        pool = WorkerPool()
+        handler1, transport1 = self._create_handler(worker_pool=pool)
+        handler2, transport2 = self._create_handler(worker_pool=pool)
+        self._emit(handler1, 'first')
+        self._emit(handler2, 'second')
+        # other transport and buffer instances, the events must not be mixed up
+        self.assertIsNot(handler1._worker_thread, handler2._worker_thread)
+        handler1.shutdown()
+        handler2.shutdown()
+        self.assertEqual(1, len(transport1.events))
+        self.assertIn(b'first', transport1.events[0])
+        self.assertEqual(1, len(transport2.events))
+        self.assertIn(b'second', transport2.events[0])
+
+        def key(**kwargs):
+            handler = AsynchronousLogHandler('localhost', 5959, worker_pool=pool, **kwargs)
+            return handler._worker_key()
+
+        self.assertEqual(key(), key())
+        self.assertNotEqual(key(), key(ssl_enable=True))
+        self.assertNotEqual(key(), key(transport='log_async.transport.UdpTransport'))
+        self.assertNotEqual(key(), key(database_path='other.db'))
+        self.assertNotEqual(key(), key(event_ttl=60))
+
+    # ----------------------------------------------------------------------
+    def test_flush_waits_for_delivery(self):
+        handler, transport = self._create_handler()
+        for i in range(3):
+            self._emit(handler, 'message %d' % i)
+        self.assertEqual(0, handler.flush(timeout=5))
+        self.assertEqual(3, len(transport.events))
+        self.assertEqual(0, handler.shutdown(timeout=5))
+
+    # ----------------------------------------------------------------------
+    def test_stats(self):
+        handler, _ = self._create_handler()
+        for i in range(3):
+            self._emit(handler, 'message %d' % i)
+        handler.flush(timeout=5)
+        stats = handler.get_stats()
+        self.assertEqual(3, lookup(stats, 'emit_seconds_count'))
+        self.assertEqual(3, lookup(stats, 'event_age_seconds_count'))
+        handler.shutdown()
+
+    # ----------------------------------------------------------------------
+    def test_flush_timeout(self):
+        transport = FailingTransport()
+        handler = AsynchronousLogHandler(
+            'localhost', 5959, transport=transport, buffer=MemoryCache({}))
+        self._emit(handler, 'message')
+        self.assertEqual(1, handler.flush(timeout=0.2))
+        # the last attempt on shutdown fails as well
+        self.assertEqual(1, handler.shutdown(timeout=5))
+        self.assertTrue(transport.closed)
+
+    # ----------------------------------------------------------------------
+    def test_deferred_formatting(self):
+        handler, transport = self._create_handler(deferred_formatting=True)
+        records = [logging.LogRecord('test', logging.INFO, __file__, 1, 'message %d', (i,), None)
+                   for i in range(3)]
+        for record in records:
+            handler.emit(record)
+        self.assertEqual(0, handler.flush(timeout=5))
+        self.assertEqual([handler.formatter.format(record) + b'\n' for record in records],
+                         transport.events)
+        self.assertEqual(0, handler.shutdown(timeout=5))
+
+    # ----------------------------------------------------------------------
+    def test_deferred_formatting_error(self):
+        handler, transport = self._create_handler(deferred_formatting=True)
+        self._emit(handler, 'valid')
+        handler.emit(logging.LogRecord('test', logging.INFO, __file__, 1, '%d', ('x',), None))
+        self._emit(handler, 'valid too')
+        # the record which cannot be formatted is dropped, but counted as done
+        self.assertEqual(0, handler.flush(timeout=5))
+        self.assertEqual(2, len(transport.events))
+        handler.shutdown()
+
+    # ----------------------------------------------------------------------
+    def test_deferred_formatting_with_worker_pool(self):
+        with self.assertRaises(ValueError):
+            self._create_handler(deferred_formatting=True, worker_pool=WorkerPool())
+
+    # ----------------------------------------------------------------------
+    def test_flush_without_worker(self):
+        handler, _ = self._create_handler()
+        self.assertIsNone(handler.flush())
+        self.assertEqual(0, handler.flush(timeout=1))
+        self.assertEqual(0, handler.shutdown(timeout=1))
+
+
+@unittest.skipUnless(hasattr(os, 'register_at_fork'), 'os.register_at_fork is not available')
+class ForkTest(unittest.TestCase):
+
+    # ----------------------------------------------------------------------
+    def _emit(self, handler, msg):
+        handler.emit(logging.LogRecord('test', logging.INFO, __file__, 1, msg, None, None))
+
+    # ----------------------------------------------------------------------
+    def _run_in_child(self, func):
+        pid = os.fork()
+        if pid == 0:
+            exit_code = 1
+            try:
+                exit_code = 0 if func() else 2
+            finally:
+                os._exit(exit_code)
+        _, status = os.waitpid(pid, 0)
+        self.assertEqual(0, os.WEXITSTATUS(status))
+
+    # ----------------------------------------------------------------------
+    def test_restart_in_child(self):
+        transport = RecordingTransport()
+        handler = AsynchronousLogHandler(
+            'localhost', 5959, transport=transport, buffer=MemoryCache({}))
+        self._emit(handler, 'parent')
+
+        def child():
+            # fresh worker, the parent's events are not inherited
+            fresh = handler._worker_thread is None and not handler._buffer._cache
+            self._emit(handler, 'child')
+            started = handler._worker_thread.is_alive()
+            handler.shutdown()
+            return fresh and started and len(transport.events) == 1
+
+        self._run_in_child(child)
+        handler.shutdown()
+        self.assertEqual(1, len(transport.events))
+        self.assertIn(b'"parent"', transport.events[0])
+
+    # ----------------------------------------------------------------------
+    def test_forward_to_parent(self):
+        transport = RecordingTransport()
+        path = os.path.join(tempfile.mkdtemp(), 'forward.sock')
+        handler = AsynchronousLogHandler(
+            'localhost', 5959, transport=transport, buffer=MemoryCache({}),
+            fork_mode='forward', forward_socket_path=path)
+        self._emit(handler, 'parent')
+
+        def child():
+            self._emit(handler, 'child')
+            handler.shutdown()
+            return not transport.events
+
+        self._run_in_child(child)
+        handler.shutdown()
+        self.assertFalse(os.path.exists(path))
+        self.assertEqual(2, len(transport.events))
+        self.assertTrue(any(b'"child"' in event for event in transport.events))
+        self.assertTrue(any(b'"parent"' in event for event in transport.events))
+        os.rmdir(os.path.dirname(path))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+#
+# This software may be modified and distributed under the terms
+# of the MIT license.  See the LICENSE file for details.
+
+import logging
+import unittest
+
+from log_async.handler import AsynchronousLogHandler
+from log_async.hooks import HookRegistry, hooks
+from log_async.memory_cache import MemoryCache
+from log_async.transport import TcpTransport
+
+
+class RecordingTransport(object):
+
+    def __init__(self):
+        self.events = []
+
+    def send(self, events):
+        self.events.extend(events)
+
+    def close(self):
+        pass
+
+
+class HookRegistryTest(unittest.TestCase):
+
+    # ----------------------------------------------------------------------
+    def test_register(self):
+        registry = HookRegistry()
+        self.assertIsNone(registry.on_send_start)
+        calls = []
+        first = calls.append
+
+        def second(events):
+            calls.append(len(events))
+
+        registry.register('on_send_start', first)
+        # a single callback is called directly
+        self.assertIs(first, registry.on_send_start)
+        registry.register('on_send_start', second)
+        registry.on_send_start(['a', 'b'])
+        self.assertEqual([['a', 'b'], 2], calls)
+        registry.unregister('on_send_start', first)
+        self.assertIs(second, registry.on_send_start)
+        registry.clear()
+        self.assertIsNone(registry.on_send_start)
+
+    # ----------------------------------------------------------------------
+    def test_unknown_hook(self):
+        with self.assertRaises(ValueError):
+            HookRegistry().register('on_something', print)
+
+
+class PipelineHooksTest(unittest.TestCase):
+
+    # ----------------------------------------------------------------------
+    def setUp(self):
+        self.calls = []
+        self.callbacks = {}
+        for name in ('on_enqueue', 'on_cache_write', 'on_claim', 'on_flush_cycle',
+                     'on_send_start', 'on_send_end'):
+            self.callbacks[name] = self._recorder(name)
+            hooks.register(name, self.callbacks[name])
+
+    # ----------------------------------------------------------------------
+    def tearDown(self):
+        for name, callback in self.callbacks.items():
+            hooks.unregister(name, callback)
+
+    # ----------------------------------------------------------------------
+    def _recorder(self, name):
+        return lambda *args: self.calls.append((name, args))
+
+    # ----------------------------------------------------------------------
+    def test_worker_hooks(self):
+        transport = RecordingTransport()
+        handler = AsynchronousLogHandler(
+            'localhost', 5959, transport=transport, buffer=MemoryCache({}))
+        handler.emit(logging.LogRecord('test', logging.INFO, __file__, 1, 'message', None, None))
+        handler.shutdown()
+        names = [name for name, _ in self.calls]
+        self.assertEqual(['on_enqueue', 'on_cache_write', 'on_claim', 'on_flush_cycle'], names)
+        _, (count, duration) = self.calls[-1]
+        self.assertEqual(1, count)
+        self.assertGreaterEqual(duration, 0)
+
+    # ----------------------------------------------------------------------
+    def test_transport_hooks(self):
+        transport = TcpTransport('localhost', 1, False, True, None, None, None)
+        with self.assertRaises(Exception):
+            transport.send([b'event'])
+        self.assertEqual(['on_send_start', 'on_send_end'], [name for name, _ in self.calls])
+        events, _, error = self.calls[1][1]
+        self.assertEqual([b'event'], events)
+        self.assertIsNotNone(error)
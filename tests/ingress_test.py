@@ -0,0 +1,44 @@
+# -*- coding: utf-8 -*-
+#
+# This software may be modified and distributed under the terms
+# of the MIT license.  See the LICENSE file for details.
+
+from threading import Thread
+import unittest
+
+from log_async.ingress import DequeIngressQueue
+
+
+class DequeIngressQueueTest(unittest.TestCase):
+
+    # ----------------------------------------------------------------------
+    def test_get_batch(self):
+        queue = DequeIngressQueue()
+        self.assertEqual([], queue.get_batch())
+        for i in range(5):
+            queue.put(i)
+        self.assertEqual(5, queue.qsize())
+        self.assertEqual([0, 1], queue.get_batch(max_events=2))
+        self.assertEqual([2, 3, 4], queue.get_batch())
+        self.assertEqual(0, queue.qsize())
+
+    # ----------------------------------------------------------------------
+    def test_concurrent_producers(self):
+        queue = DequeIngressQueue()
+
+        def produce(producer):
+            for i in range(1000):
+                queue.put((producer, i))
+
+        threads = [Thread(target=produce, args=(producer,)) for producer in range(8)]
+        received = []
+        for thread in threads:
+            thread.start()
+        while any(thread.is_alive() for thread in threads):
+            received.extend(queue.get_batch())
+        received.extend(queue.get_batch())
+        self.assertEqual(8000, len(received))
+        for producer in range(8):
+            # events of each producer keep their order
+            events = [i for p, i in received if p == producer]
+            self.assertEqual(list(range(1000)), events)
@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+#
+# This software may be modified and distributed under the terms
+# of the MIT license.  See the LICENSE file for details.
+
+import json
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+from six.moves import StringIO
+
+from log_async.constants import constants
+from log_async.handler import AsynchronousLogHandler
+from log_async.loadgen import expected_backlog, LoadGenerator, main, parse_mix, summarize
+from log_async.memory_cache import MemoryCache
+from log_async.testing import RecordingTransport
+
+
+class CountingTransport(RecordingTransport):
+    """RecordingTransport which can be created from its path by the handler"""
+
+    def __init__(self, **kwargs):
+        super(CountingTransport, self).__init__()
+
+
+class LoadGeneratorTest(unittest.TestCase):
+
+    # ----------------------------------------------------------------------
+    def test_parse_mix(self):
+        self.assertEqual({'plain': 3.0, 'large': 1.0}, dict(parse_mix('plain=3, large')))
+        self.assertRaises(ValueError, parse_mix, 'plain=1,huge=1')
+        self.assertRaises(ValueError, parse_mix, 'plain=0')
+
+    # ----------------------------------------------------------------------
+    def test_run(self):
+        transport = RecordingTransport()
+        handler = AsynchronousLogHandler(
+            'localhost', 5959, transport=transport, buffer=MemoryCache({}))
+        generator = LoadGenerator(
+            handler, threads=2, mix=parse_mix('plain,extra,exception,large'),
+            sample_interval=0.1)
+        try:
+            result = generator.run([400, 0], 0.25)
+            self.assertEqual(0, handler.flush(timeout=10))
+            self.assertEqual(0, handler.pending)
+        finally:
+            handler.shutdown()
+
+        paced, unthrottled = result['stages']
+        self.assertAlmostEqual(100, paced['emitted'], delta=10)
+        self.assertGreater(unthrottled['emitted'], 0)
+        self.assertEqual(paced['emitted'], len(paced['latencies']))
+        self.assertEqual(paced['emitted'] + unthrottled['emitted'], len(transport.events))
+        text = b''.join(transport.events)
+        for fragment in (b'handled in', b'"currency": "EUR"', b'KeyError', b'payload of request'):
+            self.assertIn(fragment, text)
+        self.assertTrue(result['timeline'])
+        self.assertIn('eventlog_handler_emit_seconds_count', result['timeline'][-1]['stats'])
+
+    # ----------------------------------------------------------------------
+    def test_saturation(self):
+        stage = dict(duration=1.0, emitted=1000, backlog_start=0, backlog_end=0,
+                     latencies=[0.001] * 1000)
+        self.assertFalse(summarize(1000, [stage])['saturated'])
+        # the target rate was not reached
+        self.assertTrue(summarize(2000, [stage])['saturated'])
+        # the backlog grows beyond what the worker holds back by design
+        stage['backlog_end'] = 2 * expected_backlog(1000) + 1
+        summary = summarize(1000, [stage])
+        self.assertTrue(summary['saturated'])
+        self.assertEqual(1000.0, summary['emit_latency_us']['p99'])
+        # merged over processes
+        summary = summarize(2000, [dict(stage, backlog_end=0), dict(stage, backlog_end=0)])
+        self.assertEqual(2000, summary['emitted'])
+        self.assertFalse(summary['saturated'])
+
+    # ----------------------------------------------------------------------
+    def test_expected_backlog(self):
+        count = constants.QUEUED_EVENTS_FLUSH_COUNT
+        # events are sent after the flush interval if the flush count is not reached
+        self.assertEqual(
+            count + (constants.QUEUE_CHECK_INTERVAL + constants.QUEUED_EVENTS_FLUSH_INTERVAL),
+            expected_backlog(1))
+        self.assertEqual(count + 1000 * constants.QUEUE_CHECK_INTERVAL, expected_backlog(1000))
+
+    # ----------------------------------------------------------------------
+    def test_main(self):
+        directory = tempfile.mkdtemp()
+        try:
+            path = os.path.join(directory, 'report.json')
+            stdout, sys.stdout = sys.stdout, StringIO()
+            try:
+                self.assertEqual(0, main([
+                    '--transport', 'tests.loadgen_test.CountingTransport', '--rate', '200',
+                    '--duration', '0.2', '--sample-interval', '0.1', '--output', path]))
+            finally:
+                stdout, sys.stdout = sys.stdout, stdout
+            self.assertIn('backlog over time', stdout.getvalue())
+            with open(path) as report_file:
+                report = json.load(report_file)
+        finally:
+            shutil.rmtree(directory)
+        self.assertEqual(1, len(report['stages']))
+        self.assertEqual(0, report['pending'])
+        self.assertEqual(0, report['timeline'][0]['process'])
@@ -56,6 +56,38 @@ class MemoryCacheTest(unittest.TestCase):
         cache.delete_queued_events()
         self.assertEqual(len(cache._cache), 1)
 
+    # ----------------------------------------------------------------------
+    def test_get_queued_events_limit(self):
+        cache = MemoryCache({})
+        for i in range(5):
+            cache.add_event("message %d" % i)
+        batch = cache.get_queued_events(limit=3)
+        self.assertEqual(len(batch), 3)
+        self.assertEqual(batch[0]['event_text'], 'message 0')
+        self.assertEqual(len(cache.get_queued_events(limit=3)), 2)
+
+    # ----------------------------------------------------------------------
+    def test_delete_events(self):
+        cache = MemoryCache({})
+        for i in range(4):
+            cache.add_event("message %d" % i)
+        first = cache.get_queued_events(limit=2)
+        second = cache.get_queued_events(limit=2)
+        cache.delete_events(second)
+        self.assertEqual(len(cache._cache), 2)
+        cache.requeue_queued_events(first)
+        self.assertEqual(len(cache.get_queued_events()), 2)
+
+    # ----------------------------------------------------------------------
+    def test_complete_queued_events(self):
+        cache = MemoryCache({})
+        for i in range(4):
+            cache.add_event("message %d" % i)
+        events = cache.get_queued_events()
+        cache.complete_queued_events(events, 3)
+        self.assertEqual(['message 3'],
+                         [event['event_text'] for event in cache.get_queued_events()])
+
     # ----------------------------------------------------------------------
     def test_expire_events(self):
         cache = MemoryCache({
@@ -65,6 +97,17 @@ class MemoryCacheTest(unittest.TestCase):
         cache.expire_events()
         self.assertEqual(len(cache._cache), 1)
 
+    # ----------------------------------------------------------------------
+    def test_expire_events_with_clock(self):
+        now = [1000000.0]
+        cache = MemoryCache({}, event_ttl=100, clock=lambda: now[0])
+        cache.add_event("old")
+        now[0] += 60
+        cache.add_event("new")
+        now[0] += 60
+        self.assertEqual(1, cache.expire_events())
+        self.assertEqual(['new'], [event['event_text'] for event in cache.get_queued_events()])
+
     # ----------------------------------------------------------------------
     def test_event_counter(self):
         cache = MemoryCache({})
@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+#
+# This software may be modified and distributed under the terms
+# of the MIT license.  See the LICENSE file for details.
+
+import logging
+import sys
+import unittest
+
+from six.moves.urllib.request import urlopen
+
+from log_async.handler import AsynchronousLogHandler
+from log_async.memory_cache import MemoryCache
+from log_async.openmetrics import CONTENT_TYPE, OpenMetricsExporter, start_http_server
+from log_async.transport import TransportStats
+
+
+class RecordingTransport(object):
+
+    def __init__(self):
+        self.events = []
+
+    def send(self, events):
+        self.events.extend(events)
+
+    def close(self):
+        pass
+
+    def get_stats(self):
+        return [('custom_requests', 7)]
+
+
+class OpenMetricsExporterTest(unittest.TestCase):
+
+    # ----------------------------------------------------------------------
+    def setUp(self):
+        self.handlers = []
+        for name in ('app', 'app', 'audit'):
+            handler = AsynchronousLogHandler(
+                'localhost', 5959, transport=RecordingTransport(), buffer=MemoryCache({}))
+            handler.set_name(name)
+            self.handlers.append(handler)
+        record = logging.LogRecord('test', logging.INFO, __file__, 1, 'message', None, None)
+        self.handlers[0].emit(record)
+        self.handlers[0].flush(timeout=5)
+
+    # ----------------------------------------------------------------------
+    def tearDown(self):
+        for handler in self.handlers:
+            handler.shutdown()
+
+    # ----------------------------------------------------------------------
+    def test_render(self):
+        text = OpenMetricsExporter(self.handlers).render().decode('utf-8')
+        lines = text.split('\n')
+        self.assertEqual('# EOF', lines[-2])
+        self.assertEqual('', lines[-1])
+
+        self.assertIn('# TYPE eventlog_worker_events counter', lines)
+        self.assertIn('# HELP eventlog_worker_events events received', lines)
+        self.assertIn(
+            'eventlog_worker_events_total{handler="app",endpoint="localhost:5959"} 1', lines)
+        self.assertIn('# TYPE eventlog_worker_queue_size gauge', lines)
+        self.assertIn('# TYPE eventlog_handler_emit_seconds histogram', lines)
+        self.assertIn('eventlog_handler_emit_seconds_bucket'
+                      '{handler="app",endpoint="localhost:5959",le="+Inf"} 1', lines)
+        self.assertIn(
+            'eventlog_handler_emit_seconds_count{handler="app-2",endpoint="localhost:5959"} 0',
+            lines)
+        # samples without a metric definition
+        self.assertIn('# TYPE custom_requests unknown', lines)
+        self.assertIn('custom_requests{handler="audit",endpoint="localhost:5959"} 7', lines)
+
+        # each family is described once, followed by the samples of all handlers
+        self.assertEqual(1, lines.count('# TYPE eventlog_bufmem_events counter'))
+        start = lines.index('# TYPE eventlog_bufmem_events counter')
+        self.assertEqual(3, len([line for line in lines[start + 2:start + 5]
+                                 if line.startswith('eventlog_bufmem_events_total{')]))
+
+    # ----------------------------------------------------------------------
+    def test_counter_without_total_suffix(self):
+        TransportStats('test_transport_')
+        exporter = OpenMetricsExporter([])
+        self.assertEqual(('test_transport_sent_bytes', 'counter', 'bytes transmitted',
+                          'test_transport_sent_bytes_total', ''),
+                         exporter._parse('test_transport_sent_bytes'))
+        self.assertEqual(b'# EOF\n', exporter.render())
+
+    # ----------------------------------------------------------------------
+    def test_http_server(self):
+        server = start_http_server(0, exporter=OpenMetricsExporter(self.handlers))
+        try:
+            response = urlopen('http://127.0.0.1:{}/metrics'.format(server.server_port))
+            self.assertEqual(CONTENT_TYPE, response.info()['Content-Type'])
+            self.assertIn(b'eventlog_worker_events_total{handler="app"', response.read())
+        finally:
+            server.shutdown()
+            server.server_close()
+
+    # ----------------------------------------------------------------------
+    @unittest.skipIf(sys.version_info < (3, 7), 'ASGI application requires Python 3.7')
+    def test_asgi_app(self):
+        import asyncio
+        from log_async.openmetrics import make_asgi_app
+        app = make_asgi_app(OpenMetricsExporter(self.handlers))
+        messages = []
+
+        async def receive():
+            return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+        async def send(message):
+            messages.append(message)
+
+        asyncio.run(app({'type': 'http', 'method': 'GET', 'path': '/metrics'}, receive, send))
+        self.assertEqual(200, messages[0]['status'])
+        self.assertIn((b'content-type', CONTENT_TYPE.encode('ascii')), messages[0]['headers'])
+        self.assertTrue(messages[1]['body'].endswith(b'# EOF\n'))
@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+#
+# This software may be modified and distributed under the terms
+# of the MIT license.  See the LICENSE file for details.
+
+import pstats
+import unittest
+
+from log_async.hooks import HookRegistry
+from log_async.memory_cache import MemoryCache
+from log_async.profiling import TimingSampler, WorkerProfiler
+from log_async.worker import LogProcessingWorker
+
+
+class FakeClock(object):
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class NullTransport(object):
+
+    def send(self, events):
+        pass
+
+    def close(self):
+        pass
+
+
+class TimingSamplerTest(unittest.TestCase):
+
+    # ----------------------------------------------------------------------
+    def test_summaries(self):
+        registry = HookRegistry()
+        clock = FakeClock()
+        summaries = []
+        sampler = TimingSampler(
+            interval=10, output=summaries.append, registry=registry, clock=clock)
+        sampler.start()
+        registry.on_claim(['a', 'b'], 0.002)
+        registry.on_send_end(['a', 'b'], 0.004, None)
+        registry.on_send_end(['a', 'b'], 0.002, IOError())
+        registry.on_drop(3, 'expired')
+        self.assertEqual([], summaries)
+        clock.now = 10
+        registry.on_requeue(['a', 'b'], IOError())
+        self.assertEqual(1, len(summaries))
+        self.assertIn(u'over 10.0s', summaries[0])
+        self.assertIn(u'claim n=1 avg=2.00ms max=2.00ms events=2', summaries[0])
+        self.assertIn(u'send n=2 avg=3.00ms max=4.00ms events=4 errors=1', summaries[0])
+        self.assertIn(u'requeued=2; dropped=3', summaries[0])
+        sampler.stop()
+        self.assertIsNone(registry.on_claim)
+        self.assertIn(u'send n=0', summaries[1])
+
+
+class WorkerProfilerTest(unittest.TestCase):
+
+    # ----------------------------------------------------------------------
+    def test_profile_worker_thread(self):
+        worker = LogProcessingWorker(
+            host='localhost', port=5959, transport=NullTransport(), ssl_enable=False,
+            ssl_verify=True, keyfile=None, certfile=None, ca_certs=None,
+            buffer=MemoryCache({}))
+        profiler = WorkerProfiler(memory=True)
+        # the worker thread is not running
+        self.assertFalse(worker.set_profiler(profiler, timeout=0.1))
+        worker.start()
+        try:
+            self.assertTrue(worker.set_profiler(profiler, timeout=5))
+            worker.enqueue_event('event')
+            worker.force_flush_queued_events()
+            self.assertTrue(worker.set_profiler(None, timeout=5))
+        finally:
+            worker.shutdown()
+            worker.join()
+        self.assertIsNotNone(profiler.profile)
+        self.assertIsNotNone(profiler.snapshot)
+        # only the worker thread was profiled
+        functions = [function for _, _, function in pstats.Stats(profiler.profile).stats]
+        self.assertIn('add_event', functions)
+        self.assertNotIn('test_profile_worker_thread', functions)
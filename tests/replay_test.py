@@ -0,0 +1,281 @@
+# -*- coding: utf-8 -*-
+#
+# This software may be modified and distributed under the terms
+# of the MIT license.  See the LICENSE file for details.
+
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import unittest
+
+from six.moves import StringIO
+
+from log_async.database import DatabaseCache, DatabaseLockedError
+from log_async.replay import (
+    LOCKED_RETRY_DELAY,
+    main,
+    PENDING_CLAIMED,
+    PENDING_REPLAY,
+    ReplayBuffer,
+    Replayer,
+    ReplayError,
+    ReplaySpoolFile,
+)
+from log_async.spool import DeadLetterSpool, read_spool_file, REASON_REJECTED
+from log_async.testing import (
+    FaultInjectingTransport,
+    PartialWrite,
+    RecordingTransport,
+    Refused,
+    VirtualClock,
+)
+from log_async.transport import RejectedEventError
+
+
+class LockedBuffer(ReplayBuffer):
+    """The first claims fail as the process using the file holds the lock"""
+
+    def __init__(self, path, locked):
+        super(LockedBuffer, self).__init__(path)
+        self.locked = locked
+        self.locked_claims = 0
+
+    def claim(self, limit):
+        if self.locked_claims < self.locked:
+            self.locked_claims += 1
+            raise DatabaseLockedError()
+        return super(LockedBuffer, self).claim(limit)
+
+
+class ReplayTest(unittest.TestCase):
+
+    # ----------------------------------------------------------------------
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'buffer.db')
+        self.cache = DatabaseCache(self.path)
+        for index in range(1000):
+            self.cache.add_event(u'event-{}'.format(index))
+        self.server = RecordingTransport()
+
+    # ----------------------------------------------------------------------
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    # ----------------------------------------------------------------------
+    def _count(self, pending_delete):
+        with self.cache._connect() as connection:
+            return connection.execute(
+                'SELECT COUNT(*) FROM `event` WHERE `pending_delete` = ?;',
+                (pending_delete,)).fetchone()[0]
+
+    # ----------------------------------------------------------------------
+    def _interrupt_replay(self):
+        # the events claimed for replay belong to a process which exited
+        process = subprocess.Popen([sys.executable, '-c', ''])
+        process.wait()
+        owner = u'{}:{}:token'.format(socket.gethostname(), process.pid)
+        with self.cache._connect() as connection:
+            connection.execute('UPDATE `event` SET `replay_owner` = ? WHERE `pending_delete` = ?;',
+                               (owner, PENDING_REPLAY))
+
+    # ----------------------------------------------------------------------
+    def test_replay(self):
+        replayer = Replayer(lambda: self.server, connections=3, batch_size=64)
+        self.assertEqual(1000, replayer.replay(self.path))
+        self.assertEqual(1000, len(self.server.counts))
+        self.assertEqual(0, self.server.duplicates)
+        self.assertEqual(0, ReplayBuffer(self.path).count_queued())
+        self.assertEqual(0, self._count(PENDING_REPLAY))
+
+    # ----------------------------------------------------------------------
+    def test_shared_with_process(self):
+        # events claimed by the worker of the process using the file are left alone
+        claimed = self.cache.get_queued_events(limit=100)
+        replayer = Replayer(lambda: self.server, batch_size=64)
+        self.assertEqual(900, replayer.replay(self.path))
+        self.assertEqual(100, self._count(PENDING_CLAIMED))
+        self.cache.delete_events(claimed)
+        self.assertEqual([], self.cache.get_queued_events())
+
+    # ----------------------------------------------------------------------
+    def test_resume(self):
+        # an interrupted replay left claimed events behind, as did a process which exited
+        buffer = ReplayBuffer(self.path)
+        buffer.claim(100)
+        self._interrupt_replay()
+        self.cache.get_queued_events(limit=100)
+        self.assertEqual(800, buffer.count_queued())
+
+        self.assertEqual(900, Replayer(lambda: self.server).replay(self.path))
+        self.assertEqual(100, Replayer(lambda: self.server, reclaim=True).replay(self.path))
+        self.assertEqual(1000, len(self.server.counts))
+        self.assertEqual(0, self.server.duplicates)
+
+    # ----------------------------------------------------------------------
+    def test_concurrent_replay(self):
+        # the events claimed by a replay which is still running are left alone
+        running = ReplayBuffer(self.path)
+        claimed = running.claim(100)
+        self.assertEqual(900, Replayer(lambda: self.server).replay(self.path))
+        self.assertEqual(100, self._count(PENDING_REPLAY))
+        running.delete_events(claimed)
+        self.assertEqual(0, ReplayBuffer(self.path).count_queued())
+        self.assertEqual(0, self.server.duplicates)
+
+    # ----------------------------------------------------------------------
+    @unittest.skipUnless(hasattr(time, 'process_time'), 'time.process_time is not available')
+    def test_backoff_does_not_spin(self):
+        def create_transport():
+            return FaultInjectingTransport(self.server, [(0, None, Refused())])
+
+        replayer = Replayer(create_transport, connections=1, batch_size=1000, max_failures=2,
+                            backoff_initial=0.5)
+        start, cpu_start = time.time(), time.process_time()
+        self.assertRaises(ReplayError, replayer.replay, self.path)
+        self.assertGreaterEqual(time.time() - start, 0.5)
+        self.assertLess(time.process_time() - cpu_start, 0.25)
+
+    # ----------------------------------------------------------------------
+    def test_locked_claim_is_retried_after_delay(self):
+        buffer = LockedBuffer(self.path, locked=3)
+        start = time.time()
+        self.assertEqual(1000, Replayer(lambda: self.server)._replay(buffer))
+        self.assertEqual(3, buffer.locked_claims)
+        self.assertGreaterEqual(time.time() - start, 3 * LOCKED_RETRY_DELAY)
+
+    # ----------------------------------------------------------------------
+    def test_failures(self):
+        def create_transport():
+            return FaultInjectingTransport(self.server, [(0, None, Refused())])
+
+        replayer = Replayer(create_transport, connections=2, batch_size=64, max_failures=3,
+                            backoff_initial=0)
+        self.assertRaises(ReplayError, replayer.replay, self.path)
+        # the unsent events were queued again
+        self.assertEqual(1000, ReplayBuffer(self.path).count_queued())
+        self.assertEqual([], self.server.events)
+
+    # ----------------------------------------------------------------------
+    def test_partial_send(self):
+        clock = VirtualClock()
+
+        def send_count():
+            clock.advance(1)
+            return clock()
+
+        # the first sends fail after half of the batch, which still makes progress
+        transport = FaultInjectingTransport(
+            self.server, [(0, 5, PartialWrite())], clock=send_count)
+        replayer = Replayer(lambda: transport, connections=1, batch_size=64, backoff_initial=0)
+        self.assertEqual(1000, replayer.replay(self.path))
+        self.assertEqual(4, sum(transport.injected.values()))
+        self.assertEqual(1000, len(self.server.counts))
+        self.assertEqual(0, self.server.duplicates)
+
+    # ----------------------------------------------------------------------
+    def test_rate(self):
+        replayer = Replayer(lambda: self.server, batch_size=100, rate=4000)
+        start = time.time()
+        replayer.replay(self.path)
+        # the first batch is sent at once
+        self.assertGreaterEqual(time.time() - start, 900 / 4000.0)
+
+    # ----------------------------------------------------------------------
+    def test_missing_file(self):
+        path = os.path.join(self.directory, 'missing.db')
+        self.assertRaises(ReplayError, Replayer(lambda: self.server).replay, path)
+        self.assertFalse(os.path.exists(path))
+
+    # ----------------------------------------------------------------------
+    def test_main_dry_run(self):
+        stdout, sys.stdout = sys.stdout, StringIO()
+        try:
+            self.assertEqual(0, main([self.path, '--dry-run']))
+        finally:
+            stdout, sys.stdout = sys.stdout, stdout
+        self.assertEqual(u'{}: 1000 events queued\n'.format(self.path), stdout.getvalue())
+
+
+class RejectingTransport(RecordingTransport):
+    """Rejects the events starting with `rejected`"""
+
+    def send(self, events):
+        for sent, event in enumerate(events):
+            if event.startswith(b'rejected'):
+                super(RejectingTransport, self).send(events[:sent])
+                raise RejectedEventError(IOError('message too long'), sent)
+        super(RejectingTransport, self).send(events)
+
+
+class ReplaySpoolTest(unittest.TestCase):
+
+    # ----------------------------------------------------------------------
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.spool = DeadLetterSpool(self.directory, max_file_size=1000, block_size=100)
+        for index in range(300):
+            self.spool.add(b'event-%d' % index, 'overflow')
+        self.spool.close()
+        self.server = RecordingTransport()
+
+    # ----------------------------------------------------------------------
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    # ----------------------------------------------------------------------
+    def test_replay(self):
+        # a process exited while writing a file
+        crashed = DeadLetterSpool(self.directory, block_size=1)
+        crashed.add(b'event-300', 'expired')
+
+        replayer = Replayer(lambda: self.server, connections=2, batch_size=16)
+        self.assertEqual(300, replayer.replay(self.directory))
+        self.assertEqual([b'event-%d' % index for index in range(300)],
+                         sorted(self.server.events, key=lambda event: int(event[6:])))
+        self.assertEqual(1, len(os.listdir(self.directory)))
+        self.assertEqual(1, Replayer(lambda: self.server, reclaim=True).replay(self.directory))
+        self.assertEqual([], os.listdir(self.directory))
+        self.assertEqual(0, self.server.duplicates)
+
+    # ----------------------------------------------------------------------
+    def test_resume(self):
+        path = os.path.join(self.directory, sorted(os.listdir(self.directory))[0])
+        spool_file = ReplaySpoolFile(path)
+        self.assertEqual(len(list(read_spool_file(path))), spool_file.count_queued())
+        first, second, third = [spool_file.claim(10) for _ in range(3)]
+        self.assertEqual((0, b'event-0'), first[0])
+        # the progress only advances over events sent in order
+        spool_file.delete_events(second)
+        self.assertEqual(0, ReplaySpoolFile(path).claim(1)[0][0])
+        spool_file.delete_events(first)
+        self.assertEqual((20, b'event-20'), ReplaySpoolFile(path).claim(1)[0])
+
+    # ----------------------------------------------------------------------
+    def test_rejected_events_are_spooled(self):
+        buffer_path = os.path.join(self.directory, 'buffer.db')
+        cache = DatabaseCache(buffer_path)
+        for event in (b'a', b'rejected', b'b'):
+            cache.add_event(event)
+        spool = DeadLetterSpool(os.path.join(self.directory, 'rejected'), block_size=1)
+        replayer = Replayer(RejectingTransport, batch_size=10, max_failures=1, spool=spool)
+        self.assertEqual(2, replayer.replay(buffer_path))
+        spool.close()
+        rejected_path, = [os.path.join(spool.directory, name)
+                          for name in os.listdir(spool.directory)]
+        self.assertEqual([(REASON_REJECTED, b'rejected')],
+                         [(reason, event) for reason, _, event in read_spool_file(rejected_path)])
+        self.assertEqual(0, ReplayBuffer(buffer_path).count_queued())
+
+    # ----------------------------------------------------------------------
+    def test_main_dry_run(self):
+        stdout, sys.stdout = sys.stdout, StringIO()
+        try:
+            self.assertEqual(0, main([self.directory, '--dry-run']))
+        finally:
+            stdout, sys.stdout = sys.stdout, stdout
+        self.assertEqual(u'{}: 300 events queued\n'.format(self.directory), stdout.getvalue())
@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+#
+# This software may be modified and distributed under the terms
+# of the MIT license.  See the LICENSE file for details.
+
+import unittest
+
+from log_async.scheduler import MaintenanceScheduler
+
+
+class FakeClock(object):
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class MaintenanceSchedulerTest(unittest.TestCase):
+
+    # ----------------------------------------------------------------------
+    def setUp(self):
+        self.clock = FakeClock()
+        self.scheduler = MaintenanceScheduler(clock=self.clock)
+        self.calls = []
+
+    # ----------------------------------------------------------------------
+    def _add(self, name, interval, priority, duration=0.0):
+        def callback():
+            self.calls.append(name)
+            self.clock.now += duration
+        self.scheduler.add(name, interval, callback, priority)
+
+    # ----------------------------------------------------------------------
+    def test_independent_intervals(self):
+        self._add('expire', 30, priority=1)
+        self._add('flush', 10, priority=0)
+        self.assertEqual([], self.scheduler.run_due())
+        self.assertEqual(10, self.scheduler.time_until_next())
+        self.clock.now = 10
+        self.assertEqual(['flush'], self.scheduler.run_due())
+        self.clock.now = 30
+        self.assertEqual(['flush', 'expire'], self.scheduler.run_due())
+
+    # ----------------------------------------------------------------------
+    def test_budget(self):
+        self._add('flush', 1, priority=0, duration=0.4)
+        self._add('stats', 1, priority=2, duration=0.4)
+        self._add('expire', 1, priority=1, duration=0.4)
+        self.clock.now = 1
+        self.assertEqual(['flush', 'expire'], self.scheduler.run_due(budget=0.5))
+        self.assertEqual(0, self.scheduler.time_until_next())
+        self.assertEqual(['stats'], self.scheduler.run_due(budget=0.5))
+
+    # ----------------------------------------------------------------------
+    def test_reset_and_callable_interval(self):
+        interval = [10]
+        self.scheduler.add('flush', lambda: interval[0], lambda: None)
+        self.clock.now = 8
+        self.scheduler.reset('flush')
+        self.clock.now = 12
+        self.assertFalse(self.scheduler.is_due('flush'))
+        interval[0] = 2
+        self.assertTrue(self.scheduler.is_due('flush'))
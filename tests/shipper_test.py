@@ -0,0 +1,149 @@
+# -*- coding: utf-8 -*-
+#
+# This software may be modified and distributed under the terms
+# of the MIT license.  See the LICENSE file for details.
+
+import logging
+import multiprocessing
+import socket
+import sys
+import threading
+import unittest
+
+from log_async.handler import AsynchronousLogHandler
+from log_async.stats import lookup
+
+
+@unittest.skipIf(sys.version_info < (3, 8), 'multiprocessing.shared_memory requires Python 3.8')
+class SharedMemoryRingBufferTest(unittest.TestCase):
+
+    # ----------------------------------------------------------------------
+    def setUp(self):
+        from log_async.shipper import SharedMemoryRingBuffer
+        self.ring = SharedMemoryRingBuffer(size=64)
+
+    # ----------------------------------------------------------------------
+    def tearDown(self):
+        self.ring.close()
+
+    # ----------------------------------------------------------------------
+    def test_put_get(self):
+        self.assertTrue(self.ring.put(b'first'))
+        self.assertTrue(self.ring.put(b'second'))
+        self.assertEqual([b'first', b'second'], self.ring.get_all())
+        self.assertEqual([], self.ring.get_all())
+        self.assertEqual(0, self.ring.used_bytes())
+
+    # ----------------------------------------------------------------------
+    def test_wrap_around(self):
+        for i in range(20):
+            event = 'event {:02d}'.format(i).encode('ascii') * 2
+            self.assertTrue(self.ring.put(event))
+            self.assertEqual([event], self.ring.get_all())
+
+    # ----------------------------------------------------------------------
+    def test_full(self):
+        self.assertTrue(self.ring.put(b'x' * 40))
+        self.assertFalse(self.ring.put(b'y' * 40))
+        self.assertEqual([b'x' * 40], self.ring.get_all())
+        self.assertTrue(self.ring.put(b'y' * 40))
+
+    # ----------------------------------------------------------------------
+    def test_attach_by_name(self):
+        from log_async.shipper import SharedMemoryRingBuffer
+        other = SharedMemoryRingBuffer(name=self.ring.name, lock=self.ring.lock)
+        self.ring.put(b'shared')
+        self.assertEqual([b'shared'], other.get_all())
+        other.close()
+
+
+class TcpSink(threading.Thread):
+
+    def __init__(self):
+        super(TcpSink, self).__init__()
+        self.daemon = True
+        self.data = b''
+        self.server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.server.bind(('127.0.0.1', 0))
+        self.server.listen(5)
+        self.server.settimeout(30)
+        self.port = self.server.getsockname()[1]
+
+    def run(self):
+        try:
+            while self.data.count(b'\n') < 3:
+                client, _ = self.server.accept()
+                while True:
+                    chunk = client.recv(65536)
+                    if not chunk:
+                        break
+                    self.data += chunk
+                client.close()
+        finally:
+            self.server.close()
+
+
+class StuckProcess(object):
+    """Shipper process which does not exit until told to"""
+
+    def __init__(self):
+        self.alive = True
+
+    def join(self, timeout=None):
+        pass
+
+    def is_alive(self):
+        return self.alive
+
+
+@unittest.skipIf(sys.version_info < (3, 8), 'multiprocessing.shared_memory requires Python 3.8')
+class ShipperClientTest(unittest.TestCase):
+
+    # ----------------------------------------------------------------------
+    def test_join_timeout_keeps_ring(self):
+        from log_async.shipper import ShipperClient
+        client = ShipperClient(ring_size=64, worker_kwargs={})
+        process = client._process = StuckProcess()
+        client.shutdown()
+        self.assertFalse(client.join(0.01))
+        self.assertTrue(client.is_alive())
+        # the shipper process can still read the ring buffer
+        self.assertTrue(client._ring.put(b'event'))
+        self.assertEqual([b'event'], client._ring.get_all())
+        process.alive = False
+        self.assertTrue(client.join(0.01))
+        self.assertFalse(client.is_alive())
+        self.assertTrue(client.join(0.01))
+
+
+@unittest.skipIf(sys.version_info < (3, 8), 'multiprocessing.shared_memory requires Python 3.8')
+class ShipperHandlerTest(unittest.TestCase):
+
+    # ----------------------------------------------------------------------
+    def test_events_are_sent_by_shipper_process(self):
+        sink = TcpSink()
+        sink.start()
+        handler = AsynchronousLogHandler('127.0.0.1', sink.port, shipper=True)
+        for i in range(3):
+            handler.emit(logging.LogRecord(
+                'test', logging.INFO, __file__, 1, 'shipped %s', (i,), None))
+        self.assertEqual(3, lookup(handler.get_stats(), 'shipper_events_total'))
+        handler.shutdown()
+        sink.join(30)
+        for i in range(3):
+            self.assertIn('shipped {}'.format(i).encode('ascii'), sink.data)
+
+    # ----------------------------------------------------------------------
+    def test_spawn_start_method(self):
+        # the default start method is 'forkserver' since Python 3.14, the worker arguments
+        # are not picklable though
+        start_method = multiprocessing.get_start_method(allow_none=True)
+        multiprocessing.set_start_method('spawn', force=True)
+        try:
+            self.test_events_are_sent_by_shipper_process()
+        finally:
+            multiprocessing.set_start_method(start_method, force=True)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,200 @@
+# -*- coding: utf-8 -*-
+#
+# This software may be modified and distributed under the terms
+# of the MIT license.  See the LICENSE file for details.
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from log_async.database import DatabaseCache
+from log_async.handler import AsynchronousLogHandler
+from log_async.memory_cache import MemoryCache
+from log_async.spool import (
+    DeadLetterSpool,
+    read_spool_file,
+    REASON_EXPIRED,
+    REASON_OVERFLOW,
+    REASON_REJECTED,
+    REPLAYING_SUFFIX,
+    SPOOL_SUFFIX,
+    WRITING_SUFFIX,
+)
+from log_async.stats import lookup
+from log_async.testing import RecordingTransport
+
+
+class DeadLetterSpoolTest(unittest.TestCase):
+
+    # ----------------------------------------------------------------------
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    # ----------------------------------------------------------------------
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    # ----------------------------------------------------------------------
+    def _files(self, suffix=SPOOL_SUFFIX):
+        return sorted(os.path.join(self.directory, name)
+                      for name in os.listdir(self.directory) if name.endswith(suffix))
+
+    # ----------------------------------------------------------------------
+    def _read_all(self):
+        return [(reason, event) for path in self._files()
+                for reason, _, event in read_spool_file(path)]
+
+    # ----------------------------------------------------------------------
+    def test_add_and_read(self):
+        spool = DeadLetterSpool(self.directory, block_size=100)
+        spool.add(b'\x00binary\xff', REASON_OVERFLOW)
+        spool.add(u'text \xe4', REASON_EXPIRED)
+        for i in range(50):
+            spool.add(b'event %d' % i, REASON_REJECTED)
+        # full blocks were written to the file being written, the rest is held in memory
+        self.assertEqual([], self._files())
+        self.assertEqual(1, len(self._files(WRITING_SUFFIX)))
+        spool.close()
+
+        self.assertEqual([], self._files(WRITING_SUFFIX))
+        events = self._read_all()
+        self.assertEqual((REASON_OVERFLOW, b'\x00binary\xff'), events[0])
+        self.assertEqual((REASON_EXPIRED, u'text \xe4'.encode('utf-8')), events[1])
+        self.assertEqual([(REASON_REJECTED, b'event %d' % i) for i in range(50)], events[2:])
+        stats = spool.get_stats()
+        self.assertEqual(50, lookup(stats, 'spool_rejected_total'))
+        self.assertEqual(1, lookup(stats, 'spool_overflow_total'))
+        self.assertGreater(lookup(stats, 'written_bytes_total'), 0)
+
+    # ----------------------------------------------------------------------
+    def test_flush_interval(self):
+        spool = DeadLetterSpool(self.directory, flush_interval=0)
+        spool.add(b'event', REASON_OVERFLOW)
+        path, = self._files(WRITING_SUFFIX)
+        self.assertEqual([(REASON_OVERFLOW, b'event')],
+                         [(reason, event) for reason, _, event in read_spool_file(path)])
+
+    # ----------------------------------------------------------------------
+    def test_rotation(self):
+        spool = DeadLetterSpool(self.directory, max_file_size=200, block_size=1)
+        for i in range(20):
+            spool.add(os.urandom(100), REASON_OVERFLOW)
+        spool.close()
+        self.assertEqual(10, len(self._files()))
+        self.assertEqual(20, len(self._read_all()))
+
+    # ----------------------------------------------------------------------
+    def test_max_total_size(self):
+        spool = DeadLetterSpool(self.directory, max_file_size=200, max_total_size=1000,
+                                block_size=1)
+        for i in range(40):
+            spool.add(b'%d' % i + os.urandom(100), REASON_OVERFLOW)
+        spool.close()
+        self.assertLessEqual(sum(os.path.getsize(path) for path in self._files()), 1000)
+        # the oldest files were deleted
+        events = self._read_all()
+        self.assertEqual(b'39', events[-1][1][:2])
+        self.assertLess(len(events), 40)
+        self.assertGreater(lookup(spool.get_stats(), 'deleted_files_total'), 0)
+
+        # files being replayed are not deleted, new events are dropped instead
+        for path in self._files():
+            os.rename(path, path + REPLAYING_SUFFIX)
+        spool.add(os.urandom(1000), REASON_OVERFLOW)
+        spool.close()
+        self.assertEqual([], self._files())
+        self.assertEqual(1, lookup(spool.get_stats(), 'spool_dropped_total'))
+
+    # ----------------------------------------------------------------------
+    def test_truncated_file(self):
+        spool = DeadLetterSpool(self.directory, block_size=1)
+        for i in range(3):
+            spool.add(b'event %d' % i, REASON_OVERFLOW)
+        spool.close()
+        path, = self._files()
+        with open(path, 'r+b') as spool_file:
+            spool_file.truncate(os.path.getsize(path) - 20)
+        self.assertEqual([b'event 0', b'event 1'],
+                         [event for _, _, event in read_spool_file(path)])
+
+
+class CacheSpoolTest(unittest.TestCase):
+
+    # ----------------------------------------------------------------------
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.spool = DeadLetterSpool(os.path.join(self.directory, 'spool'))
+
+    # ----------------------------------------------------------------------
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    # ----------------------------------------------------------------------
+    def _spooled(self):
+        self.spool.close()
+        directory = self.spool.directory
+        return [(reason, event) for name in sorted(os.listdir(directory))
+                for reason, _, event in read_spool_file(os.path.join(directory, name))]
+
+    # ----------------------------------------------------------------------
+    def test_memory_cache(self):
+        now = [1000000.0]
+        cache = MemoryCache({}, event_ttl=100, max_size=2, clock=lambda: now[0],
+                            spool=self.spool)
+        for event in ('a', 'b', 'c'):
+            cache.add_event(event)
+        now[0] += 200
+        self.assertEqual(2, cache.expire_events())
+        self.assertEqual(
+            [(REASON_OVERFLOW, b'c'), (REASON_EXPIRED, b'a'), (REASON_EXPIRED, b'b')],
+            sorted(self._spooled(), key=lambda event: (event[0] != REASON_OVERFLOW, event)))
+
+    # ----------------------------------------------------------------------
+    def test_database_cache(self):
+        cache = DatabaseCache(os.path.join(self.directory, 'buffer.db'), event_ttl=100,
+                              max_size=2, spool=self.spool)
+        for event in ('a', 'b', 'c'):
+            cache.add_event(event)
+        with cache._connect() as connection:
+            connection.execute(
+                "UPDATE `event` SET `entry_date` = datetime('now', '-200 seconds') "
+                "WHERE `event_text` = 'a';")
+        self.assertEqual(1, cache.expire_events())
+        self.assertEqual([(REASON_OVERFLOW, b'c'), (REASON_EXPIRED, b'a')], self._spooled())
+        self.assertEqual(['b'], [event['event_text'] for event in cache.get_queued_events()])
+
+    # ----------------------------------------------------------------------
+    def test_in_flight_events_are_not_expired(self):
+        now = [1000000.0]
+        memory_cache = MemoryCache({}, event_ttl=100, clock=lambda: now[0], spool=self.spool)
+        database_cache = DatabaseCache(os.path.join(self.directory, 'buffer.db'),
+                                       event_ttl=100, spool=self.spool)
+        for cache in (memory_cache, database_cache):
+            cache.add_event('in flight')
+            self.assertEqual(1, len(cache.get_queued_events()))
+            cache.add_event('queued')
+        with database_cache._connect() as connection:
+            connection.execute(
+                "UPDATE `event` SET `entry_date` = datetime('now', '-200 seconds');")
+        now[0] += 200
+        self.assertEqual(1, memory_cache.expire_events())
+        self.assertEqual(1, database_cache.expire_events())
+        self.assertEqual([(REASON_EXPIRED, b'queued')] * 2, self._spooled())
+        # the events in flight are deleted once sent
+        for cache in (memory_cache, database_cache):
+            cache.delete_queued_events()
+            self.assertEqual([], cache.get_queued_events())
+
+    # ----------------------------------------------------------------------
+    def test_handler(self):
+        handler = AsynchronousLogHandler(
+            'localhost', 5959, transport=RecordingTransport(), event_ttl=100, spool=self.spool)
+        self.assertIs(self.spool, handler._buffer.spool)
+        handler._buffer.spool.add(b'event', REASON_OVERFLOW)
+        self.assertEqual(1, lookup(handler.get_stats(), 'eventlog_spool_overflow_total'))
+        handler.shutdown()
+        # the spool was closed, so its file can be replayed
+        self.assertEqual([], [name for name in os.listdir(self.spool.directory)
+                              if name.endswith(WRITING_SUFFIX)])
+        self.assertEqual([(REASON_OVERFLOW, b'event')], self._spooled())
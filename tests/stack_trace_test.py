@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+#
+# This software may be modified and distributed under the terms
+# of the MIT license.  See the LICENSE file for details.
+
+import sys
+import unittest
+
+from log_async.stack_trace import fingerprint_exception, StackTraceCache
+
+
+def _raise_key_error(key):
+    return {}[key]
+
+
+def _exc_info(func, *args):
+    try:
+        func(*args)
+    except Exception:
+        return sys.exc_info()
+
+
+class StackTraceCacheTest(unittest.TestCase):
+
+    # ----------------------------------------------------------------------
+    def test_fingerprint_ignores_message(self):
+        first = fingerprint_exception(*_exc_info(_raise_key_error, 'a'))
+        second = fingerprint_exception(*_exc_info(_raise_key_error, 'b'))
+        self.assertEqual(first, second)
+
+    # ----------------------------------------------------------------------
+    def test_fingerprint_differs_by_type(self):
+        first = fingerprint_exception(*_exc_info(_raise_key_error, 'a'))
+        second = fingerprint_exception(*_exc_info(int, 'x'))
+        self.assertNotEqual(first, second)
+
+    # ----------------------------------------------------------------------
+    def test_rendered_trace_is_cached(self):
+        cache = StackTraceCache(max_size=2)
+        _, trace1, repeats1, hit1 = cache.get(_exc_info(_raise_key_error, 'a'))
+        _, trace2, repeats2, hit2 = cache.get(_exc_info(_raise_key_error, 'a'))
+        self.assertFalse(hit1)
+        self.assertTrue(hit2)
+        self.assertEqual(trace1, trace2)
+        self.assertEqual((1, 1), (repeats1, repeats2))
+        # different message, different rendering
+        _, trace3, _, hit3 = cache.get(_exc_info(_raise_key_error, 'b'))
+        self.assertFalse(hit3)
+        self.assertIn("KeyError: 'b'", trace3)
+
+    # ----------------------------------------------------------------------
+    def test_cache_is_bounded(self):
+        cache = StackTraceCache(max_size=2)
+        for key in range(5):
+            cache.get(_exc_info(_raise_key_error, key))
+        self.assertEqual(len(cache._rendered), 2)
+
+    # ----------------------------------------------------------------------
+    def test_dedup_window(self):
+        now = [100.0]
+        cache = StackTraceCache(max_size=10, dedup_window=60, clock=lambda: now[0])
+        results = [cache.get(_exc_info(_raise_key_error, 'a')) for _ in range(3)]
+        self.assertIsNotNone(results[0][1])
+        self.assertIsNone(results[1][1])
+        self.assertIsNone(results[2][1])
+        self.assertEqual([1, 2, 3], [result[2] for result in results])
+        # the window expired, the full trace is sent again
+        now[0] += 61
+        _, stack_trace, repeats, _ = cache.get(_exc_info(_raise_key_error, 'a'))
+        self.assertIsNotNone(stack_trace)
+        self.assertEqual(1, repeats)
+
+
+if __name__ == '__main__':
+    unittest.main()
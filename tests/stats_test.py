@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+#
+# This software may be modified and distributed under the terms
+# of the MIT license.  See the LICENSE file for details.
+
+from threading import Thread
+import sys
+import unittest
+
+from log_async.stats import Counter, Gauge, Histogram, LogStats, lookup
+
+
+class StatsTest(unittest.TestCase):
+
+    # ----------------------------------------------------------------------
+    def test_concurrent_increments(self):
+        counter = Counter('test_total')
+        # switch threads often to provoke lost updates
+        interval = sys.getswitchinterval() if hasattr(sys, 'getswitchinterval') else None
+        if interval is not None:
+            sys.setswitchinterval(1e-6)
+        try:
+            threads = [Thread(target=lambda: [counter.inc() for _ in range(10000)])
+                       for _ in range(8)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        finally:
+            if interval is not None:
+                sys.setswitchinterval(interval)
+        self.assertEqual(('test_total', 80000), counter.val())
+
+    # ----------------------------------------------------------------------
+    def test_gauge(self):
+        gauge = Gauge('test_gauge')
+        gauge.inc(5)
+        thread = Thread(target=gauge.dec, args=(2,))
+        thread.start()
+        thread.join()
+        self.assertEqual(3, gauge.value())
+        gauge.set(10)
+        self.assertEqual(10, gauge.value())
+        gauge.reset()
+        self.assertEqual(('test_gauge', 0), gauge.val())
+
+    # ----------------------------------------------------------------------
+    def test_log_stats(self):
+        stats = LogStats('test_')
+        stats.event(3)
+        stats.buffer(3)
+        stats.unbuffer(5)
+        stats.send(2)
+        values = stats.get_stats()
+        self.assertEqual(['test_events_total', 'test_discarded_total', 'test_buffered_events',
+                          'test_sent_total'], [name for name, _ in values])
+        self.assertEqual(3, lookup(values, 'events_total'))
+        self.assertEqual(0, lookup(values, 'buffered'))
+        self.assertEqual(2, lookup(values, 'sent'))
+
+    # ----------------------------------------------------------------------
+    def test_histogram(self):
+        histogram = Histogram('test_seconds', buckets=(0.1, 1))
+        threads = [Thread(target=histogram.observe, args=(value,)) for value in (0.05, 0.1, 2)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        histogram.observe(0.5)
+        self.assertEqual([('test_seconds_bucket{le="0.1"}', 2),
+                          ('test_seconds_bucket{le="1"}', 3),
+                          ('test_seconds_bucket{le="+Inf"}', 4),
+                          ('test_seconds_count', 4)],
+                         histogram.samples()[:-1])
+        self.assertAlmostEqual(2.65, lookup(histogram.samples(), 'test_seconds_sum'))
+        histogram.reset()
+        self.assertEqual(0, lookup(histogram.samples(), 'test_seconds_count'))
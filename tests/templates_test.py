@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+#
+# This software may be modified and distributed under the terms
+# of the MIT license.  See the LICENSE file for details.
+
+from datetime import date, datetime
+from decimal import Decimal
+import json
+import logging
+import unittest
+
+from log_async.formatter import LogstashFormatter
+from log_async.templates import TemplateDecoder, TemplateRegistry
+
+
+class TemplateEncodingTest(unittest.TestCase):
+
+    # ----------------------------------------------------------------------
+    def _format(self, formatter, msg, args):
+        record = logging.LogRecord('test', logging.INFO, __file__, 1, msg, args, None)
+        return json.loads(formatter.format(record).decode('utf-8'))
+
+    # ----------------------------------------------------------------------
+    def test_registry_refresh(self):
+        now = [0.0]
+        registry = TemplateRegistry(refresh_interval=10, clock=lambda: now[0])
+        id1, send1 = registry.lookup('user %s logged in')
+        id2, send2 = registry.lookup('user %s logged in')
+        self.assertEqual(id1, id2)
+        self.assertEqual((True, False), (send1, send2))
+        now[0] = 11
+        self.assertTrue(registry.lookup('user %s logged in')[1])
+        self.assertFalse(registry.lookup('user %s logged in')[1])
+
+    # ----------------------------------------------------------------------
+    def test_roundtrip(self):
+        formatter = LogstashFormatter(template_encoding=True)
+        decoder = TemplateDecoder()
+        events = [
+            self._format(formatter, 'user %s has %d items', ('alice', 1)),
+            self._format(formatter, 'user %s has %d items', ('bob', 2)),
+            self._format(formatter, '%(name)s done', ({'name': 'job'},)),
+            self._format(formatter, 'no arguments', None),
+        ]
+        self.assertIn('message_template', events[0]['extra'])
+        self.assertNotIn('message_template', events[1]['extra'])
+        self.assertNotIn('message', events[1])
+        messages = [decoder.decode(event)['message'] for event in events]
+        self.assertEqual(
+            ['user alice has 1 items', 'user bob has 2 items', 'job done', 'no arguments'],
+            messages)
+
+    # ----------------------------------------------------------------------
+    def test_roundtrip_matches_get_message(self):
+        formatter = LogstashFormatter(template_encoding=True)
+        decoder = TemplateDecoder()
+        cases = [
+            ('quoted %s', ('text',)),
+            ('number %d of %s', (3, Decimal('1.5'))),
+            ('float %.2f %s', (1.0 / 3, 2.5)),
+            ('repr %r', ('text',)),
+            ('hex %x %s', (255, True)),
+            ('decimal %d', (Decimal('2.5'),)),
+            ('date %s', (datetime(2020, 1, 2, 3, 4, 5),)),
+            ('object %s', (object(),)),
+            ('%(user)s at %(when)s', ({'user': u'\xe4', 'when': date(2020, 1, 2)},)),
+        ]
+        for msg, args in cases:
+            record = logging.LogRecord('test', logging.INFO, __file__, 1, msg, args, None)
+            event = json.loads(formatter.format(record).decode('utf-8'))
+            self.assertEqual(record.getMessage(), decoder.decode(event)['message'], msg)
+        # arguments which cannot be reproduced exactly are sent as message
+        event = self._format(formatter, 'repr %r', (Decimal('1.5'),))
+        self.assertEqual("repr Decimal('1.5')", event['message'])
+        self.assertNotIn('message_template_id', event['extra'])
+
+    # ----------------------------------------------------------------------
+    def test_roundtrip_truncated_message(self):
+        formatter = LogstashFormatter(template_encoding=True, max_string_length=20)
+        event = self._format(formatter, 'value %s', ('x' * 100,))
+        self.assertNotIn('message_template_id', event['extra'])
+        self.assertTrue(event['message'].startswith('value xxx'))
+
+    # ----------------------------------------------------------------------
+    def test_max_event_bytes(self):
+        formatter = LogstashFormatter(template_encoding=True, max_event_bytes=700)
+        decoder = TemplateDecoder()
+        # escaping makes the event exceed the limit after serialization
+        record = logging.LogRecord(
+            'test', logging.INFO, __file__, 1, 'user %s logged in', ('alice',), None)
+        record.payload = u'\x00' * 300
+        event = json.loads(formatter.format(record).decode('utf-8'))
+        self.assertTrue(event['extra']['truncated'])
+        self.assertEqual('user alice logged in', event['message'])
+        # the template was not sent, so it is announced with the next event
+        event = self._format(formatter, 'user %s logged in', ('bob',))
+        self.assertEqual('user %s logged in', event['extra']['message_template'])
+        self.assertEqual('user bob logged in', decoder.decode(event)['message'])
+        event = self._format(formatter, 'user %s logged in', ('carol',))
+        self.assertNotIn('message_template', event['extra'])
+        self.assertEqual('user carol logged in', decoder.decode(event)['message'])
+
+    # ----------------------------------------------------------------------
+    def test_unknown_template(self):
+        formatter = LogstashFormatter(template_encoding=True)
+        self._format(formatter, 'value %s', (1,))
+        decoder = TemplateDecoder()
+        event = decoder.decode(self._format(formatter, 'value %s', (2,)))
+        self.assertNotIn('message', event)
+        self.assertEqual(1, decoder.unknown_templates)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,153 @@
+# -*- coding: utf-8 -*-
+#
+# This software may be modified and distributed under the terms
+# of the MIT license.  See the LICENSE file for details.
+
+import socket
+import unittest
+
+from log_async.constants import constants
+from log_async.memory_cache import MemoryCache
+from log_async.testing import (
+    Blackhole,
+    Disconnect,
+    FaultInjectingTransport,
+    Latency,
+    PartialWrite,
+    RecordingTransport,
+    Refused,
+    SlowRead,
+    SoakTest,
+    VirtualClock,
+)
+from log_async.transport import PartialSendError
+
+
+class VirtualClockTest(unittest.TestCase):
+
+    # ----------------------------------------------------------------------
+    def test_advance(self):
+        clock = VirtualClock(start=10.0, epoch=1000.0)
+        self.assertEqual(10.0, clock())
+        self.assertEqual(1000.0, clock.time())
+        clock.advance(5)
+        clock.sleep(1.5)
+        self.assertEqual(16.5, clock())
+        self.assertEqual(1006.5, clock.time())
+
+
+class FaultInjectingTransportTest(unittest.TestCase):
+
+    # ----------------------------------------------------------------------
+    def setUp(self):
+        self.clock = VirtualClock()
+        self.server = RecordingTransport()
+
+    # ----------------------------------------------------------------------
+    def _create_transport(self, *schedule):
+        return FaultInjectingTransport(
+            self.server, schedule, clock=self.clock, sleep=self.clock.sleep)
+
+    # ----------------------------------------------------------------------
+    def test_schedule(self):
+        transport = self._create_transport((10, 20, Refused()), (30, None, Refused()))
+        transport.send(['a'])
+        self.clock.advance(10)
+        self.assertRaises(socket.error, transport.send, ['b'])
+        self.clock.advance(10)
+        transport.send(['c'])
+        self.clock.advance(100)
+        self.assertRaises(socket.error, transport.send, ['d'])
+        self.assertEqual(['a', 'c'], self.server.events)
+        self.assertEqual(2, transport.injected['refused'])
+
+    # ----------------------------------------------------------------------
+    def test_delays(self):
+        transport = self._create_transport((0, None, Latency(2)), (0, None, SlowRead(10)))
+        transport.send(['12345', '12345'])
+        self.assertEqual(3.0, self.clock())
+        self.assertEqual(['12345', '12345'], self.server.events)
+
+    # ----------------------------------------------------------------------
+    def test_partial_write(self):
+        transport = self._create_transport((0, None, PartialWrite(0.5)))
+        with self.assertRaises(PartialSendError) as context:
+            transport.send(['a', 'b', 'c', 'd'])
+        self.assertEqual(2, context.exception.sent)
+        self.assertEqual(['a', 'b'], self.server.events)
+
+    # ----------------------------------------------------------------------
+    def test_disconnect(self):
+        transport = self._create_transport((0, None, Disconnect(0.5)))
+        with self.assertRaises(socket.error) as context:
+            transport.send(['a', 'b', 'c', 'd'])
+        self.assertNotIsInstance(context.exception, PartialSendError)
+        self.assertEqual(['a', 'b'], self.server.events)
+
+    # ----------------------------------------------------------------------
+    def test_blackhole(self):
+        transport = self._create_transport((0, None, Blackhole(timeout=7)))
+        self.assertRaises(socket.timeout, transport.send, ['a'])
+        self.assertEqual(7, self.clock())
+        self.assertEqual([], self.server.events)
+
+
+class SoakTestTest(unittest.TestCase):
+
+    # ----------------------------------------------------------------------
+    def test_outage_and_recovery(self):
+        hour = 3600
+        soak = SoakTest(
+            schedule=[(hour, 1.5 * hour, Refused()),
+                      (2 * hour, 2.25 * hour, Blackhole()),
+                      (2.5 * hour, 2.75 * hour, PartialWrite()),
+                      (3 * hour, 3.5 * hour, Latency(1))],
+            rate=2, step=5)
+        result = soak.run(4 * hour)
+
+        # timeouts and latency advance the clock within steps, so the run may end a bit later
+        self.assertAlmostEqual(8 * hour, result.enqueued, delta=20)
+        self.assertEqual(0, result.lost)
+        self.assertEqual(0, result.duplicated)
+        # the backlog grew during the outage by the events of half an hour
+        self.assertGreater(result.max_backlog, hour * 0.9)
+        self.assertEqual(0, result.samples[-1]['backlog'])
+        # the backlog was sent at once after the circuit breaker closed again
+        self.assertGreater(result.peak_drain_rate, 10 * 2)
+        self.assertTrue(soak.worker.messages)
+
+    # ----------------------------------------------------------------------
+    def test_disconnect_duplicates(self):
+        soak = SoakTest(schedule=[(600, 1200, Disconnect())], rate=1, step=5)
+        result = soak.run(1800)
+        self.assertEqual(0, result.lost)
+        self.assertGreater(result.duplicated, 0)
+        self.assertEqual(result.duplicated, soak.server.duplicates)
+
+    # ----------------------------------------------------------------------
+    def test_expiry_in_simulated_time(self):
+        clock = VirtualClock()
+        cache = MemoryCache({}, event_ttl=1200, clock=clock.time)
+        soak = SoakTest(schedule=[(600, 3000, Refused())], rate=1, step=5, buffer=cache,
+                        clock=clock)
+        result = soak.run(3600)
+        # events older than the TTL when the server was reachable again were expired, the
+        # circuit breaker may retry up to its (jittered) maximum backoff after the outage
+        self.assertGreaterEqual(result.lost, 1200 - constants.MAINTENANCE_EXPIRE_INTERVAL)
+        slack = constants.CIRCUIT_BREAKER_BACKOFF_MAX + constants.MAINTENANCE_EXPIRE_INTERVAL
+        self.assertLessEqual(result.lost, 1200 + slack)
+        self.assertEqual(0, result.duplicated)
+        self.assertEqual(0, result.samples[-1]['backlog'])
+
+    # ----------------------------------------------------------------------
+    def test_pipeline(self):
+        saved = constants.QUEUED_EVENTS_PIPELINE_DEPTH
+        constants.QUEUED_EVENTS_PIPELINE_DEPTH = 2
+        try:
+            soak = SoakTest(schedule=[(600, 1200, Refused())], rate=5, step=5)
+            result = soak.run(1800)
+        finally:
+            constants.QUEUED_EVENTS_PIPELINE_DEPTH = saved
+        self.assertEqual(0, result.lost)
+        self.assertEqual(0, result.duplicated)
+        self.assertGreater(result.max_backlog, 0)
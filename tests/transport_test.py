@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+#
+# This software may be modified and distributed under the terms
+# of the MIT license.  See the LICENSE file for details.
+
+import errno
+import socket
+import unittest
+
+from log_async.stats import lookup
+from log_async.transport import PartialSendError, RejectedEventError, TcpTransport, UdpTransport
+
+
+class FailingSocket(object):
+
+    def __init__(self, fail_at):
+        self.data = []
+        self._fail_at = fail_at
+
+    def sendall(self, data):
+        if len(self.data) == self._fail_at:
+            raise socket.error('connection reset by peer')
+        self.data.append(data)
+
+    def close(self):
+        pass
+
+
+class TcpTransportTest(unittest.TestCase):
+
+    # ----------------------------------------------------------------------
+    def _create_transport(self, sock):
+        transport = TcpTransport('localhost', 5959, False, True, None, None, None)
+        transport._sock = sock
+        return transport
+
+    # ----------------------------------------------------------------------
+    def test_partial_send(self):
+        transport = self._create_transport(FailingSocket(fail_at=2))
+        with self.assertRaises(PartialSendError) as context:
+            transport.send([b'a', b'b', b'c', b'd'])
+        self.assertEqual(2, context.exception.sent)
+        self.assertIsInstance(context.exception.error, socket.error)
+        self.assertEqual(2, lookup(transport.get_stats(), 'sent_msgs'))
+
+    # ----------------------------------------------------------------------
+    def test_nothing_sent(self):
+        transport = self._create_transport(FailingSocket(fail_at=0))
+        with self.assertRaises(socket.error) as context:
+            transport.send([b'a', b'b'])
+        self.assertNotIsInstance(context.exception, PartialSendError)
+
+    # ----------------------------------------------------------------------
+    def test_batch_histograms(self):
+        transport = self._create_transport(FailingSocket(fail_at=3))
+        transport.send([b'ab', b'cde'])
+        transport._sock = FailingSocket(fail_at=1)
+        with self.assertRaises(PartialSendError):
+            transport.send([b'f', b'g'])
+        # only the successful batch is recorded
+        stats = transport.get_stats()
+        self.assertEqual(1, lookup(stats, 'batch_send_seconds_count'))
+        self.assertEqual(2, lookup(stats, 'batch_size_events_sum'))
+        self.assertEqual(5, lookup(stats, 'batch_size_bytes_sum'))
+
+
+class UdpTransportTest(unittest.TestCase):
+
+    # ----------------------------------------------------------------------
+    def test_oversized_datagram_is_rejected(self):
+        receiver = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        receiver.bind(('127.0.0.1', 0))
+        try:
+            transport = UdpTransport('127.0.0.1', receiver.getsockname()[1])
+            with self.assertRaises(RejectedEventError) as context:
+                transport.send([b'a', b'x' * 70000, b'b'])
+        finally:
+            receiver.close()
+        self.assertEqual(1, context.exception.sent)
+        self.assertEqual(errno.EMSGSIZE, context.exception.error.errno)
@@ -0,0 +1,524 @@
+# -*- coding: utf-8 -*-
+#
+# This software may be modified and distributed under the terms
+# of the MIT license.  See the LICENSE file for details.
+
+from threading import Event, Thread
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from log_async.cache import Cache
+from log_async.constants import constants
+from log_async.database import DatabaseCache
+from log_async.ingress import DequeIngressQueue
+from log_async.memory_cache import MemoryCache
+from log_async.stats import lookup
+from log_async.transport import PartialSendError, RejectedEventError
+from log_async.worker import LogProcessingWorker, SendPipeline
+
+
+class PartialFailureTransport(object):
+
+    def __init__(self, sent, error_class=PartialSendError):
+        self.sent = sent
+        self.error_class = error_class
+        self.events = []
+
+    def send(self, events):
+        if self.sent is not None:
+            sent, self.sent = self.sent, None
+            self.events.extend(events[:sent])
+            raise self.error_class(IOError('connection reset'), sent)
+        self.events.extend(events)
+
+    def close(self):
+        pass
+
+
+class RecordingSpool(object):
+
+    def __init__(self):
+        self.events = []
+
+    def add(self, event, reason):
+        self.events.append((event, reason))
+
+    def flush(self):
+        pass
+
+
+class BatchRecordingTransport(object):
+
+    def __init__(self, fail_first=0):
+        self.batches = []
+        self.fail_first = fail_first
+
+    def send(self, events):
+        if self.fail_first:
+            self.fail_first -= 1
+            raise IOError('connection refused')
+        self.batches.append(list(events))
+
+    def close(self):
+        pass
+
+
+class LegacyCache(Cache):
+    """Cache implementing the methods of log_async.Cache with their original arguments"""
+
+    def __init__(self):
+        self.events = []
+
+    def add_event(self, event):
+        self.events.append(event)
+
+    def get_queued_events(self):
+        events, self.events = self.events, []
+        return [{'event_text': event} for event in events]
+
+    def requeue_queued_events(self, events):
+        self.events[:0] = [event['event_text'] for event in events]
+
+    def delete_queued_events(self):
+        pass
+
+    def expire_events(self):
+        return 0
+
+    def get_stats(self):
+        return []
+
+
+class InterleavingQueue(DequeIngressQueue):
+    """Reads the sequence of the worker in another thread while a batch is taken"""
+
+    def __init__(self):
+        super(InterleavingQueue, self).__init__()
+        self.worker = None
+        self.sequences = []
+        self.readers = []
+
+    def get_batch(self, max_events=None):
+        events = super(InterleavingQueue, self).get_batch(max_events)
+        if events:
+            reader = Thread(target=lambda: self.sequences.append(self.worker.sequence))
+            reader.start()
+            reader.join(0.1)
+            self.readers.append(reader)
+        return events
+
+
+class PipelinedFlushTest(unittest.TestCase):
+
+    # ----------------------------------------------------------------------
+    def setUp(self):
+        self._saved = (constants.QUEUED_EVENTS_PIPELINE_DEPTH, constants.QUEUED_EVENTS_BATCH_SIZE)
+        constants.QUEUED_EVENTS_PIPELINE_DEPTH = 2
+        constants.QUEUED_EVENTS_BATCH_SIZE = 3
+
+    # ----------------------------------------------------------------------
+    def tearDown(self):
+        constants.QUEUED_EVENTS_PIPELINE_DEPTH, constants.QUEUED_EVENTS_BATCH_SIZE = self._saved
+
+    # ----------------------------------------------------------------------
+    def _create_worker(self, transport, cache):
+        return LogProcessingWorker(
+            host='localhost', port=5959, transport=transport, ssl_enable=False,
+            ssl_verify=True, keyfile=None, certfile=None, ca_certs=None, buffer=cache)
+
+    # ----------------------------------------------------------------------
+    def test_send_in_batches_on_shutdown(self):
+        transport = BatchRecordingTransport()
+        cache = MemoryCache({})
+        worker = self._create_worker(transport, cache)
+        worker.start()
+        for i in range(8):
+            worker.enqueue_event('event %d' % i)
+        worker.shutdown()
+        worker.join()
+        self.assertEqual([3, 3, 2], [len(batch) for batch in transport.batches])
+        sent = [event for batch in transport.batches for event in batch]
+        self.assertEqual(['event %d' % i for i in range(8)], sent)
+        self.assertEqual({}, cache._cache)
+        self.assertEqual(0, lookup(worker.get_stats(), 'batches_in_flight'))
+
+    # ----------------------------------------------------------------------
+    def test_failed_batch_is_requeued(self):
+        transport = BatchRecordingTransport(fail_first=1)
+        cache = MemoryCache({})
+        for i in range(3):
+            cache.add_event('event %d' % i)
+        worker = self._create_worker(transport, cache)
+        worker._reset_flush_counters()
+        worker._setup_logger()
+        worker._setup_pipeline()
+        try:
+            worker._flush_queued_events_pipelined(force=True)
+            worker._pipeline.wait(5)
+            # the failure is collected, no new batch is claimed until the next flush
+            self.assertFalse(worker._flush_queued_events_pipelined(force=True))
+            self.assertEqual(0, worker._pipeline.in_flight)
+            self.assertEqual(3, len(cache.get_queued_events()))
+        finally:
+            worker._stop_pipeline()
+
+
+class SendPipelineTest(unittest.TestCase):
+
+    # ----------------------------------------------------------------------
+    def test_depth(self):
+        release = Event()
+        pipeline = SendPipeline(lambda events: release.wait(5), depth=2)
+        pipeline.start()
+        pipeline.submit([{'event_text': 'a'}])
+        pipeline.submit([{'event_text': 'b'}])
+        self.assertFalse(pipeline.can_submit())
+        release.set()
+        results = []
+        while len(results) < 2:
+            pipeline.wait(5)
+            results.extend(pipeline.collect())
+        pipeline.stop()
+        self.assertEqual([None, None], [error for _, error in results])
+        self.assertTrue(pipeline.can_submit())
+
+
+class CircuitBreakerWorkerTest(unittest.TestCase):
+
+    # ----------------------------------------------------------------------
+    def setUp(self):
+        self._saved = constants.CIRCUIT_BREAKER_FAILURE_THRESHOLD
+        constants.CIRCUIT_BREAKER_FAILURE_THRESHOLD = 1
+
+    # ----------------------------------------------------------------------
+    def tearDown(self):
+        constants.CIRCUIT_BREAKER_FAILURE_THRESHOLD = self._saved
+
+    # ----------------------------------------------------------------------
+    def test_no_sends_while_open(self):
+        transport = BatchRecordingTransport(fail_first=1)
+        cache = MemoryCache({})
+        for i in range(3):
+            cache.add_event('event %d' % i)
+        worker = LogProcessingWorker(
+            host='localhost', port=5959, transport=transport, ssl_enable=False,
+            ssl_verify=True, keyfile=None, certfile=None, ca_certs=None, buffer=cache)
+        worker._reset_flush_counters()
+        worker._setup_logger()
+
+        worker._flush_queued_events(force=True)
+        self.assertEqual(1, lookup(worker.get_stats(), 'breaker_state'))
+        self.assertEqual(1, lookup(worker.get_stats(), 'breaker_trips_total'))
+        worker._flush_queued_events(force=True)
+        self.assertEqual([], transport.batches)
+
+        # half-open: a single event probes the server, then the rest follows
+        worker._circuit_breaker._retry_at = 0
+        worker._flush_queued_events(force=True)
+        self.assertEqual([['event 0']], transport.batches)
+        self.assertTrue(worker._flush_requested())
+        worker._flush_queued_events(force=True)
+        self.assertEqual([['event 0'], ['event 1', 'event 2']], transport.batches)
+        self.assertEqual(0, lookup(worker.get_stats(), 'breaker_state'))
+
+
+class PartialSendTest(unittest.TestCase):
+
+    # ----------------------------------------------------------------------
+    def test_only_unsent_events_are_requeued(self):
+        transport = PartialFailureTransport(sent=2)
+        cache = MemoryCache({})
+        for i in range(5):
+            cache.add_event('event %d' % i)
+        worker = LogProcessingWorker(
+            host='localhost', port=5959, transport=transport, ssl_enable=False,
+            ssl_verify=True, keyfile=None, certfile=None, ca_certs=None, buffer=cache)
+        worker._reset_flush_counters()
+        worker._setup_logger()
+        worker._flush_queued_events(force=True)
+        self.assertEqual(3, len(cache._cache))
+        worker._flush_queued_events(force=True)
+        self.assertEqual(['event %d' % i for i in range(5)], transport.events)
+
+    # ----------------------------------------------------------------------
+    def test_rejected_event_is_spooled(self):
+        transport = PartialFailureTransport(sent=2, error_class=RejectedEventError)
+        spool = RecordingSpool()
+        cache = MemoryCache({}, spool=spool)
+        for i in range(5):
+            cache.add_event('event %d' % i)
+        worker = LogProcessingWorker(
+            host='localhost', port=5959, transport=transport, ssl_enable=False,
+            ssl_verify=True, keyfile=None, certfile=None, ca_certs=None, buffer=cache)
+        worker._reset_flush_counters()
+        worker._setup_logger()
+        worker._flush_queued_events(force=True)
+        self.assertEqual([('event 2', 'rejected')], spool.events)
+        self.assertEqual(2, len(cache._cache))
+        # the server is reachable, so the circuit breaker stays closed
+        self.assertEqual(0, lookup(worker.get_stats(), 'breaker_state'))
+        worker._flush_queued_events(force=True)
+        self.assertEqual(['event 0', 'event 1', 'event 3', 'event 4'], transport.events)
+
+
+class AdaptiveFlushWorkerTest(unittest.TestCase):
+
+    # ----------------------------------------------------------------------
+    def _create_worker(self):
+        return LogProcessingWorker(
+            host='localhost', port=5959, transport=BatchRecordingTransport(), ssl_enable=False,
+            ssl_verify=True, keyfile=None, certfile=None, ca_certs=None, buffer=MemoryCache({}))
+
+    # ----------------------------------------------------------------------
+    def test_static_flush_parameters_in_stats(self):
+        stats = self._create_worker().get_stats()
+        self.assertEqual(constants.QUEUED_EVENTS_FLUSH_INTERVAL,
+                         lookup(stats, 'flush_interval_seconds'))
+        self.assertEqual(constants.QUEUED_EVENTS_FLUSH_COUNT, lookup(stats, 'flush_count'))
+
+    # ----------------------------------------------------------------------
+    def test_adaptive_flush_parameters_in_stats(self):
+        saved = constants.ADAPTIVE_FLUSH
+        constants.ADAPTIVE_FLUSH = True
+        try:
+            worker = self._create_worker()
+        finally:
+            constants.ADAPTIVE_FLUSH = saved
+        worker._flush_controller.interval = 2.5
+        worker._flush_controller.count = 1234
+        stats = worker.get_stats()
+        self.assertEqual(2.5, lookup(stats, 'flush_interval_seconds'))
+        self.assertEqual(1234, lookup(stats, 'flush_count'))
+        self.assertEqual(1234, worker._batch_size())
+
+
+class FakeClock(object):
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class MaintenanceTest(unittest.TestCase):
+
+    # ----------------------------------------------------------------------
+    def test_flush_interval_uses_clock(self):
+        clock = FakeClock()
+        transport = BatchRecordingTransport()
+        cache = MemoryCache({})
+        worker = LogProcessingWorker(
+            host='localhost', port=5959, transport=transport, ssl_enable=False,
+            ssl_verify=True, keyfile=None, certfile=None, ca_certs=None, buffer=cache,
+            clock=clock)
+        worker._reset_flush_counters()
+        worker._setup_logger()
+        cache.add_event('event')
+        self.assertEqual([], worker._scheduler.run_due())
+        clock.now = constants.QUEUED_EVENTS_FLUSH_INTERVAL
+        self.assertIn('flush', worker._scheduler.run_due())
+        self.assertEqual([['event']], transport.batches)
+        clock.now = constants.MAINTENANCE_VACUUM_INTERVAL
+        self.assertEqual(
+            ['flush', 'expire', 'stats', 'vacuum', 'spool'], worker._scheduler.run_due())
+
+
+class IngressQueueTest(unittest.TestCase):
+
+    # ----------------------------------------------------------------------
+    def test_batch_drain(self):
+        cache = MemoryCache({})
+        worker = LogProcessingWorker(
+            host='localhost', port=5959, transport=BatchRecordingTransport(), ssl_enable=False,
+            ssl_verify=True, keyfile=None, certfile=None, ca_certs=None, buffer=cache)
+        worker._reset_flush_counters()
+        for i in range(3):
+            worker.enqueue_event('event %d' % i)
+        self.assertEqual(3, worker.sequence)
+        worker._fetch_event()
+        # the whole queue was taken at once, the current event is retried first
+        self.assertEqual(0, worker._queue.qsize())
+        worker._requeue_event()
+        self.assertEqual(3, worker._queue_size())
+        for _ in range(3):
+            worker._fetch_event()
+            worker._process_event()
+        self.assertEqual(['event 0', 'event 1', 'event 2'],
+                         [event['event_text'] for event in cache.get_queued_events()])
+        self.assertEqual(3, lookup(worker.get_stats(), 'events_total'))
+
+    # ----------------------------------------------------------------------
+    def test_sequence_while_taking_batch(self):
+        queue = InterleavingQueue()
+        worker = LogProcessingWorker(
+            host='localhost', port=5959, transport=BatchRecordingTransport(), ssl_enable=False,
+            ssl_verify=True, keyfile=None, certfile=None, ca_certs=None, buffer=MemoryCache({}),
+            ingress_queue=queue)
+        queue.worker = worker
+        for i in range(3):
+            worker.enqueue_event('event %d' % i)
+        worker._fetch_event()
+        for reader in queue.readers:
+            reader.join(5)
+        # the events taken from the queue but not yet counted must not be missed
+        self.assertEqual([3], queue.sequences)
+        self.assertEqual(3, worker.sequence)
+
+
+class LatencyHistogramTest(unittest.TestCase):
+
+    # ----------------------------------------------------------------------
+    def test_histograms(self):
+        transport = BatchRecordingTransport()
+        worker = LogProcessingWorker(
+            host='localhost', port=5959, transport=transport, ssl_enable=False,
+            ssl_verify=True, keyfile=None, certfile=None, ca_certs=None,
+            buffer=MemoryCache({}))
+        worker.start()
+        worker.enqueue_event('event 1', created=time.time() - 2)
+        worker.enqueue_event('event 2', created=time.time())
+        worker.enqueue_event('forwarded event')
+        worker.shutdown()
+        worker.join()
+        self.assertEqual(3, len(transport.batches[0]))
+        stats = worker.get_stats()
+        self.assertEqual(3, lookup(stats, 'queue_wait_seconds_count'))
+        self.assertEqual(3, lookup(stats, 'cache_insert_seconds_count'))
+        self.assertEqual(1, lookup(stats, 'cache_claim_seconds_count'))
+        # only events with a creation time
+        self.assertEqual(2, lookup(stats, 'event_age_seconds_count'))
+        self.assertEqual(1, lookup(stats, 'event_age_seconds_bucket{le="1.0"}'))
+        self.assertGreaterEqual(lookup(stats, 'event_age_seconds_sum'), 2)
+
+
+class LegacyCacheTest(unittest.TestCase):
+
+    # ----------------------------------------------------------------------
+    def _create_worker(self, transport, cache):
+        worker = LogProcessingWorker(
+            host='localhost', port=5959, transport=transport, ssl_enable=False,
+            ssl_verify=True, keyfile=None, certfile=None, ca_certs=None, buffer=cache)
+        worker._reset_flush_counters()
+        worker._setup_logger()
+        return worker
+
+    # ----------------------------------------------------------------------
+    def test_get_queued_events_without_limit(self):
+        cache = LegacyCache()
+        for i in range(3):
+            cache.add_event('event %d' % i)
+        worker = self._create_worker(BatchRecordingTransport(), cache)
+        self.assertEqual(3, len(worker._get_queued_events(limit=1)))
+
+    # ----------------------------------------------------------------------
+    def test_add_event_without_created(self):
+        cache = LegacyCache()
+        transport = BatchRecordingTransport()
+        worker = self._create_worker(transport, cache)
+        worker.start()
+        worker.enqueue_event('event', created=time.time())
+        worker.shutdown()
+        worker.join(10)
+        self.assertEqual([['event']], transport.batches)
+        self.assertEqual(0, worker.pending)
+
+    # ----------------------------------------------------------------------
+    def test_partial_send_without_delete_events(self):
+        cache = LegacyCache()
+        for i in range(3):
+            cache.add_event('event %d' % i)
+        transport = PartialFailureTransport(sent=2)
+        worker = self._create_worker(transport, cache)
+        worker._flush_queued_events(force=True)
+        # the whole batch was requeued
+        self.assertEqual(['event %d' % i for i in range(3)], cache.events)
+        worker._flush_queued_events(force=True)
+        self.assertEqual([], cache.events)
+        self.assertEqual(['event 0', 'event 1', 'event 0', 'event 1', 'event 2'],
+                         transport.events)
+
+    # ----------------------------------------------------------------------
+    def test_pipeline_without_delete_events(self):
+        saved = constants.QUEUED_EVENTS_PIPELINE_DEPTH
+        constants.QUEUED_EVENTS_PIPELINE_DEPTH = 2
+        try:
+            cache = LegacyCache()
+            transport = BatchRecordingTransport()
+            worker = self._create_worker(transport, cache)
+            worker.start()
+            for i in range(3):
+                worker.enqueue_event('event %d' % i)
+            worker.shutdown()
+            worker.join(10)
+        finally:
+            constants.QUEUED_EVENTS_PIPELINE_DEPTH = saved
+        # sent without pipeline, the worker did not die on delete_events()
+        self.assertIsNone(worker._pipeline)
+        self.assertEqual([['event %d' % i for i in range(3)]], transport.batches)
+        self.assertEqual(0, worker.pending)
+
+
+class ConcurrentSenderTransport(object):
+    """Fails to send after another process sharing the database sent its events"""
+
+    def __init__(self, other_process):
+        self.other_process = other_process
+
+    def send(self, events):
+        self.other_process()
+        raise IOError('connection refused')
+
+    def close(self):
+        pass
+
+
+@unittest.skipUnless(hasattr(os, 'fork'), 'os.fork is not available')
+class SharedDatabaseTest(unittest.TestCase):
+
+    # ----------------------------------------------------------------------
+    def setUp(self):
+        self._directory = tempfile.mkdtemp()
+        self._path = os.path.join(self._directory, 'events.db')
+
+    # ----------------------------------------------------------------------
+    def tearDown(self):
+        shutil.rmtree(self._directory)
+
+    # ----------------------------------------------------------------------
+    def _create_worker(self, transport, cache):
+        worker = LogProcessingWorker(
+            host='localhost', port=5959, transport=transport, ssl_enable=False,
+            ssl_verify=True, keyfile=None, certfile=None, ca_certs=None, buffer=cache)
+        worker._reset_flush_counters()
+        worker._setup_logger()
+        return worker
+
+    # ----------------------------------------------------------------------
+    def _run_child(self):
+        pid = os.fork()
+        if pid == 0:
+            exit_code = 1
+            try:
+                cache = DatabaseCache(self._path)
+                cache.add_event('child')
+                transport = BatchRecordingTransport()
+                self._create_worker(transport, cache)._flush_queued_events(force=True)
+                exit_code = 0 if transport.batches == [['child']] else 2
+            finally:
+                os._exit(exit_code)
+        _, status = os.waitpid(pid, 0)
+        self.assertEqual(0, os.WEXITSTATUS(status))
+
+    # ----------------------------------------------------------------------
+    def test_failed_send_keeps_events(self):
+        cache = DatabaseCache(self._path)
+        cache.add_event('parent')
+        worker = self._create_worker(ConcurrentSenderTransport(self._run_child), cache)
+        # the child claims and deletes its events while the parent sends
+        worker._flush_queued_events(force=True)
+        events = cache.get_queued_events()
+        self.assertEqual(['parent'], [event['event_text'] for event in events])